@@ -0,0 +1,260 @@
+import urllib.parse
+import requests
+from packaging import version
+from app.config import Config
+from app.json_utils import loads
+
+def get_airbyte_workspace_id():
+    """
+    Get the first workspace ID using the new Airbyte API format.
+    New API: GET /v1/workspaces
+    """
+    url_base = Config.AIRBYTE_API_LINK
+    api_base = Config.AIRBYTE_API_BASE
+    api_version = "v1"
+    url = f"{url_base}/{api_base}/{api_version}/workspaces"
+    headers = {"accept": "application/json"}
+
+    try:
+        response = requests.get(url, headers=headers)
+        response.raise_for_status()  # Raise an exception for HTTP errors
+    except requests.exceptions.RequestException as e:
+        print(f"Error: {e}")
+        return None  # Return None if there's a connection error or HTTP error
+
+    try:
+        data = loads(response.content)
+        # New API returns data directly, not wrapped in "workspaces" key
+        workspaces = data.get("data", []) if isinstance(data, dict) else data
+        if workspaces and len(workspaces) > 0:
+            return workspaces[0]["workspaceId"]  # Assuming you want the ID of the first workspace
+    except ValueError as ve:
+        print(f"Error decoding JSON: {ve}")
+
+    return None  # Return None if the workspace ID is not found or if there's an error in decoding JSON
+
+
+def get_airbyte_destination_image(destination_definition_id, workspace_id):
+    """
+    Fetch the docker image tag for a given Airbyte destination_definition_id.
+    New API: GET /v1/workspaces/{workspaceId}/definitions/destinations/{definitionId}
+
+    Args:
+        destination_definition_id: The destination definition ID
+        workspace_id: The workspace ID (required for new API)
+
+    Returns:
+        dict: The destination definition data if successful, None otherwise.
+    """
+    if not workspace_id:
+        print("Error: workspace_id is required for new Airbyte API")
+        return None
+        
+    url_base = Config.AIRBYTE_API_LINK
+    api_base = Config.AIRBYTE_API_BASE
+    api_version = "v1"
+    url = f"{url_base}/{api_base}/{api_version}/workspaces/{workspace_id}/definitions/destinations/{destination_definition_id}"
+    headers = {"accept": "application/json"}
+
+    try:
+        response = requests.get(url, headers=headers)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching destination image: {e}")
+        return None
+
+    if response.status_code == 200:
+        return loads(response.content)
+    return None
+
+
+def get_airbyte_destination_type(destination_id, workspace_id):
+    """
+    Determine the type of Airbyte destination based on docker_image_tag.
+
+    Args:
+        destination_id: The destination ID
+        workspace_id: The workspace ID (required for new API)
+
+    Returns:
+        tuple: (bigquery_version, destination_name, dwh_type) or (None, None, None)
+    """
+    if destination_id is None:
+        return None, None, None
+
+    url_base = Config.AIRBYTE_API_LINK
+    api_base = Config.AIRBYTE_API_BASE
+    api_version = "v1"
+    url = f"{url_base}/{api_base}/{api_version}/destinations/{destination_id}"
+    headers = {"accept": "application/json"}
+
+    try:
+        response = requests.get(url, headers=headers)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching destination type: {e}")
+        return None, None, None
+
+    if response.status_code == 200:
+        destination_details = loads(response.content)
+        destination_definition_id = destination_details.get("definitionId", "")
+        # Get the destination name from destination details (this is the instance name like "BigQuery_Xxi_Destination")
+        destination_instance_name = destination_details.get("name", "")
+        
+        # Get destination definition data to get the proper destination name (like "BigQuery")
+        image_api = get_airbyte_destination_image(destination_definition_id, workspace_id)
+        docker_image_tag = image_api.get("dockerImageTag", "") if image_api else ""
+        docker_repo = image_api.get("dockerRepository", "") if image_api else ""
+        # Get the proper destination name from the definition
+        destination_name = image_api.get("name", "") if image_api else ""
+        
+        dwh_type = None
+        if docker_repo == 'airbyte/destination-bigquery':
+            dwh_type = 'bigquery'
+        elif docker_repo == 'airbyte/destination-snowflake':
+            dwh_type = 'snowflake'
+        elif docker_repo == 'airbyte/destination-redshift':
+            dwh_type = 'redshift'
+        elif docker_repo == 'airbyte/destination-fabric':
+            dwh_type = 'fabric'
+
+        bigquery_version = None
+        if docker_image_tag:
+            parsed_docker_image_tag = version.parse(docker_image_tag)
+            last_v1_docker_image_tag = version.parse('1.10.2')  # last possible version for v1 destination Bigquery
+            if parsed_docker_image_tag > last_v1_docker_image_tag:
+                bigquery_version = 2
+            else:
+                bigquery_version = 1
+        return bigquery_version, destination_name, dwh_type
+    return None, None, None
+
+
+def get_airbyte_connections(workspace_id):
+    """
+    Get all connections using the new Airbyte API format.
+    New API: GET /v1/connections
+    Handles pagination to fetch all connections, not just the first page.
+    """
+    if workspace_id is None:
+        return {
+            "None - Basic dbt Labs Project Initialization": {
+                "connection": "None",
+                "destination_version": "None",
+                "destination_name": "None",
+                "destination_type": "None"
+            }
+        }
+
+    url_base = Config.AIRBYTE_API_LINK
+    api_base = Config.AIRBYTE_API_BASE
+    api_version = "v1"
+    base_url = f"{url_base}/{api_base}/{api_version}/connections"
+    headers = {"accept": "application/json"}
+
+    result = {
+        "None - Basic dbt Labs Project Initialization": {
+            "connection": "None",
+            "destination_version": "None",
+            "destination_name": "None",
+            "destination_type": "None"
+        }
+    }
+
+    # Pagination parameters
+    limit = 100  # Request up to 100 items per page
+    offset = 0
+    has_more = True
+
+    while has_more:
+        # Build URL with pagination parameters
+        params = {
+            "limit": limit,
+            "offset": offset
+        }
+        url = f"{base_url}?{urllib.parse.urlencode(params)}"
+
+        try:
+            response = requests.get(url, headers=headers)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching Airbyte connections: {e}")
+            # If this is the first page and it fails, return the default "None" option
+            if offset == 0:
+                return {
+                    "None - Basic dbt Labs Project Initialization": {
+                        "connection": "None",
+                        "destination_version": "None",
+                        "destination_name": "None",
+                        "destination_type": "None"
+                    }
+                }
+            # If a subsequent page fails, break and return what we have
+            break
+
+        if response.status_code == 200:
+            response_json = loads(response.content)
+            # New API returns data in a "data" array
+            connections_data = response_json.get("data", [])
+            
+            # Process connections from this page
+            for connection in connections_data:
+                connection_id = connection.get("connectionId")
+                destination_id = connection.get("destinationId")
+                init_version, destination_name, dwh_type = get_airbyte_destination_type(destination_id, workspace_id)
+                name = connection.get("name")
+
+                result[name] = {
+                    "connection": connection_id,
+                    "destination_id": destination_id,  # Store the destination ID for later use
+                    "destination_version": init_version,
+                    "destination_name": destination_name,
+                    "destination_type": dwh_type
+                }
+
+            # Check if there are more pages
+            # Airbyte API v1 returns pagination info in a "next" field with a URL
+            # Priority: Check "next" field first (most reliable indicator)
+            
+            next_url = response_json.get("next")
+            pagination = response_json.get("pagination", {})
+            has_more_pagination = pagination.get("hasMore", False)
+            
+            # If there's a "next" URL, there are more pages - extract offset from it
+            if next_url:
+                # Extract offset from next URL (e.g., "http://...?limit=20&offset=20")
+                if isinstance(next_url, str) and "offset" in next_url:
+                    try:
+                        parsed = urllib.parse.urlparse(next_url)
+                        query_params = urllib.parse.parse_qs(parsed.query)
+                        offset = int(query_params.get("offset", [offset + limit])[0])
+                        # Note: API may enforce its own limit (e.g., 20), but we keep our requested limit
+                        # The offset extraction ensures we continue from the correct position
+                    except (ValueError, KeyError, IndexError) as e:
+                        print(f"Warning: Could not parse offset from next URL: {e}")
+                        offset += limit
+                else:
+                    # If next is a simple token/number, increment offset
+                    offset += limit
+            # If pagination object indicates more pages
+            elif has_more_pagination:
+                offset += limit
+            # If we got fewer items than requested, we've reached the last page
+            elif len(connections_data) < limit:
+                has_more = False
+            # If we got exactly the limit, there might be more, so continue
+            elif len(connections_data) == limit:
+                offset += limit
+                # Safety check: prevent infinite loops by setting a maximum offset
+                # Assuming reasonable maximum of 10,000 connections (100 pages * 100 items)
+                if offset > 10000:
+                    print("Warning: Reached maximum pagination limit (10,000 connections). Some connections may be missing.")
+                    has_more = False
+            else:
+                # No more pages
+                has_more = False
+        else:
+            # Non-200 status, stop pagination
+            has_more = False
+
+    return result
@@ -24,12 +24,18 @@ from flask_session import Session
 from flask_mail import Mail
 from flask_caching import Cache
 from app.config import Config, SourceConfig
+from app.json_utils import OrjsonProvider, loads
 from app.classes import User, CustomUser
 from app.user_console_db import UserConsoleMetadataHandler
 from packaging import version
-from concurrent.futures import ThreadPoolExecutor
 
 import app.dbt_project_management as dpm
+from app.airbyte_connections import get_airbyte_workspace_id, get_airbyte_connections
+from app.monitoring_alerts import get_alert_summary
+from app.beat_leader import get_beat_leader
+from app.datawarehouse_stats.adapters import get_warehouse_labels
+from app.datawarehouse_stats.stats_metrics import get_console_query_costs, get_default_window, get_dwh_stats, get_stats_progress
+from app.datawarehouse_stats.query_metrics import get_query_timings
 
 import random
 
@@ -65,6 +71,8 @@ else:
 app = Flask(__name__, template_folder=template_dir, static_url_path="/", static_folder=template_dir )
 # Get app Configuration
 app.config.from_object(Config)
+# orjson backed jsonify / request.get_json
+app.json = OrjsonProvider(app)
 # Set Database configuration
 db_config = {
     'dbname': app.config['DB_NAME'],
@@ -87,345 +95,6 @@ app.user_metadata_handler = user_metadata_handler
 # Configure caching with Redis using parameters from Config
 app.cache = Cache(app)
 
-def get_bq_stats():
-    # Import bigquery_stats only when needed
-    import app.datawarehouse_stats.bigquery_stats as bq
-    with ThreadPoolExecutor() as executor:
-        futures = {
-            # cards
-            'dataset_count': executor.submit(bq.get_dataset_count),
-            'total_query_executed': executor.submit(bq.get_total_query_executed),
-            'table_count': executor.submit(bq.get_table_count),
-            'avg_execution_time_seconds': executor.submit(bq.get_avg_execution_time_seconds),
-            'failure_rate_percentage': executor.submit(bq.get_failure_rate_percentage),
-            # charts
-            'query_cost_by_months_chart': executor.submit(bq.get_query_cost_by_month),
-            'query_cost_by_days_chart': executor.submit(bq.get_query_cost_for_last_30_days),
-            # tables
-            'total_cost_gb_by_users': executor.submit(bq.get_total_cost_gb_by_users),
-            'total_cost_gb_by_table': executor.submit(bq.get_total_cost_gb_by_table)
-        }
-        results = {key: future.result() for key, future in futures.items()}
-    return results
-
-def get_sf_stats():
-    # Import snowflake_stats only when needed
-    import app.datawarehouse_stats.snowflake_stats as sf
-    with ThreadPoolExecutor() as executor:
-        futures = {
-            # cards
-            'dataset_count': executor.submit(sf.get_dataset_count),
-            'total_query_executed': executor.submit(sf.get_total_query_executed),
-            'table_count': executor.submit(sf.get_table_count),
-            'avg_execution_time_seconds': executor.submit(sf.get_avg_execution_time_seconds),
-            'failure_rate_percentage': executor.submit(sf.get_failure_rate_percentage),
-            # charts
-            'query_cost_by_months_chart': executor.submit(sf.get_query_cost_by_month),
-            'query_cost_by_days_chart': executor.submit(sf.get_query_cost_for_last_30_days),
-            # tables
-            'total_cost_gb_by_users': executor.submit(sf.get_total_cost_gb_by_users),
-            'total_cost_gb_by_table': executor.submit(sf.get_total_cost_gb_by_table)
-        }
-        results = {key: future.result() for key, future in futures.items()}
-    return results
-
-def get_rd_stats():
-    # Import redshift_stats only when needed
-    import app.datawarehouse_stats.redshift_stats as rd
-    with ThreadPoolExecutor() as executor:
-        futures = {
-            # cards
-            'dataset_count': executor.submit(rd.get_dataset_count),
-            'total_query_executed': executor.submit(rd.get_total_query_executed),
-            'table_count': executor.submit(rd.get_table_count),
-            'avg_execution_time_seconds': executor.submit(rd.get_avg_execution_time_seconds),
-            'failure_rate_percentage': executor.submit(rd.get_failure_rate_percentage),
-            # charts
-            'query_cost_by_months_chart': executor.submit(rd.get_query_cost_by_month),
-            'query_cost_by_days_chart': executor.submit(rd.get_query_cost_for_last_30_days),
-            # tables
-            'total_cost_gb_by_users': executor.submit(rd.get_total_cost_gb_by_users),
-            'total_cost_gb_by_table': executor.submit(rd.get_total_cost_gb_by_table)
-        }
-        results = {key: future.result() for key, future in futures.items()}
-    return results
-
-def get_ft_stats():
-    # Import fabric_stats only when needed
-    import app.datawarehouse_stats.fabric_stats as ft
-    with ThreadPoolExecutor() as executor:
-        futures = {
-            # cards
-            'dataset_count': executor.submit(ft.get_dataset_count),
-            'total_query_executed': executor.submit(ft.get_total_query_executed),
-            'table_count': executor.submit(ft.get_table_count),
-            'avg_execution_time_seconds': executor.submit(ft.get_avg_execution_time_seconds),
-            'failure_rate_percentage': executor.submit(ft.get_failure_rate_percentage),
-            # charts
-            'query_cost_by_months_chart': executor.submit(ft.get_query_cost_by_month),
-            'query_cost_by_days_chart': executor.submit(ft.get_query_cost_for_last_30_days),
-            # tables
-            'total_cost_gb_by_users': executor.submit(ft.get_total_cost_gb_by_users),
-            'total_cost_gb_by_table': executor.submit(ft.get_total_cost_gb_by_table)
-        }
-        results = {key: future.result() for key, future in futures.items()}
-    return results
-
-def get_airbyte_workspace_id():
-    """
-    Get the first workspace ID using the new Airbyte API format.
-    New API: GET /v1/workspaces
-    """
-    url_base = app.config['AIRBYTE_API_LINK']
-    api_base = app.config['AIRBYTE_API_BASE']
-    api_version = "v1"
-    url = f"{url_base}/{api_base}/{api_version}/workspaces"
-    headers = {"accept": "application/json"}
-
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()  # Raise an exception for HTTP errors
-    except requests.exceptions.RequestException as e:
-        print(f"Error: {e}")
-        return None  # Return None if there's a connection error or HTTP error
-
-    try:
-        data = response.json()
-        # New API returns data directly, not wrapped in "workspaces" key
-        workspaces = data.get("data", []) if isinstance(data, dict) else data
-        if workspaces and len(workspaces) > 0:
-            return workspaces[0]["workspaceId"]  # Assuming you want the ID of the first workspace
-    except ValueError as ve:
-        print(f"Error decoding JSON: {ve}")
-
-    return None  # Return None if the workspace ID is not found or if there's an error in decoding JSON
-
-
-def get_airbyte_destination_image(destination_definition_id, workspace_id):
-    """
-    Fetch the docker image tag for a given Airbyte destination_definition_id.
-    New API: GET /v1/workspaces/{workspaceId}/definitions/destinations/{definitionId}
-
-    Args:
-        destination_definition_id: The destination definition ID
-        workspace_id: The workspace ID (required for new API)
-
-    Returns:
-        dict: The destination definition data if successful, None otherwise.
-    """
-    if not workspace_id:
-        print("Error: workspace_id is required for new Airbyte API")
-        return None
-        
-    url_base = app.config['AIRBYTE_API_LINK']
-    api_base = app.config['AIRBYTE_API_BASE']
-    api_version = "v1"
-    url = f"{url_base}/{api_base}/{api_version}/workspaces/{workspace_id}/definitions/destinations/{destination_definition_id}"
-    headers = {"accept": "application/json"}
-
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching destination image: {e}")
-        return None
-
-    if response.status_code == 200:
-        return response.json()
-    return None
-
-
-def get_airbyte_destination_type(destination_id, workspace_id):
-    """
-    Determine the type of Airbyte destination based on docker_image_tag.
-
-    Args:
-        destination_id: The destination ID
-        workspace_id: The workspace ID (required for new API)
-
-    Returns:
-        tuple: (bigquery_version, destination_name, dwh_type) or (None, None, None)
-    """
-    if destination_id is None:
-        return None, None, None
-
-    url_base = app.config['AIRBYTE_API_LINK']
-    api_base = app.config['AIRBYTE_API_BASE']
-    api_version = "v1"
-    url = f"{url_base}/{api_base}/{api_version}/destinations/{destination_id}"
-    headers = {"accept": "application/json"}
-
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching destination type: {e}")
-        return None, None, None
-
-    if response.status_code == 200:
-        destination_details = response.json()
-        destination_definition_id = destination_details.get("definitionId", "")
-        # Get the destination name from destination details (this is the instance name like "BigQuery_Xxi_Destination")
-        destination_instance_name = destination_details.get("name", "")
-        
-        # Get destination definition data to get the proper destination name (like "BigQuery")
-        image_api = get_airbyte_destination_image(destination_definition_id, workspace_id)
-        docker_image_tag = image_api.get("dockerImageTag", "") if image_api else ""
-        docker_repo = image_api.get("dockerRepository", "") if image_api else ""
-        # Get the proper destination name from the definition
-        destination_name = image_api.get("name", "") if image_api else ""
-        
-        dwh_type = None
-        if docker_repo == 'airbyte/destination-bigquery':
-            dwh_type = 'bigquery'
-        elif docker_repo == 'airbyte/destination-snowflake':
-            dwh_type = 'snowflake'
-        elif docker_repo == 'airbyte/destination-redshift':
-            dwh_type = 'redshift'
-        elif docker_repo == 'airbyte/destination-fabric':
-            dwh_type = 'fabric'
-
-        bigquery_version = None
-        if docker_image_tag:
-            parsed_docker_image_tag = version.parse(docker_image_tag)
-            last_v1_docker_image_tag = version.parse('1.10.2')  # last possible version for v1 destination Bigquery
-            if parsed_docker_image_tag > last_v1_docker_image_tag:
-                bigquery_version = 2
-            else:
-                bigquery_version = 1
-        return bigquery_version, destination_name, dwh_type
-    return None, None, None
-
-
-def get_airbyte_connections(workspace_id):
-    """
-    Get all connections using the new Airbyte API format.
-    New API: GET /v1/connections
-    Handles pagination to fetch all connections, not just the first page.
-    """
-    if workspace_id is None:
-        return {
-            "None - Basic dbt Labs Project Initialization": {
-                "connection": "None",
-                "destination_version": "None",
-                "destination_name": "None",
-                "destination_type": "None"
-            }
-        }
-
-    url_base = app.config['AIRBYTE_API_LINK']
-    api_base = app.config['AIRBYTE_API_BASE']
-    api_version = "v1"
-    base_url = f"{url_base}/{api_base}/{api_version}/connections"
-    headers = {"accept": "application/json"}
-
-    result = {
-        "None - Basic dbt Labs Project Initialization": {
-            "connection": "None",
-            "destination_version": "None",
-            "destination_name": "None",
-            "destination_type": "None"
-        }
-    }
-
-    # Pagination parameters
-    limit = 100  # Request up to 100 items per page
-    offset = 0
-    has_more = True
-
-    while has_more:
-        # Build URL with pagination parameters
-        params = {
-            "limit": limit,
-            "offset": offset
-        }
-        url = f"{base_url}?{urllib.parse.urlencode(params)}"
-
-        try:
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching Airbyte connections: {e}")
-            # If this is the first page and it fails, return the default "None" option
-            if offset == 0:
-                return {
-                    "None - Basic dbt Labs Project Initialization": {
-                        "connection": "None",
-                        "destination_version": "None",
-                        "destination_name": "None",
-                        "destination_type": "None"
-                    }
-                }
-            # If a subsequent page fails, break and return what we have
-            break
-
-        if response.status_code == 200:
-            response_json = response.json()
-            # New API returns data in a "data" array
-            connections_data = response_json.get("data", [])
-            
-            # Process connections from this page
-            for connection in connections_data:
-                connection_id = connection.get("connectionId")
-                destination_id = connection.get("destinationId")
-                init_version, destination_name, dwh_type = get_airbyte_destination_type(destination_id, workspace_id)
-                name = connection.get("name")
-
-                result[name] = {
-                    "connection": connection_id,
-                    "destination_id": destination_id,  # Store the destination ID for later use
-                    "destination_version": init_version,
-                    "destination_name": destination_name,
-                    "destination_type": dwh_type
-                }
-
-            # Check if there are more pages
-            # Airbyte API v1 returns pagination info in a "next" field with a URL
-            # Priority: Check "next" field first (most reliable indicator)
-            
-            next_url = response_json.get("next")
-            pagination = response_json.get("pagination", {})
-            has_more_pagination = pagination.get("hasMore", False)
-            
-            # If there's a "next" URL, there are more pages - extract offset from it
-            if next_url:
-                # Extract offset from next URL (e.g., "http://...?limit=20&offset=20")
-                if isinstance(next_url, str) and "offset" in next_url:
-                    try:
-                        parsed = urllib.parse.urlparse(next_url)
-                        query_params = urllib.parse.parse_qs(parsed.query)
-                        offset = int(query_params.get("offset", [offset + limit])[0])
-                        # Note: API may enforce its own limit (e.g., 20), but we keep our requested limit
-                        # The offset extraction ensures we continue from the correct position
-                    except (ValueError, KeyError, IndexError) as e:
-                        print(f"Warning: Could not parse offset from next URL: {e}")
-                        offset += limit
-                else:
-                    # If next is a simple token/number, increment offset
-                    offset += limit
-            # If pagination object indicates more pages
-            elif has_more_pagination:
-                offset += limit
-            # If we got fewer items than requested, we've reached the last page
-            elif len(connections_data) < limit:
-                has_more = False
-            # If we got exactly the limit, there might be more, so continue
-            elif len(connections_data) == limit:
-                offset += limit
-                # Safety check: prevent infinite loops by setting a maximum offset
-                # Assuming reasonable maximum of 10,000 connections (100 pages * 100 items)
-                if offset > 10000:
-                    print("Warning: Reached maximum pagination limit (10,000 connections). Some connections may be missing.")
-                    has_more = False
-            else:
-                # No more pages
-                has_more = False
-        else:
-            # Non-200 status, stop pagination
-            has_more = False
-
-    return result
-
 def get_jwt_token(user_name, user_email):
     key_path = app.config['GRAFANA_JWT_KEY_PATH']
 
@@ -622,6 +291,19 @@ def health():
     print(response.headers)  # Check if CORS headers are present
     return response
 
+# Readiness page route
+@app.route("/ready")
+def ready():
+    warmup_status = app.cache.get('cache_warmup_status')
+    try:
+        beat_leader = get_beat_leader()
+    except Exception as e:
+        logging.error(f"Error reading beat leader: {e}")
+        beat_leader = None
+    if app.config['CACHE_WARMUP_READINESS_WAIT'] and (warmup_status is None or warmup_status.get('state') != 'completed'):
+        return jsonify({"ready": False, "cache_warmup": warmup_status, "beat_leader": beat_leader}), 503
+    return jsonify({"ready": True, "cache_warmup": warmup_status, "beat_leader": beat_leader})
+
 # User profile route
 @app.route('/profile')
 def user_profile():
@@ -733,35 +415,19 @@ def homepage():
             iframe_mode = user_data['iframe_mode']
             light_dark_mode = user_data['light_dark_mode']
 
-            env_variables = SourceConfig.get_environment_variables()
-            monitoring_link = env_variables.get('monitoring_link')
-            monitoring_basic_auth_user = env_variables.get('monitoring_basic_auth_user')
-            monitoring_basic_auth_pass = env_variables.get('monitoring_basic_auth_pass')
-            grafana_url = f"{monitoring_link}/api/prometheus/grafana/api/v1/alerts?includeInternalLabels=false"
             try:
-                response = requests.get(grafana_url, headers={'accept': 'application/json'}, auth=(monitoring_basic_auth_user, monitoring_basic_auth_pass))
-                if response.status_code == 200:
-                    alert_data = response.json()
-                    alerts = alert_data['data']['alerts']
-                    alert_amount = len(alerts)
-                    # Treat both 'Normal' and 'Normal (NoData)' as normal
-                    normal_alerts = [alert for alert in alerts if alert['state'] == 'Normal' or alert['state'] == 'Normal (NoData)']
-                    non_normal_alerts = [alert for alert in alerts if alert['state'] != 'Normal' and alert['state'] != 'Normal (NoData)']
-                    error_alerts = [alert for alert in non_normal_alerts if alert['state'] == 'Error']
-                    alerts_count_errors = len(error_alerts)
-                    error_dates = [datetime.fromisoformat(alert['activeAt'][:-1]) for alert in error_alerts]
-                    non_normal_dates = [datetime.fromisoformat(alert['activeAt'][:-1]) for alert in non_normal_alerts]
-                    normal_dates = [datetime.fromisoformat(alert['activeAt'][:-1]) for alert in normal_alerts]
-
-                    oldest_error_date = min(error_dates) if error_dates else None
-                    latest_non_normal_date = max(non_normal_dates) if non_normal_dates else None
-                    latest_normal_date = max(normal_dates) if normal_dates else None
-
+                # Alert summary is shared between users and pre-filled by the cache warm-up
+                alert_summary = app.cache.get('grafana_alert_summary')
+                if alert_summary is None:
+                    alert_summary = get_alert_summary()
+                    if alert_summary is not None:
+                        app.cache.set('grafana_alert_summary', alert_summary, timeout=app.config['ALERT_SUMMARY_CACHE_TIMEOUT'])
+                if alert_summary is not None:
                     auth_token = get_jwt_token(user_data['username'], user_data['email'])
-                    return render_template('home.html', auth_token=auth_token, user_id=current_user.id, current_user=current_user, user_name=user_data['username'], user_email=user_data['email'], follow_mode=follow_mode, iframe_mode=iframe_mode, welcome_message=welcome_message_js, light_dark_mode=light_dark_mode, alert_amount=alert_amount, non_normal_alerts=len(non_normal_alerts), alerts_count_errors=alerts_count_errors, oldest_error_date=oldest_error_date, latest_non_normal_date=latest_non_normal_date, latest_normal_date=latest_normal_date, now=now, today=today_str, this_month_start=this_month_start,  **SourceConfig.get_environment_variables())
+                    return render_template('home.html', auth_token=auth_token, user_id=current_user.id, current_user=current_user, user_name=user_data['username'], user_email=user_data['email'], follow_mode=follow_mode, iframe_mode=iframe_mode, welcome_message=welcome_message_js, light_dark_mode=light_dark_mode, now=now, today=today_str, this_month_start=this_month_start, **alert_summary, **SourceConfig.get_environment_variables())
                 else:
                     return render_template('500.html', error_message="Failed to fetch alert statistics from Grafana.")
-            except requests.exceptions.RequestException as e:
+            except (requests.exceptions.RequestException, ValueError) as e:
                 return render_template('500.html')
         return redirect(url_for('index'))
     return get_homepage()
@@ -791,8 +457,18 @@ def dbt_init():
             if mandatory_group in user_groups and not user_groups.isdisjoint(role_based_groups):
                 # The user has one of the required groups, proceed with rendering
                 # Assuming you have airbyte_workspace_id and airbyte_connections variables available
-                airbyte_workspace_id = get_airbyte_workspace_id()  # Function to get airbyte workspace ID
-                airbyte_obj = json.dumps(get_airbyte_connections(airbyte_workspace_id))
+                # Connection map is shared between users and pre-filled by the cache warm-up
+                airbyte_cache = app.cache.get('airbyte_connections')
+                if airbyte_cache is None:
+                    airbyte_workspace_id = get_airbyte_workspace_id()  # Function to get airbyte workspace ID
+                    airbyte_cache = {
+                        'workspace_id': airbyte_workspace_id,
+                        'connections': get_airbyte_connections(airbyte_workspace_id)
+                    }
+                    if airbyte_workspace_id is not None:
+                        app.cache.set('airbyte_connections', airbyte_cache, timeout=app.config['AIRBYTE_CONNECTIONS_CACHE_TIMEOUT'])
+                airbyte_workspace_id = airbyte_cache['workspace_id']
+                airbyte_obj = json.dumps(airbyte_cache['connections'])
                 return render_template('dbt-project-initialization.html',
                                     current_user=current_user,
                                     user_name=user_data['username'],
@@ -854,7 +530,12 @@ def dbt_management():
         # Check for mandatory group membership and at least one of the role-based groups
         if mandatory_group in user_groups and not user_groups.isdisjoint(role_based_groups):
             # The user has the mandatory group and one of the required role-based groups, proceed with rendering
-            dbt_projects = dpm.get_dbt_projects()
+            # Project list is shared between users and pre-filled by the cache warm-up
+            dbt_projects = app.cache.get('dbt_projects')
+            if dbt_projects is None:
+                dbt_projects = dpm.get_dbt_projects()
+                if dbt_projects is not None:
+                    app.cache.set('dbt_projects', dbt_projects, timeout=app.config['DBT_PROJECTS_CACHE_TIMEOUT'])
             return render_template('dbt-project-management.html', 
                                 dbt_projects=dbt_projects, 
                                 current_user=current_user, 
@@ -896,18 +577,19 @@ def stats():
             mandatory_group = '/Data Platform Services/Data_Platform_Stats'
             role_based_groups = {'Admin', 'User', 'Viewer'}
 
-            # Check global cache first
-            stats_data = app.cache.get('global_stats')
-            if stats_data is None:
-                # If global cache is empty, fetch stats based on data warehouse type
-                if app.config['FASTBI_PLATFORM_DWH'] == 'bigquery':
-                    stats_data = get_bq_stats()
-                elif app.config['FASTBI_PLATFORM_DWH'] == 'snowflake':
-                    stats_data = get_sf_stats()
-                elif app.config['FASTBI_PLATFORM_DWH'] == 'redshift':
-                    stats_data = get_rd_stats()
-                elif app.config['FASTBI_PLATFORM_DWH'] == 'fabric':
-                    stats_data = get_ft_stats()
+            # Selected warehouse, the first configured one by default
+            dwh_types = app.config['FASTBI_PLATFORM_DWH_LIST']
+            dwh_type = request.args.get('dwh', dwh_types[0])
+            if dwh_type not in dwh_types:
+                dwh_type = dwh_types[0]
+
+            # Selected creation_time window, only offered where the warehouse supports one
+            window_days = get_default_window(dwh_type)
+            if window_days and request.args.get('window', type=int) in app.config['STATS_WINDOW_OPTIONS']:
+                window_days = request.args.get('window', type=int)
+
+            # Render from cache only, missing metrics are filled in by the page via /stats/data
+            stats_data, stats_freshness = get_dwh_stats(app.cache, dwh_type, window_days)
 
             if mandatory_group in user_groups and not user_groups.isdisjoint(role_based_groups):
                 return render_template('stats.html',
@@ -917,6 +599,12 @@ def stats():
                     follow_mode=follow_mode,
                     iframe_mode=iframe_mode,
                     light_dark_mode=light_dark_mode,
+                    stats_freshness=stats_freshness,
+                    dwh_type=dwh_type,
+                    dwh_types=dwh_types,
+                    dwh_labels=get_warehouse_labels(),
+                    window_days=window_days,
+                    window_options=app.config['STATS_WINDOW_OPTIONS'],
                     **stats_data,
                     **SourceConfig.get_environment_variables()
                 )
@@ -933,6 +621,67 @@ def stats():
     else:
         return redirect(url_for('index'))
 
+# Platform Stats data, polled by stats.html until every metric is cached
+@app.route('/stats/data')
+def stats_progress():
+    if not oidc.user_loggedin:
+        return jsonify({"error": "Authentication required"}), 401
+
+    user_info = oidc.user_getinfo(['groups'])
+    user_groups = set(user_info.get('groups', []))
+    mandatory_group = '/Data Platform Services/Data_Platform_Stats'
+    role_based_groups = {'Admin', 'User', 'Viewer'}
+    if mandatory_group not in user_groups or user_groups.isdisjoint(role_based_groups):
+        return jsonify({"error": "Access denied"}), 403
+
+    dwh_type = request.args.get('dwh', app.config['FASTBI_PLATFORM_DWH'])
+    if dwh_type not in app.config['FASTBI_PLATFORM_DWH_LIST']:
+        return jsonify({"error": f"Data warehouse {dwh_type} is not configured"}), 404
+
+    window_days = request.args.get('window', type=int)
+    if window_days is not None and window_days not in app.config['STATS_WINDOW_OPTIONS']:
+        return jsonify({"error": f"Unsupported window: {window_days} days"}), 400
+
+    try:
+        return jsonify(get_stats_progress(app.cache, dwh_type, window_days))
+    except Exception as e:
+        logging.error(f"Error getting stats progress: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/stats/costs')
+def stats_query_costs():
+    if not oidc.user_loggedin:
+        return jsonify({"error": "Authentication required"}), 401
+
+    user_info = oidc.user_getinfo(['groups'])
+    user_groups = set(user_info.get('groups', []))
+    mandatory_group = '/Data Platform Services/Data_Platform_Stats'
+    if mandatory_group not in user_groups or 'Admin' not in user_groups:
+        return jsonify({"error": "Access denied"}), 403
+
+    dwh_type = request.args.get('dwh', app.config['FASTBI_PLATFORM_DWH'])
+    if dwh_type not in app.config['FASTBI_PLATFORM_DWH_LIST']:
+        return jsonify({"error": f"Data warehouse {dwh_type} is not configured"}), 404
+    days = min(max(request.args.get('days', 1, type=int), 1), 30)
+
+    try:
+        payload = {
+            'dwh_type': dwh_type,
+            'days': days,
+            'costs': get_console_query_costs(dwh_type, days),
+            # Elapsed time of the console's tagged statements, as recorded by the workers
+            'query_timings': get_query_timings(dwh_type).get(dwh_type, {})
+        }
+        if dwh_type == 'bigquery':
+            # Import bigquery_stats only when needed
+            from app.datawarehouse_stats.bigquery_stats import get_query_cache_stats
+            # Result cache hits per stats query, counted by every worker
+            payload['query_cache_hits'] = get_query_cache_stats()
+        return jsonify(payload)
+    except Exception as e:
+        logging.error(f"Error getting console query costs: {e}")
+        return jsonify({"error": str(e)}), 500
+
 ### Platform external Services
 
 # Data Manipulation (ide console) route
@@ -1365,7 +1114,7 @@ def data_catalog():
                 response = requests.get(url, headers=headers)
                 if response.status_code == 500:
                     return render_template('500.html', error_message="Failed to fetch data catalog projects. Please try again later.", current_user=current_user, user_name=user_data['username'], user_email=user_data['email'], follow_mode=follow_mode, iframe_mode=iframe_mode, light_dark_mode=light_dark_mode, **SourceConfig.get_environment_variables())
-                projects = response.json()
+                projects = loads(response.content)
                 if not user_groups.isdisjoint(action_toggle_status):
                     action_toggle_status_enable=True
                 if not user_groups.isdisjoint(action_delete):
@@ -1412,7 +1161,7 @@ def data_catalog_live(partial_url):
                 response = requests.get(projects_url, headers=headers)
                 if response.status_code == 500:
                     return render_template('500.html', error_message="Failed to fetch data catalog projects. Please try again later.", current_user=current_user, user_name=user_data['username'], user_email=user_data['email'], follow_mode=follow_mode, iframe_mode=iframe_mode, light_dark_mode=light_dark_mode, **SourceConfig.get_environment_variables())
-                projects = response.json()
+                projects = loads(response.content)
                 url = 'https://' + unquote(partial_url)
 
                 # Find the project by endpoint link
@@ -1503,7 +1252,7 @@ def data_catalog_toggle_status(project_name):
                 # Fetch current status first
                 project_url = f"{app.config['DC_DQ_ENDPOINT_URL']}/data-catalog/{project_name}"
                 headers = {'Authorization': app.config['BEARER_TOKEN']}
-                project = requests.get(project_url, headers=headers).json()
+                project = loads(requests.get(project_url, headers=headers).content)
                 project_id = project['id']
                 new_status = not project['online_status']
                 # Update the status
@@ -1554,8 +1303,8 @@ def data_catalog_project_logstream(id):
                 try:
                     response = requests.get(url, headers=headers)
                     response.raise_for_status()
-                    logs_data = response.json()
-                except requests.exceptions.RequestException as e:
+                    logs_data = loads(response.content)
+                except (requests.exceptions.RequestException, ValueError) as e:
                     print(f"Error fetching logs from external service: {e}")
                     return {}
                 logs = logs_data.get("logs") or {}
@@ -1651,7 +1400,7 @@ def data_quality():
                 response = requests.get(url, headers=headers)
                 if response.status_code == 500:
                     return render_template('500.html', error_message="Failed to fetch data quality projects. Please try again later.", current_user=current_user, user_name=user_data['username'], user_email=user_data['email'], follow_mode=follow_mode, iframe_mode=iframe_mode, light_dark_mode=light_dark_mode, **SourceConfig.get_environment_variables())
-                projects = response.json()
+                projects = loads(response.content)
                 if not user_groups.isdisjoint(action_toggle_status):
                     action_toggle_status_enable=True
                 if not user_groups.isdisjoint(action_delete):
@@ -1698,7 +1447,7 @@ def data_quality_live(partial_url):
                 response = requests.get(projects_url, headers=headers)
                 if response.status_code == 500:
                     return render_template('500.html', error_message="Failed to fetch data quality projects. Please try again later.", current_user=current_user, user_name=user_data['username'], user_email=user_data['email'], follow_mode=follow_mode, iframe_mode=iframe_mode, light_dark_mode=light_dark_mode, **SourceConfig.get_environment_variables())
-                projects = response.json()
+                projects = loads(response.content)
                 url = 'https://' + unquote(partial_url)
 
                 # Find the project by endpoint link
@@ -1790,7 +1539,7 @@ def data_quality_toggle_status(project_name):
                 # Fetch current status first
                 project_url = f"{app.config['DC_DQ_ENDPOINT_URL']}/data-quality/{project_name}"
                 headers = {'Authorization': app.config['BEARER_TOKEN']}
-                project = requests.get(project_url, headers=headers).json()
+                project = loads(requests.get(project_url, headers=headers).content)
                 project_id = project['id']
                 new_status = not project['online_status']
                 # Update the status
@@ -1841,8 +1590,8 @@ def data_quality_project_logstream(id):
                 try:
                     response = requests.get(url, headers=headers)
                     response.raise_for_status()
-                    logs_data = response.json()
-                except requests.exceptions.RequestException as e:
+                    logs_data = loads(response.content)
+                except (requests.exceptions.RequestException, ValueError) as e:
                     print(f"Error fetching logs from external service: {e}")
                     return {}
                 logs = logs_data.get("logs") or {}
@@ -1941,6 +1690,9 @@ def clear_cache():
         if hasattr(app.cache, 'get') and hasattr(app.cache, 'set'):
             # Get current value and re-cache with 1 second timeout to effectively delete
             app.cache.set(actual_cache_key, None, timeout=1)
+
+        # Drop the shared project list as well so the page reflects the latest projects
+        app.cache.delete('dbt_projects')
         
         return jsonify({
             "success": True,
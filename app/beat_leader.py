@@ -0,0 +1,115 @@
+"""
+Redis-lease leader election for Celery beat.
+
+Every console replica runs its own `celery beat` (see supervisord.conf). The
+LeaderElectedScheduler lets only the replica holding the lease send periodic
+tasks; the others keep ticking and take over once the lease expires.
+"""
+import json
+import logging
+import os
+import socket
+from datetime import datetime, timezone
+from celery.beat import PersistentScheduler
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+LEASE_KEY = 'celery_beat_leader'
+LEASE_INFO_KEY = 'celery_beat_leader_info'
+
+# Extend the lease only if this node still holds it
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Delete the lease only if this node still holds it
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class BeatLease:
+    def __init__(self, redis_client=None, lease_seconds=None):
+        self.redis = redis_client or Config.SESSION_REDIS
+        self.lease_seconds = lease_seconds or Config.BEAT_LEADER_LEASE_SECONDS
+        self.node_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.is_leader = False
+        self.acquired_at = None
+
+    def acquire_or_renew(self):
+        """Return True while this node holds the lease, taking it over when it is free."""
+        try:
+            if self.redis.eval(RENEW_SCRIPT, 1, LEASE_KEY, self.node_id, self.lease_seconds):
+                leader = True
+            else:
+                leader = bool(self.redis.set(LEASE_KEY, self.node_id, nx=True, ex=self.lease_seconds))
+                if leader:
+                    self.acquired_at = datetime.now(timezone.utc).isoformat()
+        except Exception as e:
+            logger.error(f"Beat leader election failed on {self.node_id}: {e}")
+            leader = False
+
+        if leader != self.is_leader:
+            logger.warning(f"Beat on {self.node_id} {'acquired' if leader else 'lost'} the leader lease")
+        self.is_leader = leader
+        if leader:
+            self._record_holder()
+        return leader
+
+    def _record_holder(self):
+        info = {
+            'node': self.node_id,
+            'acquired_at': self.acquired_at,
+            'renewed_at': datetime.now(timezone.utc).isoformat(),
+            'lease_seconds': self.lease_seconds
+        }
+        self.redis.set(LEASE_INFO_KEY, json.dumps(info), ex=self.lease_seconds)
+
+    def release(self):
+        try:
+            if self.redis.eval(RELEASE_SCRIPT, 1, LEASE_KEY, self.node_id):
+                self.redis.delete(LEASE_INFO_KEY)
+                logger.warning(f"Beat on {self.node_id} released the leader lease")
+        except Exception as e:
+            logger.error(f"Releasing the beat leader lease failed on {self.node_id}: {e}")
+        self.is_leader = False
+
+
+_lease = None
+
+def get_beat_lease():
+    global _lease
+    if _lease is None:
+        _lease = BeatLease()
+    return _lease
+
+def get_beat_leader(redis_client=None):
+    """Return the recorded lease holder ({node, acquired_at, renewed_at, lease_seconds}) or None."""
+    info = (redis_client or Config.SESSION_REDIS).get(LEASE_INFO_KEY)
+    return json.loads(info) if info else None
+
+
+class LeaderElectedScheduler(PersistentScheduler):
+    """PersistentScheduler that only sends due tasks while holding the beat lease."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lease = get_beat_lease()
+        # Tick often enough to renew the lease before it expires
+        self.max_interval = min(self.max_interval, self.lease.lease_seconds / 3)
+
+    def tick(self, *args, **kwargs):
+        if not self.lease.acquire_or_renew():
+            return self.max_interval
+        return super().tick(*args, **kwargs)
+
+    def close(self):
+        super().close()
+        self.lease.release()
@@ -0,0 +1,135 @@
+"""
+Deploy-time cache warm-up.
+
+Fills the shared cache entries that would otherwise be computed by the first
+user hitting /stats, /dbt-management, /dbt-init or /homepage after a deploy.
+Runs from the Celery worker at boot (see app.tasks.at_worker_start) or on demand:
+
+    python -m app.cache_warmup [--force] [--only dwh_stats dbt_projects ...]
+"""
+import argparse
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+WARMUP_STATUS_CACHE_KEY = 'cache_warmup_status'
+
+
+def warm_dwh_stats(cache, force=False):
+    # Stats metrics are cached per warehouse and metric by their own Celery tasks
+    from app.datawarehouse_stats.stats_metrics import get_cached_metrics, queue_metric_refresh
+    queued = []
+    for dwh_type in Config.FASTBI_PLATFORM_DWH_LIST:
+        entries = get_cached_metrics(cache, dwh_type)
+        metrics = [metric for metric, entry in entries.items() if force or entry is None]
+        if metrics:
+            queued += queue_metric_refresh(cache, dwh_type, metrics)
+    return 'queued' if queued else 'skipped'
+
+def load_dbt_projects():
+    import app.dbt_project_management as dpm
+    return dpm.get_dbt_projects()
+
+def load_airbyte_connections():
+    from app.airbyte_connections import get_airbyte_workspace_id, get_airbyte_connections
+    workspace_id = get_airbyte_workspace_id()
+    if workspace_id is None:
+        return None
+    return {
+        'workspace_id': workspace_id,
+        'connections': get_airbyte_connections(workspace_id)
+    }
+
+def load_alert_summary():
+    from app.monitoring_alerts import get_alert_summary
+    return get_alert_summary()
+
+# name: (cache key, loader, timeout); a None cache key means the loader
+# takes (cache, force), stores its own entries and returns the item status
+WARMUP_ITEMS = {
+    'dwh_stats': (None, warm_dwh_stats, None),
+    'dbt_projects': ('dbt_projects', load_dbt_projects, Config.DBT_PROJECTS_CACHE_TIMEOUT),
+    'airbyte_connections': ('airbyte_connections', load_airbyte_connections, Config.AIRBYTE_CONNECTIONS_CACHE_TIMEOUT),
+    'alert_summary': ('grafana_alert_summary', load_alert_summary, Config.ALERT_SUMMARY_CACHE_TIMEOUT),
+}
+
+
+def warm_item(cache, name, force=False):
+    cache_key, loader, timeout = WARMUP_ITEMS[name]
+    started = time.monotonic()
+    try:
+        if cache_key is None:
+            status = loader(cache, force)
+        elif not force and cache.get(cache_key) is not None:
+            status = 'skipped'
+        else:
+            value = loader()
+            if value is None:
+                status = 'empty'
+            else:
+                cache.set(cache_key, value, timeout=timeout)
+                status = 'ok'
+    except Exception as e:
+        logger.error(f"Cache warm-up of {name} failed: {e}")
+        status = 'failed'
+    duration = round(time.monotonic() - started, 3)
+    logger.info(f"Cache warm-up of {name}: {status} in {duration}s")
+    return {'status': status, 'duration_seconds': duration}
+
+
+def run_cache_warmup(cache, items=None, force=False, max_workers=None):
+    """
+    Warm the shared cache entries in parallel.
+
+    Args:
+        cache: Flask-Caching instance bound to the shared Redis cache.
+        items: Names from WARMUP_ITEMS to warm, all of them by default.
+        force: Recompute entries that are already cached.
+        max_workers: Concurrency cap, defaults to CACHE_WARMUP_CONCURRENCY.
+
+    Returns:
+        dict: Warm-up status with per-item status and duration, also stored
+        under WARMUP_STATUS_CACHE_KEY for the /ready endpoint.
+    """
+    items = list(items or WARMUP_ITEMS)
+    max_workers = max_workers or Config.CACHE_WARMUP_CONCURRENCY
+    status = {
+        'state': 'running',
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'finished_at': None,
+        'items': {}
+    }
+    cache.set(WARMUP_STATUS_CACHE_KEY, status, timeout=0)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(warm_item, cache, name, force): name for name in items}
+        for future in as_completed(futures):
+            status['items'][futures[future]] = future.result()
+
+    status['state'] = 'completed'
+    status['finished_at'] = datetime.now(timezone.utc).isoformat()
+    status['duration_seconds'] = round(time.monotonic() - started, 3)
+    cache.set(WARMUP_STATUS_CACHE_KEY, status, timeout=0)
+    logger.info(f"Cache warm-up completed in {status['duration_seconds']}s: {status['items']}")
+    return status
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    parser = argparse.ArgumentParser(description='Warm the shared User Console caches.')
+    parser.add_argument('--force', action='store_true', help='Recompute entries that are already cached.')
+    parser.add_argument('--only', nargs='+', choices=list(WARMUP_ITEMS), help='Warm only the given entries.')
+    parser.add_argument('--concurrency', type=int, default=None, help='Maximum number of entries warmed at once.')
+    args = parser.parse_args()
+
+    from app.tasks import get_cache
+    app, cache = get_cache()
+    with app.app_context():
+        result = run_cache_warmup(cache, items=args.only, force=args.force, max_workers=args.concurrency)
+    for name, item in sorted(result['items'].items()):
+        print(f"{name}: {item['status']} ({item['duration_seconds']}s)")
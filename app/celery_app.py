@@ -15,6 +15,9 @@ def make_celery():
         'timezone': 'UTC',
         'imports': ('app.tasks',),  # Ensure tasks are imported
     })
+    if Config.BEAT_LEADER_ELECTION:
+        # Only the replica holding the Redis lease sends periodic tasks
+        celery.conf.beat_scheduler = 'app.beat_leader:LeaderElectedScheduler'
     return celery
 
 celery = make_celery()
@@ -1,4 +1,5 @@
 from datetime import timedelta
+import json
 import redis
 import os
 import ssl
@@ -139,6 +140,20 @@ class Config:
     else:
         CACHE_REDIS_URL = f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}'
 
+    # Shared cache entries (seconds)
+    DBT_PROJECTS_CACHE_TIMEOUT = int(os.getenv('DBT_PROJECTS_CACHE_TIMEOUT', 7200))
+    AIRBYTE_CONNECTIONS_CACHE_TIMEOUT = int(os.getenv('AIRBYTE_CONNECTIONS_CACHE_TIMEOUT', 3600))
+    ALERT_SUMMARY_CACHE_TIMEOUT = int(os.getenv('ALERT_SUMMARY_CACHE_TIMEOUT', 300))
+
+    # Cache warm-up configuration
+    CACHE_WARMUP_ON_WORKER_START = os.getenv('CACHE_WARMUP_ON_WORKER_START', 'true').lower() in ('true', '1', 'yes', 'on')
+    CACHE_WARMUP_CONCURRENCY = int(os.getenv('CACHE_WARMUP_CONCURRENCY', 4))
+    CACHE_WARMUP_READINESS_WAIT = os.getenv('CACHE_WARMUP_READINESS_WAIT', 'false').lower() in ('true', '1', 'yes', 'on')
+
+    # Celery beat leader election across replicas
+    BEAT_LEADER_ELECTION = os.getenv('BEAT_LEADER_ELECTION', 'true').lower() in ('true', '1', 'yes', 'on')
+    BEAT_LEADER_LEASE_SECONDS = int(os.getenv('BEAT_LEADER_LEASE_SECONDS', 60))
+
     # DCDQ Meta Collect Service API Configuration
     DC_DQ_ENDPOINT_URL = os.getenv('DC_DQ_ENDPOINT_URL', 'http://data-dcdq-metacollect.data-dcdq-metacollect.svc.cluster.local')
     if not DC_DQ_ENDPOINT_URL:
@@ -173,8 +188,86 @@ class Config:
 
     #Stats
 
-    # Datawarehouse Stats
-    FASTBI_PLATFORM_DWH = os.environ.get('FASTBI_PLATFORM_DWH', 'bigquery')
+    # Datawarehouse Stats, a comma separated list when several warehouses run side by side (the first one is the default)
+    FASTBI_PLATFORM_DWH_LIST = [dwh.strip().lower() for dwh in os.environ.get('FASTBI_PLATFORM_DWH', 'bigquery').split(',') if dwh.strip()]
+    FASTBI_PLATFORM_DWH = FASTBI_PLATFORM_DWH_LIST[0]
+
+    # BigQuery client reuse: HTTP pool shared by the concurrent stats queries, token refresh lead time (seconds)
+    BIGQUERY_HTTP_POOL_SIZE = int(os.getenv('BIGQUERY_HTTP_POOL_SIZE', 16))
+    BIGQUERY_TOKEN_REFRESH_MARGIN = int(os.getenv('BIGQUERY_TOKEN_REFRESH_MARGIN', 300))
+    # 'per_metric' runs one query per stats metric, 'consolidated' computes them all from one JOBS_BY_PROJECT scan
+    BIGQUERY_STATS_MODE = os.getenv('BIGQUERY_STATS_MODE', 'per_metric').lower()
+    # Stats query guardrails: dry-run estimate before each BigQuery stats query, byte budgets per query and per refresh (0 disables)
+    BIGQUERY_STATS_DRY_RUN = os.getenv('BIGQUERY_STATS_DRY_RUN', 'true').lower() in ('true', '1', 'yes', 'on')
+    BIGQUERY_STATS_MAX_BYTES_PER_QUERY = int(os.getenv('BIGQUERY_STATS_MAX_BYTES_PER_QUERY', 10 * 1024 ** 3))
+    BIGQUERY_STATS_MAX_BYTES_PER_REFRESH = int(os.getenv('BIGQUERY_STATS_MAX_BYTES_PER_REFRESH', 50 * 1024 ** 3))
+    # Fetch BigQuery and Snowflake stats results as Arrow and convert them column-wise, BigQuery optionally through the Storage Read API
+    STATS_ARROW_FETCH = os.getenv('STATS_ARROW_FETCH', 'true').lower() in ('true', '1', 'yes', 'on')
+    BIGQUERY_STORAGE_API = os.getenv('BIGQUERY_STORAGE_API', 'false').lower() in ('true', '1', 'yes', 'on')
+    # creation_time window (days) of the BigQuery job statistics, and the ranges selectable on /stats
+    BIGQUERY_STATS_WINDOW_DAYS = int(os.getenv('BIGQUERY_STATS_WINDOW_DAYS', 180))
+    # Deterministic mode: window bounds bound as query parameters, truncated to this many seconds, so BigQuery's result cache can serve repeats
+    BIGQUERY_STATS_DETERMINISTIC = os.getenv('BIGQUERY_STATS_DETERMINISTIC', 'false').lower() in ('true', '1', 'yes', 'on')
+    BIGQUERY_STATS_TIME_GRANULARITY = int(os.getenv('BIGQUERY_STATS_TIME_GRANULARITY', 3600))
+    STATS_WINDOW_OPTIONS = [int(days) for days in os.getenv('STATS_WINDOW_OPTIONS', '7,30,90,180').split(',') if days.strip()]
+
+    # Snowflake batched mode (canonical: every metric from get_all_stats in one task), batches submit every statement with execute_async
+    SNOWFLAKE_STATS_BATCHED = os.getenv('SNOWFLAKE_STATS_BATCHED', 'true').lower() in ('true', '1', 'yes', 'on')
+    SNOWFLAKE_ASYNC_QUERIES = os.getenv('SNOWFLAKE_ASYNC_QUERIES', 'true').lower() in ('true', '1', 'yes', 'on')
+    SNOWFLAKE_ASYNC_POLL_SECONDS = float(os.getenv('SNOWFLAKE_ASYNC_POLL_SECONDS', 0.5))
+
+    # Snowflake session pool: keep-alive sessions with role and warehouse set at creation, closed when idle or too old
+    SNOWFLAKE_ROLE = os.getenv('SNOWFLAKE_ROLE', 'ACCOUNTADMIN')
+    SNOWFLAKE_POOL_SIZE = int(os.getenv('SNOWFLAKE_POOL_SIZE', 4))
+    SNOWFLAKE_POOL_TIMEOUT = float(os.getenv('SNOWFLAKE_POOL_TIMEOUT', 30))
+    SNOWFLAKE_POOL_IDLE_SECONDS = int(os.getenv('SNOWFLAKE_POOL_IDLE_SECONDS', 300))
+    SNOWFLAKE_POOL_MAX_AGE_SECONDS = int(os.getenv('SNOWFLAKE_POOL_MAX_AGE_SECONDS', 3600))
+
+    # Snowflake per-table costs: auto (ACCESS_HISTORY when readable), access_history or regex over QUERY_TEXT, both over the same start time window
+    SNOWFLAKE_TABLE_ATTRIBUTION = os.getenv('SNOWFLAKE_TABLE_ATTRIBUTION', 'auto').lower()
+    SNOWFLAKE_ACCESS_HISTORY_DAYS = int(os.getenv('SNOWFLAKE_ACCESS_HISTORY_DAYS', 180))
+
+    # Console warehouse queries: tag set on every session / statement, and per-statement timeout in seconds (0 disables)
+    STATS_QUERY_TAG = os.getenv('STATS_QUERY_TAG', 'fastbi-console-stats')
+    STATS_STATEMENT_TIMEOUT_SECONDS = int(os.getenv('STATS_STATEMENT_TIMEOUT_SECONDS', 600))
+
+    # Redshift connection pool per process, TCP keepalive idle seconds, and batched mode (all metrics on one session)
+    REDSHIFT_POOL_SIZE = int(os.getenv('REDSHIFT_POOL_SIZE', 4))
+    REDSHIFT_POOL_TIMEOUT = float(os.getenv('REDSHIFT_POOL_TIMEOUT', 30))
+    REDSHIFT_KEEPALIVES_IDLE = int(os.getenv('REDSHIFT_KEEPALIVES_IDLE', 60))
+    REDSHIFT_STATS_BATCHED = os.getenv('REDSHIFT_STATS_BATCHED', 'false').lower() in ('true', '1', 'yes', 'on')
+
+    # Fabric: ODBC driver and driver manager pooling, login timeout (seconds), rows per fetch, batched mode (one multi-statement batch)
+    FABRIC_ODBC_DRIVER = os.getenv('FABRIC_ODBC_DRIVER', 'ODBC Driver 17 for SQL Server')
+    FABRIC_ODBC_POOLING = os.getenv('FABRIC_ODBC_POOLING', 'true').lower() in ('true', '1', 'yes', 'on')
+    FABRIC_LOGIN_TIMEOUT = int(os.getenv('FABRIC_LOGIN_TIMEOUT', 30))
+    FABRIC_FETCH_ARRAYSIZE = int(os.getenv('FABRIC_FETCH_ARRAYSIZE', 5000))
+    FABRIC_STATS_BATCHED = os.getenv('FABRIC_STATS_BATCHED', 'false').lower() in ('true', '1', 'yes', 'on')
+
+    # Extra /stats warehouse adapters, comma separated 'package.module:ClassName' (see datawarehouse_stats/adapters.py)
+    STATS_EXTRA_ADAPTERS = [spec.strip() for spec in os.getenv('STATS_EXTRA_ADAPTERS', '').split(',') if spec.strip()]
+
+    # Warehouse secrets: seconds between checks of the mounted secret files for a rotation
+    SECRETS_CHECK_SECONDS = int(os.getenv('SECRETS_CHECK_SECONDS', 30))
+
+    # Incremental stats: daily rollups kept in the console database (BigQuery, Snowflake, Redshift)
+    STATS_ROLLUP_ENABLED = os.getenv('STATS_ROLLUP_ENABLED', 'false').lower() in ('true', '1', 'yes', 'on')
+    STATS_ROLLUP_RETENTION_DAYS = int(os.getenv('STATS_ROLLUP_RETENTION_DAYS', 180))
+    STATS_ROLLUP_SETTLE_HOURS = int(os.getenv('STATS_ROLLUP_SETTLE_HOURS', 3))
+    STATS_ROLLUP_REFRESH_SECONDS = int(os.getenv('STATS_ROLLUP_REFRESH_SECONDS', 900))
+    # Start time increments (Redshift): queries younger than this are left for the next refresh
+    STATS_ROLLUP_INCREMENT_SETTLE_MINUTES = int(os.getenv('STATS_ROLLUP_INCREMENT_SETTLE_MINUTES', 15))
+    # Redshift only: read the query metrics from the incrementally updated summary even when STATS_ROLLUP_ENABLED is off
+    REDSHIFT_STATS_SUMMARY = os.getenv('REDSHIFT_STATS_SUMMARY', 'false').lower() in ('true', '1', 'yes', 'on')
+
+    # Per-metric refresh schedules, e.g. {"bigquery": {"total_cost_gb_by_table": {"interval": 43200, "ttl": 172800}}}
+    STATS_METRIC_SCHEDULES = json.loads(os.getenv('STATS_METRIC_SCHEDULES', '{}'))
+    # Per-metric Celery task limits, a queued refresh is joined for as long as its attempts can take
+    STATS_METRIC_TIME_LIMIT = int(os.getenv('STATS_METRIC_TIME_LIMIT', 600))
+    # Per-warehouse overrides of STATS_METRIC_TIME_LIMIT, e.g. {"snowflake": 900}
+    STATS_WAREHOUSE_TIME_LIMITS = json.loads(os.getenv('STATS_WAREHOUSE_TIME_LIMITS', '{}'))
+    STATS_METRIC_MAX_RETRIES = int(os.getenv('STATS_METRIC_MAX_RETRIES', 2))
+    STATS_METRIC_RETRY_DELAY = int(os.getenv('STATS_METRIC_RETRY_DELAY', 30))
 
     # Add the Celery configuration to your Flask app's configuration
     BQ_PROJECT_ID = os.getenv('BQ_PROJECT_ID')
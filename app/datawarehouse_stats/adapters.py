@@ -0,0 +1,263 @@
+"""
+Warehouse adapters for the /stats page.
+
+A WarehouseAdapter is everything the stats layer knows about one warehouse:
+its stats module, display label, schedule overrides and collection policy
+(one batched task or one task per metric, selectable windows, local rollups).
+Every statement goes through its run_query()/run_batch(), which take a pooled
+connection, apply the statement timeout, record the elapsed time and handle
+errors the same way for every warehouse; the stats module only implements the
+driver calls. Every value it returns goes through the same normalize().
+
+New warehouses subclass WarehouseAdapter and are registered with
+register_adapter(), or listed in STATS_EXTRA_ADAPTERS, without touching the
+Flask app or the Celery tasks.
+"""
+import decimal
+import importlib
+import logging
+from app.config import Config
+from app.datawarehouse_stats.query_metrics import statement_timeout_seconds, timed_query
+from app.json_utils import dumps
+
+logger = logging.getLogger(__name__)
+
+
+class WarehouseAdapter:
+    """
+    Adapter over a stats module exposing one get_*() collector per metric, and
+    optionally get_all_stats(), refresh_budget(refresh_id), get_console_query_costs(days),
+    get_daily_rollup(since_day), get_rollup_increment(since, until) and get_increment_until(since, until).
+
+    The module's queries run through run_query()/run_batch(), built on its
+    connection(statement_timeout) context manager yielding a pooled connection,
+    execute(conn, query, label) returning the rows of one tagged statement as
+    dicts, and optionally execute_batch(conn, queries) sending {name: query}
+    in one round trip.
+    """
+    dwh_type = None
+    label = None
+    module_path = None
+    # Built-in overrides of the STATS_METRICS defaults: {metric: {'interval': seconds, 'ttl': seconds}}
+    schedules = {}
+    # Job statistics can be computed over a selectable window (?window=)
+    windowed = False
+    # Query metrics can be built from the console's daily rollups
+    rollups = False
+
+    def __init__(self):
+        self._module = None
+
+    @property
+    def module(self):
+        if self._module is None:
+            self._module = importlib.import_module(self.module_path)
+        return self._module
+
+    def batched(self):
+        """True when the warehouse prefers its get_all_stats() collector over one task per metric."""
+        return False
+
+    def uses_rollups(self):
+        return self.rollups and Config.STATS_ROLLUP_ENABLED
+
+    def uses_batch_collection(self):
+        # The one place deciding between a single batched task and the per-metric chord
+        return not self.uses_rollups() and self.batched()
+
+    def supports_window(self):
+        return self.windowed and not self.uses_rollups()
+
+    def refresh_budget(self):
+        """The module's per-refresh byte budget, a context manager factory taking the refresh id, None when it has none."""
+        return getattr(self.module, 'refresh_budget', None)
+
+    def collect(self, collector, section, window_days=None):
+        """Run one metric collector (a get_*() function name) and normalize its value."""
+        function = getattr(self.module, collector)
+        value = function(window_days=window_days) if window_days else function()
+        return self.normalize(value, section)
+
+    def collect_all(self, sections, window_days=None):
+        """Run get_all_stats() and normalize each metric, sections maps metric to its page section."""
+        if self.supports_window():
+            stats = self.module.get_all_stats(window_days=window_days)
+        else:
+            stats = self.module.get_all_stats()
+        if not stats:
+            return stats
+        return {metric: self.normalize(value, sections.get(metric, 'cards')) for metric, value in stats.items()}
+
+    def statement_timeout(self):
+        """Seconds after which the warehouse cancels a statement, None for no limit."""
+        return statement_timeout_seconds()
+
+    def connection(self):
+        """A pooled connection for the block, its statements limited to statement_timeout()."""
+        return self.module.connection(self.statement_timeout())
+
+    def native_batches(self):
+        """True when run_batch() sends its statements with the module's execute_batch()."""
+        return hasattr(self.module, 'execute_batch')
+
+    def query_failed(self, error, query, label=None):
+        logger.error(f"Error running {self.label} query {label or ''}: {error}\nQuery: {query}")
+
+    def run_query(self, query, label=None, raise_errors=False, **options):
+        """
+        Run one statement on a pooled connection and return its rows as dicts, its
+        elapsed time recorded under label. Failures return [] unless raise_errors.
+        options are passed on to the module's execute().
+        """
+        try:
+            with self.connection() as conn:
+                logger.debug(f'Executing query: {query.strip().splitlines()[0]}...')
+                with timed_query(self.dwh_type, label):
+                    return self.module.execute(conn, query, label, **options)
+        except Exception as e:
+            self.query_failed(e, query, label)
+            if raise_errors:
+                raise
+            return []
+
+    def run_batch(self, queries, raise_errors=False):
+        """
+        Run every statement of {name: query} on one pooled connection and return
+        {name: rows}, as one native batch when native_batches() (timed as 'batch')
+        and one timed statement after the other otherwise. Returns {} when any
+        statement fails, unless raise_errors.
+        """
+        try:
+            with self.connection() as conn:
+                if len(queries) > 1 and self.native_batches():
+                    with timed_query(self.dwh_type, 'batch'):
+                        return self.module.execute_batch(conn, queries)
+                results = {}
+                for name, query in queries.items():
+                    with timed_query(self.dwh_type, name):
+                        results[name] = self.module.execute(conn, query, name)
+                return results
+        except Exception as e:
+            logger.error(f"Error running {self.label} batch {list(queries)}: {e}")
+            if raise_errors:
+                raise
+            return {}
+
+    def console_query_costs(self, days=1):
+        return self.module.get_console_query_costs(days)
+
+    def normalize(self, value, section):
+        """
+        One shape for every warehouse: cards are int/float (Decimal converted),
+        charts and tables are JSON strings ready to embed in the page.
+        """
+        if value is None:
+            return None
+        if section == 'cards':
+            if isinstance(value, decimal.Decimal):
+                return int(value) if value.as_tuple().exponent >= 0 else float(value)
+            return value
+        if isinstance(value, (list, dict)):
+            return dumps(value, datetime_format='%Y-%m-%d %H:%M:%S')
+        return value
+
+
+class BigQueryAdapter(WarehouseAdapter):
+    dwh_type = 'bigquery'
+    label = 'BigQuery'
+    module_path = 'app.datawarehouse_stats.bigquery_stats'
+    windowed = True
+    rollups = True
+
+    def batched(self):
+        return Config.BIGQUERY_STATS_MODE == 'consolidated'
+
+    def native_batches(self):
+        # Each statement is its own job with its own dry run and byte budget check
+        return False
+
+    def query_failed(self, error, query, label=None):
+        if isinstance(error, self.module.BytesBudgetExceeded):
+            logger.warning(f"Refused BigQuery stats query {label or ''}: {error}")
+        else:
+            super().query_failed(error, query, label)
+
+
+class SnowflakeAdapter(WarehouseAdapter):
+    dwh_type = 'snowflake'
+    label = 'Snowflake'
+    module_path = 'app.datawarehouse_stats.snowflake_stats'
+    rollups = True
+    # ACCOUNT_USAGE views lag up to 45 minutes, refreshing query cards faster only burns credits
+    schedules = {
+        'total_query_executed': {'interval': 3600},
+        'avg_execution_time_seconds': {'interval': 3600},
+        'failure_rate_percentage': {'interval': 3600},
+    }
+
+    def batched(self):
+        return Config.SNOWFLAKE_STATS_BATCHED
+
+    def native_batches(self):
+        return Config.SNOWFLAKE_ASYNC_QUERIES
+
+
+class RedshiftAdapter(WarehouseAdapter):
+    dwh_type = 'redshift'
+    label = 'Redshift'
+    module_path = 'app.datawarehouse_stats.redshift_stats'
+    rollups = True
+
+    def batched(self):
+        return Config.REDSHIFT_STATS_BATCHED
+
+    def uses_rollups(self):
+        return Config.STATS_ROLLUP_ENABLED or Config.REDSHIFT_STATS_SUMMARY
+
+
+class FabricAdapter(WarehouseAdapter):
+    dwh_type = 'fabric'
+    label = 'Fabric'
+    module_path = 'app.datawarehouse_stats.fabric_stats'
+    # Query history metrics are static placeholders on Fabric
+    schedules = {
+        'total_query_executed': {'interval': 86400, 'ttl': 172800},
+        'avg_execution_time_seconds': {'interval': 86400, 'ttl': 172800},
+        'failure_rate_percentage': {'interval': 86400, 'ttl': 172800},
+        'query_cost_by_days_chart': {'interval': 86400, 'ttl': 172800},
+    }
+
+    def batched(self):
+        return Config.FABRIC_STATS_BATCHED
+
+
+WAREHOUSE_ADAPTERS = {}
+
+def register_adapter(adapter):
+    """Register (or replace) the adapter of adapter.dwh_type."""
+    WAREHOUSE_ADAPTERS[adapter.dwh_type] = adapter
+    return adapter
+
+def load_extra_adapters(specs):
+    """Register the adapters listed as 'package.module:ClassName' entries, skipping the ones that fail to load."""
+    for spec in specs:
+        try:
+            module_path, class_name = spec.split(':', 1)
+            register_adapter(getattr(importlib.import_module(module_path), class_name)())
+        except Exception as e:
+            logger.error(f"Could not load warehouse adapter {spec}: {e}")
+
+def is_supported(dwh_type):
+    return dwh_type in WAREHOUSE_ADAPTERS
+
+def get_adapter(dwh_type):
+    """The registered adapter of dwh_type, raises KeyError for unknown warehouses."""
+    return WAREHOUSE_ADAPTERS[dwh_type]
+
+def get_warehouse_labels():
+    return {dwh_type: adapter.label for dwh_type, adapter in WAREHOUSE_ADAPTERS.items()}
+
+
+for _adapter in (BigQueryAdapter(), SnowflakeAdapter(), RedshiftAdapter(), FabricAdapter()):
+    register_adapter(_adapter)
+load_extra_adapters(Config.STATS_EXTRA_ADAPTERS)
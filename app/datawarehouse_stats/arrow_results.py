@@ -0,0 +1,107 @@
+"""
+Arrow result conversion shared by the BigQuery and Snowflake stats modules.
+
+Query results are fetched as Arrow tables (BigQuery `to_arrow()`, Snowflake
+`fetch_arrow_batches()`) and converted column by column: decimals are cast to
+float and timestamps formatted with Arrow compute kernels, then every column
+becomes a Python list in one call. The row dicts are only zipped together at
+the end, instead of being built per row and walked again by convert_types /
+convert_decimals.
+"""
+import json
+import logging
+import pyarrow as pa
+import pyarrow.compute as pc
+
+logger = logging.getLogger(__name__)
+
+
+def _convert_column(column, datetime_format=None):
+    if pa.types.is_decimal(column.type):
+        return pc.cast(column, pa.float64())
+    if datetime_format and pa.types.is_timestamp(column.type):
+        # Arrow prints fractional seconds for %S on sub-second units, truncate like datetime.strftime
+        seconds = pc.cast(column, pa.timestamp('s', tz=column.type.tz), safe=False)
+        return pc.strftime(seconds, format=datetime_format)
+    return column
+
+
+def arrow_to_records(table, datetime_format=None, upper_keys=False):
+    """
+    Convert an Arrow table to a list of row dicts, column by column.
+
+    Args:
+        table: pyarrow.Table (or RecordBatch)
+        datetime_format: strftime format applied to timestamp columns,
+            None keeps them as datetime objects like the row path
+        upper_keys: upper case the column names (Snowflake normalize_keys)
+    """
+    names = [name.upper() for name in table.column_names] if upper_keys else table.column_names
+    columns = [_convert_column(column, datetime_format).to_pylist() for column in table.columns]
+    return [dict(zip(names, values)) for values in zip(*columns)]
+
+
+def arrow_batches_to_records(batches, datetime_format=None, upper_keys=False):
+    """Convert an iterable of Arrow tables/batches, one batch in memory as Arrow at a time."""
+    records = []
+    for batch in batches:
+        records.extend(arrow_to_records(batch, datetime_format=datetime_format, upper_keys=upper_keys))
+    return records
+
+
+def benchmark(rows=100000, repeat=3):
+    """
+    Compare the row-dict path with the Arrow path on a synthetic per-table
+    cost result (the widest stats result) and return seconds and peak bytes
+    per path. No warehouse connection is needed.
+    """
+    import time
+    import tracemalloc
+    from datetime import datetime, timedelta, timezone
+    from decimal import Decimal
+    from app.datawarehouse_stats.bigquery_stats import convert_types
+
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    table = pa.table({
+        'dataset': [f'dataset_{i % 50}' for i in range(rows)],
+        'table': [f'table_{i}' for i in range(rows)],
+        'total_cost_gb': pa.array([Decimal(i) / 100 for i in range(rows)], pa.decimal128(18, 2)),
+        'total_queries': list(range(rows)),
+        'avg_execution_time_sec': [i / 7 for i in range(rows)],
+        'first_query_date': pa.array([start + timedelta(minutes=i) for i in range(rows)], pa.timestamp('us', tz='UTC')),
+        'last_query_date': pa.array([start + timedelta(minutes=2 * i) for i in range(rows)], pa.timestamp('us', tz='UTC'))
+    })
+    # What the connectors hand the row path: one tuple/Row per result row
+    names = table.column_names
+    tuples = list(zip(*(column.to_pylist() for column in table.columns)))
+
+    def row_path():
+        results = [dict(zip(names, row)) for row in tuples]
+        results = convert_types(results)
+        return json.dumps(results, default=float)
+
+    def arrow_path():
+        return json.dumps(arrow_to_records(table, datetime_format='%Y-%m-%d %H:%M:%S'))
+
+    timings = {}
+    for name, function in (('row_dict', row_path), ('arrow', arrow_path)):
+        best = None
+        for _ in range(repeat):
+            began = time.perf_counter()
+            function()
+            elapsed = time.perf_counter() - began
+            best = elapsed if best is None else min(best, elapsed)
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        timings[name] = {'seconds': round(best, 4), 'peak_bytes': peak}
+    return timings
+
+
+# Benchmark: python -m app.datawarehouse_stats.arrow_results [rows]
+if __name__ == "__main__":
+    import sys
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    for path, result in benchmark(rows).items():
+        print(f"{path}: {result['seconds']}s, peak {result['peak_bytes'] / 1048576:.1f} MiB for {rows} rows")
@@ -2,37 +2,53 @@ import base64
 import json
 import os
 import logging
-from datetime import datetime
+import ssl
+import threading
+import time
+import certifi
+import requests
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
 from google.cloud import bigquery
 from google.oauth2 import service_account
 from google.auth import impersonated_credentials
-from google.api_core.exceptions import GoogleAPIError
-# from app.config import Config  # No longer needed for secrets
+from google.auth.transport.requests import AuthorizedSession, Request as GoogleAuthRequest
+from google.api_core.exceptions import GoogleAPIError, PermissionDenied
+from app.config import Config
+from app.datawarehouse_stats.adapters import get_adapter
+from app.datawarehouse_stats.arrow_results import arrow_to_records
+from app.datawarehouse_stats.secret_provider import get_secret_provider
+from app.json_utils import dumps
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 logger = logging.getLogger(__name__)
 
+BIGQUERY_SECRETS_PATH = '/fastbi/secrets/bigquery/'
+# Local Development
+#BIGQUERY_SECRETS_PATH = './secrets/bigquery/'
+BIGQUERY_REQUIRED_SECRETS = [
+    'BIGQUERY_PROJECT_ID',
+    'BIGQUERY_REGION',
+    'DBT_DEPLOY_GCP_SA_SECRET'
+]
+BIGQUERY_SCOPES = [
+    'https://www.googleapis.com/auth/bigquery',
+    'https://www.googleapis.com/auth/cloud-platform',
+    'https://www.googleapis.com/auth/iam'
+]
+
+def get_bigquery_secrets():
+    return get_secret_provider('bigquery', BIGQUERY_REQUIRED_SECRETS, path=BIGQUERY_SECRETS_PATH)
+
 def read_bigquery_secret(secret_name):
-    secrets_path = '/fastbi/secrets/bigquery/'
-    # Local Development
-    #secrets_path = './secrets/bigquery/'
-    required_secrets = [
-        'BIGQUERY_PROJECT_ID',
-        'BIGQUERY_REGION',
-        'DBT_DEPLOY_GCP_SA_SECRET'
-    ]
+    required_secrets = BIGQUERY_REQUIRED_SECRETS
     try:
         if secret_name not in required_secrets:
             logger.error(f"Requested secret {secret_name} is not in the required secrets list")
             raise ValueError(f"Invalid secret name: {secret_name}")
-            
-        secret_path = os.path.join(secrets_path, secret_name)
-        try:
-            with open(secret_path, 'r') as f:
-                return f.read().strip()
-        except Exception as e:
-            logger.error(f"Error reading secret {secret_name}: {e}")
-            raise
+        # Cached in memory, re-read only after the mounted secret changed
+        return get_bigquery_secrets().get(secret_name)
     except Exception as e:
         logger.error(f"Error loading BigQuery secret: {e}")
         raise
@@ -56,76 +72,407 @@ def decode_base64_sa(encoded_str):
         raise ValueError(f"Failed to decode JSON: {e}")
     return decoded_dict
 
-def handle_ssl_issues():
-    ssl_vars = {
-        'SSL_CERT_FILE': os.getenv('SSL_CERT_FILE'),
-        'REQUESTS_CA_BUNDLE': os.getenv('REQUESTS_CA_BUNDLE')
-    }
-    if any(ssl_vars.values()):
-        logger.info("SSL-related environment variables detected. Handling SSL configuration...")
-        original_values = ssl_vars.copy()
-        os.environ['SSL_CERT_FILE'] = ''
-        os.environ['REQUESTS_CA_BUNDLE'] = ''
-        return original_values
-    return None
-
-def restore_ssl_settings(original_values):
-    if original_values:
-        for key, value in original_values.items():
-            if value is not None:
-                os.environ[key] = value
-            else:
-                os.environ.pop(key, None)
-
-def run_bigquery_query(query):
-    try:
-        logger.info('Preparing to connect to BigQuery...')
+def get_ssl_context():
+    """
+    SSLContext trusting certifi's bundle plus the custom CA in SSL_CERT_FILE.
+
+    ssl.create_default_context() loads the default verify paths, which honor
+    SSL_CERT_FILE; when that file holds only the internal CA, googleapis.com
+    fails verification. Starting from certifi keeps the public roots.
+    """
+    context = ssl.create_default_context(cafile=certifi.where())
+    if Config.SSL_CERT_FILE and Path(Config.SSL_CERT_FILE).exists():
+        context.load_verify_locations(cafile=Config.SSL_CERT_FILE)
+    return context
+
+class SSLContextAdapter(requests.adapters.HTTPAdapter):
+    """
+    HTTPAdapter that verifies TLS with a fixed SSLContext (get_ssl_context(),
+    certifi's CAs plus SSL_CERT_FILE) instead of whatever CA bundle requests
+    picks up from SSL_CERT_FILE / REQUESTS_CA_BUNDLE, so the environment no
+    longer has to be blanked around each query.
+    """
+    def __init__(self, ssl_context, **kwargs):
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        return super().init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        return super().proxy_manager_for(*args, **kwargs)
+
+    def cert_verify(self, conn, url, verify, cert):
+        if verify is False or cert:
+            return super().cert_verify(conn, url, verify, cert)
+        conn.cert_reqs = 'CERT_REQUIRED'
+        conn.ca_certs = None
+        conn.ca_cert_dir = None
+
+def build_transport(pool_size=None):
+    """A requests session verifying with get_ssl_context(), built once per client."""
+    session = requests.Session()
+    adapter_kwargs = {'pool_connections': pool_size, 'pool_maxsize': pool_size} if pool_size else {}
+    session.mount('https://', SSLContextAdapter(get_ssl_context(), **adapter_kwargs))
+    return session
+
+def build_credentials():
+    decoded_sa = decode_base64_sa(get_gcp_sa_secret())
+    source_credentials = service_account.Credentials.from_service_account_info(
+        decoded_sa,
+        scopes=BIGQUERY_SCOPES
+    )
+    impersonate_email = os.environ.get('GCP_SA_IMPERSONATE_EMAIL')
+    if impersonate_email:
+        return impersonated_credentials.Credentials(
+            source_credentials=source_credentials,
+            target_principal=impersonate_email,
+            target_scopes=BIGQUERY_SCOPES,
+            lifetime=3600
+        )
+    return source_credentials
+
+
+class BigQueryClientFactory:
+    """
+    Process-wide BigQuery client.
+
+    Credentials and the client (with its HTTP connection pool) are built once
+    and shared by every query thread. The access token is refreshed ahead of
+    expiry under a lock so concurrent queries do not each mint one, and
+    everything is rebuilt only when the secret provider reports a change.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._client = None
+        self._credentials = None
+        self._auth_request = None
+        self._location = None
+        self._bqstorage_client = None
+        # Set once the Storage Read API refused a read session (no bigquery.readsessions.create)
+        self._bqstorage_denied = False
+        self._stale = False
+
+    def _on_secrets_changed(self, provider):
+        # Called from provider.check(), possibly while get() holds the lock
+        self._stale = True
+
+    def _build(self):
         project_id = get_bq_project_id()
         region = get_bq_region()
-        encoded_sa = get_gcp_sa_secret()
-        decoded_sa = decode_base64_sa(encoded_sa)
-        scopes = [
-            'https://www.googleapis.com/auth/bigquery',
-            'https://www.googleapis.com/auth/cloud-platform',
-            'https://www.googleapis.com/auth/iam'
-        ]
-        source_credentials = service_account.Credentials.from_service_account_info(
-            decoded_sa,
-            scopes=scopes
-        )
-        impersonate_email = os.environ.get('GCP_SA_IMPERSONATE_EMAIL')
-        if impersonate_email:
-            credentials = impersonated_credentials.Credentials(
-                source_credentials=source_credentials,
-                target_principal=impersonate_email,
-                target_scopes=scopes,
-                lifetime=3600
-            )
+        credentials = build_credentials()
+        self._credentials = credentials
+        # Token refreshes and API calls both go through transports verifying with get_ssl_context()
+        self._auth_request = GoogleAuthRequest(session=build_transport())
+        session = AuthorizedSession(credentials, auth_request=self._auth_request)
+        session.mount('https://', SSLContextAdapter(
+            get_ssl_context(),
+            pool_connections=Config.BIGQUERY_HTTP_POOL_SIZE,
+            pool_maxsize=Config.BIGQUERY_HTTP_POOL_SIZE
+        ))
+        self._client = bigquery.Client(project=project_id, credentials=credentials, _http=session)
+        self._location = f"{project_id}.region-{region}"
+        if Config.STATS_ARROW_FETCH and Config.BIGQUERY_STORAGE_API and not self._bqstorage_denied:
+            # Import bigquery_storage only when needed
+            from google.cloud import bigquery_storage
+            self._bqstorage_client = bigquery_storage.BigQueryReadClient(credentials=credentials)
+        logger.info(f'Built BigQuery client for {project_id} ({region})')
+
+    def _refresh_token_if_needed(self):
+        credentials = self._credentials
+        expiry = credentials.expiry
+        if credentials.token is None or expiry is None or expiry - datetime.utcnow() < timedelta(seconds=Config.BIGQUERY_TOKEN_REFRESH_MARGIN):
+            credentials.refresh(self._auth_request)
+            logger.info(f'Refreshed BigQuery access token, valid until {credentials.expiry}')
+
+    def get(self):
+        """Return (client, location), rebuilding when the secret files changed."""
+        with self._lock:
+            provider = get_bigquery_secrets()
+            provider.subscribe(self._on_secrets_changed)
+            provider.check()
+            if self._client is None or self._stale:
+                if self._client is not None:
+                    logger.info('BigQuery secrets changed, rebuilding the client')
+                    self._close()
+                self._stale = False
+                self._build()
+            self._refresh_token_if_needed()
+            return self._client, self._location
+
+    def get_bqstorage_client(self):
+        """The shared Storage Read API client, None when it is disabled or was refused."""
+        with self._lock:
+            return None if self._bqstorage_denied else self._bqstorage_client
+
+    def disable_bqstorage(self, reason):
+        """Fall back to the REST download for the rest of this process."""
+        with self._lock:
+            if not self._bqstorage_denied:
+                logger.warning(f'BigQuery Storage Read API refused, fetching results over REST from now on: {reason}')
+            self._bqstorage_denied = True
+
+    def _close(self):
+        self._client.close()
+        if self._bqstorage_client is not None:
+            self._bqstorage_client.transport.close()
+            self._bqstorage_client = None
+
+    def reset(self):
+        with self._lock:
+            if self._client is not None:
+                self._close()
+            self._client = None
+
+
+client_factory = BigQueryClientFactory()
+
+def get_bigquery_client():
+    return client_factory.get()
+
+@contextmanager
+def connection(statement_timeout=None):
+    """The shared client for the block as (client, location, statement_timeout), BigQuery jobs need no checkin."""
+    client, location = get_bigquery_client()
+    yield client, location, statement_timeout
+
+_billing = threading.local()
+# A shared refresh total outlives the refresh by this much at most
+SHARED_BUDGET_SECONDS = 86400
+
+class BytesBudgetExceeded(Exception):
+    """A stats query was refused because it would go over its byte budget."""
+
+def _tracked():
+    """The totals of every track_bytes_billed block this thread is in, outermost first."""
+    return getattr(_billing, 'stack', ())
+
+@contextmanager
+def track_bytes_billed(max_bytes=None, shared_key=None):
+    """
+    Sum the bytes billed, slot-ms and cache hits of every query run in this
+    thread inside the block. Blocks nest: a query counts towards every
+    enclosing block and is checked against each one's budget. With max_bytes,
+    queries whose dry-run estimate would take the total over it are refused
+    and 'exceeded' records why. With shared_key the total checked against
+    max_bytes is kept in Redis, so several tasks draw from one budget.
+    """
+    totals = {'bytes_billed': 0, 'queries': 0, 'slot_ms': 0, 'cache_hits': 0,
+              'max_bytes': max_bytes, 'shared_key': shared_key, 'exceeded': None}
+    stack = _tracked()
+    _billing.stack = stack + (totals,)
+    try:
+        yield totals
+    finally:
+        _billing.stack = stack
+
+def refresh_budget(refresh_id=None):
+    """
+    Byte budget shared by the queries of one stats refresh (BIGQUERY_STATS_MAX_BYTES_PER_REFRESH).
+    refresh_id identifies a dispatched refresh; its metric tasks then share the
+    running total in Redis instead of each getting the whole budget.
+    """
+    shared_key = f'stats_refresh_bytes_bigquery_{refresh_id}' if refresh_id else None
+    return track_bytes_billed(max_bytes=Config.BIGQUERY_STATS_MAX_BYTES_PER_REFRESH or None, shared_key=shared_key)
+
+def _add_shared(totals, bytes_billed):
+    """Add to a shared refresh total, returns the new total."""
+    redis_client = Config.SESSION_REDIS
+    total = redis_client.incrby(totals['shared_key'], int(bytes_billed))
+    redis_client.expire(totals['shared_key'], SHARED_BUDGET_SECONDS)
+    return total
+
+def record_bytes_billed(query_job, reserved=0):
+    """Count a finished query, reserved is the dry-run estimate check_bytes_budget already added to shared totals."""
+    bytes_billed = query_job.total_bytes_billed or 0
+    slot_ms = query_job.slot_millis or 0
+    logger.info(f'Query {query_job.job_id} billed {bytes_billed} bytes, {slot_ms} slot-ms, cache hit: {bool(query_job.cache_hit)}')
+    for totals in _tracked():
+        totals['bytes_billed'] += bytes_billed
+        totals['queries'] += 1
+        totals['slot_ms'] += slot_ms
+        totals['cache_hits'] += 1 if query_job.cache_hit else 0
+        if totals['shared_key'] and totals['max_bytes'] and bytes_billed != reserved:
+            _add_shared(totals, bytes_billed - reserved)
+
+def release_reserved(reserved):
+    """Take back a dry-run estimate check_bytes_budget reserved for a query that then billed nothing."""
+    for totals in _tracked():
+        if totals['shared_key'] and totals['max_bytes']:
+            _add_shared(totals, -reserved)
+
+def refuse_query(reason):
+    for totals in _tracked():
+        totals['exceeded'] = reason
+    raise BytesBudgetExceeded(reason)
+
+def check_bytes_budget(client, query, query_parameters=None):
+    """
+    Dry-run the query (free) and refuse it when its estimate is over the
+    per-query budget or the budget of any enclosing block. Shared budgets
+    reserve the estimate atomically, record_bytes_billed settles the difference.
+
+    Returns:
+        int: The estimate reserved in the shared budgets (0 when there are none).
+    """
+    dry_run = client.query(query, job_config=bigquery.QueryJobConfig(
+        dry_run=True, use_query_cache=False, query_parameters=query_parameters or []))
+    estimated = dry_run.total_bytes_processed or 0
+    logger.info(f'Dry run estimates {estimated} bytes')
+    max_query_bytes = Config.BIGQUERY_STATS_MAX_BYTES_PER_QUERY
+    if max_query_bytes and estimated > max_query_bytes:
+        refuse_query(f'estimated {estimated} bytes exceed BIGQUERY_STATS_MAX_BYTES_PER_QUERY ({max_query_bytes})')
+    reserved = []
+    for totals in _tracked():
+        if not totals['max_bytes']:
+            continue
+        if totals['shared_key']:
+            # Reserve first so concurrent metric tasks never both fit into the same remainder
+            spent = _add_shared(totals, estimated) - estimated
+            reserved.append(totals)
         else:
-            credentials = source_credentials
-        original_ssl_settings = handle_ssl_issues()
+            spent = totals['bytes_billed']
+        if spent + estimated > totals['max_bytes']:
+            for shared in reserved:
+                _add_shared(shared, -estimated)
+            refuse_query(f"estimated {estimated} bytes on top of {spent} already billed exceed "
+                         f"BIGQUERY_STATS_MAX_BYTES_PER_REFRESH ({totals['max_bytes']})")
+    return estimated if reserved else 0
+
+def query_job_config(query_parameters=None, label=None, statement_timeout=None):
+    job_config = bigquery.QueryJobConfig(
+        use_query_cache=True,
+        query_parameters=query_parameters or [],
+        labels={'stats_query': label} if label else {}
+    )
+    if statement_timeout:
+        # BigQuery cancels the job once it has run this long
+        job_config.job_timeout_ms = int(statement_timeout * 1000)
+    if Config.BIGQUERY_STATS_MAX_BYTES_PER_QUERY:
+        # BigQuery itself fails a query that would bill more than maximum_bytes_billed
+        # (only set when configured, QueryJobConfig would send None as the string 'None')
+        job_config.maximum_bytes_billed = Config.BIGQUERY_STATS_MAX_BYTES_PER_QUERY
+    return job_config
+
+QUERY_CACHE_HITS_KEY = 'stats_query_cache_hits'
+
+def record_cache_hit(label, cache_hit, redis_client=None):
+    """Count result cache hits per stats query (by label) in a Redis hash shared by every process and log the hit rate."""
+    try:
+        pipe = (redis_client or Config.SESSION_REDIS).pipeline()
+        pipe.hincrby(QUERY_CACHE_HITS_KEY, f"{label}:queries", 1)
+        pipe.hincrby(QUERY_CACHE_HITS_KEY, f"{label}:cache_hits", 1 if cache_hit else 0)
+        queries, cache_hits = pipe.execute()
+        logger.info(f"Result cache hit rate of {label}: {cache_hits}/{queries}")
+    except Exception as e:
+        logger.warning(f"Could not record the result cache hit of {label}: {e}")
+
+def get_query_cache_stats(redis_client=None):
+    """Result cache hits as {label: {queries, cache_hits}}, counted by every web and Celery process."""
+    raw = (redis_client or Config.SESSION_REDIS).hgetall(QUERY_CACHE_HITS_KEY) or {}
+    stats = {}
+    for key, value in raw.items():
+        key = key.decode() if isinstance(key, bytes) else key
+        label, measure = key.rsplit(':', 1)
+        stats.setdefault(label, {'queries': 0, 'cache_hits': 0})[measure] = int(value)
+    return stats
+
+def get_window_days(window_days=None):
+    return int(window_days or Config.BIGQUERY_STATS_WINDOW_DAYS)
+
+def get_window_bounds(window_days=None):
+    """
+    Deterministic mode: the window as (start, end) timestamps, end truncated to
+    BIGQUERY_STATS_TIME_GRANULARITY so every refresh within the same slot binds
+    identical parameters and BigQuery can answer repeats from its result cache.
+    """
+    granularity = Config.BIGQUERY_STATS_TIME_GRANULARITY
+    end = datetime.fromtimestamp(int(time.time()) // granularity * granularity, timezone.utc)
+    return end - timedelta(days=get_window_days(window_days)), end
+
+def window_filter(window_days=None):
+    # A plain creation_time range lets BigQuery prune the JOBS_BY_PROJECT partitions
+    if Config.BIGQUERY_STATS_DETERMINISTIC:
+        return "creation_time BETWEEN @window_start AND @window_end"
+    return f"creation_time >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {get_window_days(window_days)} DAY)"
+
+def bind_query(query, location, window_days=None):
+    """
+    Fill in the {location}, {window}, {now} and {today} placeholders. In
+    deterministic mode {now}/{today} become the bound (truncated) window end
+    instead of CURRENT_TIMESTAMP()/CURRENT_DATE(), which BigQuery never caches.
+
+    Returns:
+        tuple: (query, query_parameters)
+    """
+    deterministic = Config.BIGQUERY_STATS_DETERMINISTIC
+    query = (query.replace("{location}", location)
+             .replace("{window}", window_filter(window_days))
+             .replace("{now}", "@window_end" if deterministic else "CURRENT_TIMESTAMP()")
+             .replace("{today}", "DATE(@window_end)" if deterministic else "CURRENT_DATE()"))
+    if not deterministic or '@window_' not in query:
+        return query, []
+    window_start, window_end = get_window_bounds(window_days)
+    return query, [
+        bigquery.ScalarQueryParameter('window_start', 'TIMESTAMP', window_start),
+        bigquery.ScalarQueryParameter('window_end', 'TIMESTAMP', window_end)
+    ]
+
+def fetch_records(query_job, datetime_format=None):
+    """
+    Result rows as dicts, through Arrow when STATS_ARROW_FETCH is enabled and
+    the shared Storage Read API client when BIGQUERY_STORAGE_API is too. A
+    refused read session falls back to the REST download. The row path leaves
+    datetimes for json_utils.dumps to format.
+    """
+    result = query_job.result()
+    if not Config.STATS_ARROW_FETCH:
+        return [dict(row) for row in result]
+    bqstorage_client = client_factory.get_bqstorage_client()
+    if bqstorage_client is not None:
         try:
-            logger.info('Successfully connected to BigQuery!')
-            client = bigquery.Client(
-                project=project_id,
-                credentials=credentials
-            )
-            location = f"{project_id}.region-{region}"
-            query = query.replace("{location}", location)
-            logger.info(f'Executing query: {query.strip().splitlines()[0]}...')
-            query_job = client.query(query)
+            return arrow_to_records(result.to_arrow(bqstorage_client=bqstorage_client), datetime_format=datetime_format)
+        except PermissionDenied as e:
+            client_factory.disable_bqstorage(e)
             result = query_job.result()
-            results = [dict(row) for row in result]
-            logger.info(f'Raw result: {results}')
-            return results
-        finally:
-            restore_ssl_settings(original_ssl_settings)
-    except GoogleAPIError as e:
-        logger.error(f"An error occurred while querying BigQuery: {e}")
-        return []
-    except Exception as ex:
-        logger.error(f"An unexpected error occurred: {ex}")
-        return []
+    return arrow_to_records(result.to_arrow(create_bqstorage_client=False), datetime_format=datetime_format)
+
+def execute(conn, query, label=None, window_days=None, datetime_format=None):
+    """
+    Run a stats query on connection() and return its rows as dicts. With
+    datetime_format the Arrow path formats TIMESTAMP columns, serialize the rows
+    with the same format through json_utils.dumps so both paths give the same
+    payload. label names the query in its job labels and in the cache hit rate.
+    """
+    client, location, statement_timeout = conn
+    query, query_parameters = bind_query(query, location, window_days)
+    reserved = check_bytes_budget(client, query, query_parameters) if Config.BIGQUERY_STATS_DRY_RUN else 0
+    try:
+        query_job = client.query(query, job_config=query_job_config(query_parameters, label, statement_timeout))
+        results = fetch_records(query_job, datetime_format)
+    except Exception as e:
+        # Failed jobs are not billed, the reservation would otherwise refuse later metrics of the refresh
+        if reserved:
+            release_reserved(reserved)
+        if isinstance(e, GoogleAPIError) and any(
+                error.get('reason') == 'bytesBilledLimitExceeded' for error in getattr(e, 'errors', None) or []):
+            for totals in _tracked():
+                totals['exceeded'] = f'query went over BIGQUERY_STATS_MAX_BYTES_PER_QUERY: {e}'
+        raise
+    logger.info(f'Fetched {len(results)} rows')
+    record_bytes_billed(query_job, reserved)
+    if label:
+        record_cache_hit(label, query_job.cache_hit)
+    return results
+
+def run_bigquery_query(query, raise_errors=False, window_days=None, datetime_format=None, label=None):
+    """Run a stats query through the BigQuery adapter, [] when it fails or is refused unless raise_errors."""
+    return get_adapter('bigquery').run_query(query, label=label, raise_errors=raise_errors,
+                                             window_days=window_days, datetime_format=datetime_format)
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
 
 def convert_types(obj):
     if isinstance(obj, list):
@@ -133,7 +480,7 @@ def convert_types(obj):
     elif isinstance(obj, dict):
         return {k: convert_types(v) for k, v in obj.items()}
     elif isinstance(obj, datetime):
-        return obj.strftime('%Y-%m-%d %H:%M:%S')
+        return obj.strftime(DATETIME_FORMAT)
     else:
         return obj
 
@@ -143,7 +490,7 @@ def get_dataset_count():
         query = """
         SELECT COUNT(*) AS dataset_count FROM `{location}.INFORMATION_SCHEMA.SCHEMATA`;
         """
-        results = run_bigquery_query(query)
+        results = run_bigquery_query(query, label='dataset_count')
         logger.debug(f'Raw result for dataset_count: {results}')
         if not results:
             return None
@@ -158,7 +505,7 @@ def get_table_count():
         query = """
         SELECT COUNT(*) AS table_count FROM `{location}.INFORMATION_SCHEMA.TABLES`;
         """
-        results = run_bigquery_query(query)
+        results = run_bigquery_query(query, label='table_count')
         logger.debug(f'Raw result for table_count: {results}')
         if not results:
             return None
@@ -180,13 +527,13 @@ def get_all_query_gb_cost():
     result = results[0]['total_query_cost_gb']
     return result
 
-def get_total_query_executed():
+def get_total_query_executed(window_days=None):
     try:
         logger.info('Getting total queries executed...')
         query = """
-            SELECT COUNT(*) AS total_queries_executed FROM `{location}.INFORMATION_SCHEMA.JOBS_BY_PROJECT` WHERE job_type = 'QUERY'
+            SELECT COUNT(*) AS total_queries_executed FROM `{location}.INFORMATION_SCHEMA.JOBS_BY_PROJECT` WHERE job_type = 'QUERY' AND {window}
         """
-        results = run_bigquery_query(query)
+        results = run_bigquery_query(query, window_days=window_days, label='total_query_executed')
         logger.debug(f'Raw result for total_query_executed: {results}')
         if not results:
             return None
@@ -195,13 +542,13 @@ def get_total_query_executed():
         logger.error(f'Error in get_total_query_executed: {e}')
         return None
 
-def get_avg_execution_time_seconds():
+def get_avg_execution_time_seconds(window_days=None):
     try:
         logger.info('Getting average execution time (seconds)...')
         query = """
-        SELECT ROUND(AVG(TIMESTAMP_DIFF(end_time, start_time, SECOND)), 2) AS avg_execution_time_seconds FROM `{location}`.INFORMATION_SCHEMA.JOBS_BY_PROJECT WHERE job_type = 'QUERY' AND end_time IS NOT NULL;
+        SELECT ROUND(AVG(TIMESTAMP_DIFF(end_time, start_time, SECOND)), 2) AS avg_execution_time_seconds FROM `{location}`.INFORMATION_SCHEMA.JOBS_BY_PROJECT WHERE job_type = 'QUERY' AND end_time IS NOT NULL AND {window};
         """
-        results = run_bigquery_query(query)
+        results = run_bigquery_query(query, window_days=window_days, label='avg_execution_time_seconds')
         logger.debug(f'Raw result for avg_execution_time_seconds: {results}')
         if not results:
             return None
@@ -210,39 +557,39 @@ def get_avg_execution_time_seconds():
         logger.error(f'Error in get_avg_execution_time_seconds: {e}')
         return None
 
-def get_query_cost_by_month():
+def get_query_cost_by_month(window_days=None):
     try:
         logger.info('Getting query cost by month...')
         query = """
-        SELECT FORMAT_TIMESTAMP('%Y-%m', creation_time) AS month, COUNT(*) AS query_count, ROUND(SUM(total_bytes_billed) / 1073741824, 2) AS total_cost_gb FROM `{location}.INFORMATION_SCHEMA.JOBS_BY_PROJECT` WHERE job_type = 'QUERY' AND DATE(creation_time) >= DATE_SUB(CURRENT_DATE(), INTERVAL 6 MONTH) GROUP BY month ORDER BY month
+        SELECT FORMAT_TIMESTAMP('%Y-%m', creation_time) AS month, COUNT(*) AS query_count, ROUND(SUM(total_bytes_billed) / 1073741824, 2) AS total_cost_gb FROM `{location}.INFORMATION_SCHEMA.JOBS_BY_PROJECT` WHERE job_type = 'QUERY' AND DATE(creation_time) >= DATE_SUB({today}, INTERVAL 6 MONTH) AND {window} GROUP BY month ORDER BY month
         """
-        results = run_bigquery_query(query)
+        results = run_bigquery_query(query, window_days=window_days, datetime_format=DATETIME_FORMAT, label='query_cost_by_months_chart')
         logger.debug(f'Raw result for query_cost_by_month: {results}')
-        return json.dumps(convert_types(results))
+        return dumps(results, datetime_format=DATETIME_FORMAT)
     except Exception as e:
         logger.error(f'Error in get_query_cost_by_month: {e}')
-        return json.dumps([])
+        return dumps([])
 
-def get_query_cost_for_last_30_days():
+def get_query_cost_for_last_30_days(window_days=None):
     try:
         logger.info('Getting query cost for last 30 days...')
         query = """
-        SELECT FORMAT_TIMESTAMP('%Y-%m-%d', creation_time, 'UTC') AS day, COUNT(*) AS query_count, ROUND(SUM(total_bytes_billed) / 1073741824, 2) AS total_cost_gb FROM `{location}.INFORMATION_SCHEMA.JOBS_BY_PROJECT` WHERE job_type = 'QUERY' AND creation_time >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 30 DAY) GROUP BY day ORDER BY day
+        SELECT FORMAT_TIMESTAMP('%Y-%m-%d', creation_time, 'UTC') AS day, COUNT(*) AS query_count, ROUND(SUM(total_bytes_billed) / 1073741824, 2) AS total_cost_gb FROM `{location}.INFORMATION_SCHEMA.JOBS_BY_PROJECT` WHERE job_type = 'QUERY' AND creation_time >= TIMESTAMP_SUB({now}, INTERVAL 30 DAY) AND {window} GROUP BY day ORDER BY day
         """
-        results = run_bigquery_query(query)
+        results = run_bigquery_query(query, window_days=window_days, datetime_format=DATETIME_FORMAT, label='query_cost_by_days_chart')
         logger.debug(f'Raw result for query_cost_for_last_30_days: {results}')
-        return json.dumps(convert_types(results))
+        return dumps(results, datetime_format=DATETIME_FORMAT)
     except Exception as e:
         logger.error(f'Error in get_query_cost_for_last_30_days: {e}')
-        return json.dumps([])
+        return dumps([])
 
-def get_failure_rate_percentage():
+def get_failure_rate_percentage(window_days=None):
     try:
         logger.info('Getting failure rate percentage...')
         query = """
-        SELECT ROUND(100 * COUNTIF(error_result IS NOT NULL) / COUNT(*), 2) AS query_failure_rate_percentage FROM `{location}`.INFORMATION_SCHEMA.JOBS_BY_PROJECT WHERE job_type = 'QUERY'
+        SELECT ROUND(SAFE_DIVIDE(100 * COUNTIF(error_result IS NOT NULL), COUNT(*)), 2) AS query_failure_rate_percentage FROM `{location}`.INFORMATION_SCHEMA.JOBS_BY_PROJECT WHERE job_type = 'QUERY' AND {window}
         """
-        results = run_bigquery_query(query)
+        results = run_bigquery_query(query, window_days=window_days, label='failure_rate_percentage')
         logger.debug(f'Raw result for failure_rate_percentage: {results}')
         if not results:
             return None
@@ -251,45 +598,190 @@ def get_failure_rate_percentage():
         logger.error(f'Error in get_failure_rate_percentage: {e}')
         return None
 
-def get_total_cost_gb_by_users():
+def get_total_cost_gb_by_users(window_days=None):
     try:
         logger.info('Getting total cost GB by users...')
         query = """
-        SELECT user_email, ROUND(SUM(total_bytes_billed) / 1073741824, 2) AS total_cost_gb, COUNT(job_id) AS total_queries, ROUND(AVG(total_bytes_billed) / 1073741824, 2) AS avg_query_cost_gb, MIN(creation_time) AS first_query_date, MAX(creation_time) AS last_query_date, ROUND(SUM(TIMESTAMP_DIFF(end_time, start_time, SECOND)) / 60, 2) AS total_execution_time_min, ROUND(AVG(TIMESTAMP_DIFF(end_time, start_time, SECOND)), 2) AS avg_execution_time_sec, SUM(CASE WHEN state = 'DONE' THEN 1 ELSE 0 END) AS success_count, SUM(CASE WHEN error_result is not null THEN 1 ELSE 0 END) AS failure_count FROM `{location}`.INFORMATION_SCHEMA.JOBS_BY_PROJECT WHERE job_type = 'QUERY' GROUP BY user_email ORDER BY total_cost_gb DESC LIMIT 15
+        SELECT user_email, ROUND(SUM(total_bytes_billed) / 1073741824, 2) AS total_cost_gb, COUNT(job_id) AS total_queries, ROUND(AVG(total_bytes_billed) / 1073741824, 2) AS avg_query_cost_gb, MIN(creation_time) AS first_query_date, MAX(creation_time) AS last_query_date, ROUND(SUM(TIMESTAMP_DIFF(end_time, start_time, SECOND)) / 60, 2) AS total_execution_time_min, ROUND(AVG(TIMESTAMP_DIFF(end_time, start_time, SECOND)), 2) AS avg_execution_time_sec, SUM(CASE WHEN state = 'DONE' THEN 1 ELSE 0 END) AS success_count, SUM(CASE WHEN error_result is not null THEN 1 ELSE 0 END) AS failure_count FROM `{location}`.INFORMATION_SCHEMA.JOBS_BY_PROJECT WHERE job_type = 'QUERY' AND {window} GROUP BY user_email ORDER BY total_cost_gb DESC LIMIT 15
         """
-        results = run_bigquery_query(query)
+        results = run_bigquery_query(query, window_days=window_days, datetime_format=DATETIME_FORMAT, label='total_cost_gb_by_users')
         logger.debug(f'Raw result for total_cost_gb_by_users: {results}')
-        results = convert_types(results)
-        return json.dumps(results)
+        return dumps(results, datetime_format=DATETIME_FORMAT)
     except Exception as e:
         logger.error(f'Error in get_total_cost_gb_by_users: {e}')
-        return json.dumps([])
+        return dumps([])
 
-def get_total_cost_gb_by_table():
+def get_total_cost_gb_by_table(window_days=None):
     try:
         logger.info('Getting total cost GB by table...')
         query = """
-        SELECT destination_table.dataset_id AS dataset, destination_table.table_id AS table, ROUND(SUM(total_bytes_billed) / 1073741824, 2) AS total_cost_gb, COUNT(job_id) AS total_queries, ROUND(AVG(total_bytes_billed) / 1073741824, 2) AS avg_query_cost_gb, MIN(p.creation_time) AS first_query_date, MAX(p.creation_time) AS last_query_date, ROUND(SUM(TIMESTAMP_DIFF(end_time, start_time, SECOND)) / 60, 2) AS total_execution_time_min, ROUND(AVG(TIMESTAMP_DIFF(end_time, start_time, SECOND)), 2) AS avg_execution_time_sec, SUM(CASE WHEN state = 'DONE' THEN 1 ELSE 0 END) AS success_count, SUM(CASE WHEN error_result is not null THEN 1 ELSE 0 END) AS failure_count FROM `{location}.INFORMATION_SCHEMA.JOBS_BY_PROJECT` p JOIN `{location}.INFORMATION_SCHEMA.TABLES` t on t.table_schema =p.destination_table.dataset_id and t.table_name = p.destination_table.table_id WHERE t.table_type = 'BASE TABLE' AND job_type = 'QUERY' AND destination_table.dataset_id IS NOT NULL AND destination_table.table_id IS NOT NULL GROUP BY dataset, table ORDER BY total_cost_gb desc
+        SELECT destination_table.dataset_id AS dataset, destination_table.table_id AS table, ROUND(SUM(total_bytes_billed) / 1073741824, 2) AS total_cost_gb, COUNT(job_id) AS total_queries, ROUND(AVG(total_bytes_billed) / 1073741824, 2) AS avg_query_cost_gb, MIN(p.creation_time) AS first_query_date, MAX(p.creation_time) AS last_query_date, ROUND(SUM(TIMESTAMP_DIFF(end_time, start_time, SECOND)) / 60, 2) AS total_execution_time_min, ROUND(AVG(TIMESTAMP_DIFF(end_time, start_time, SECOND)), 2) AS avg_execution_time_sec, SUM(CASE WHEN state = 'DONE' THEN 1 ELSE 0 END) AS success_count, SUM(CASE WHEN error_result is not null THEN 1 ELSE 0 END) AS failure_count FROM `{location}.INFORMATION_SCHEMA.JOBS_BY_PROJECT` p JOIN `{location}.INFORMATION_SCHEMA.TABLES` t on t.table_schema =p.destination_table.dataset_id and t.table_name = p.destination_table.table_id WHERE t.table_type = 'BASE TABLE' AND job_type = 'QUERY' AND p.{window} AND destination_table.dataset_id IS NOT NULL AND destination_table.table_id IS NOT NULL GROUP BY dataset, table ORDER BY total_cost_gb desc
         """
-        results = run_bigquery_query(query)
+        results = run_bigquery_query(query, window_days=window_days, datetime_format=DATETIME_FORMAT, label='total_cost_gb_by_table')
         logger.debug(f'Raw result for total_cost_gb_by_table: {results}')
-        results = convert_types(results)
-        return json.dumps(results)
+        return dumps(results, datetime_format=DATETIME_FORMAT)
     except Exception as e:
         logger.error(f'Error in get_total_cost_gb_by_table: {e}')
-        return json.dumps([])
-
-# Debug Local testing
-# if __name__ == "__main__":
-#     try:
-#         print("Dataset count:", get_dataset_count())
-#         print("Table count:", get_table_count())
-#         print("Total queries executed:", get_total_query_executed())
-#         print("Average execution time (seconds):", get_avg_execution_time_seconds())
-#         print("Failure rate percentage:", get_failure_rate_percentage())
-#         print("Query cost by months chart:", get_query_cost_by_month())
-#         print("Query cost by days chart:", get_query_cost_for_last_30_days())
-#         print("Total cost GB by users:", get_total_cost_gb_by_users())
-#         print("Total cost GB by table:", get_total_cost_gb_by_table())
-#     except Exception as e:
-#         logger.error(f'Error in main: {e}') 
\ No newline at end of file
+        return dumps([])
+
+def _gb(value):
+    return round(value / 1073741824, 2) if value is not None else None
+
+def _round(value, digits=2):
+    return round(value, digits) if value is not None else None
+
+def _group_row(row, labels):
+    return {
+        **labels,
+        'total_cost_gb': _gb(row['bytes_billed']),
+        'total_queries': row['query_count'],
+        'avg_query_cost_gb': _gb(row['avg_bytes_billed']),
+        'first_query_date': row['first_query_date'],
+        'last_query_date': row['last_query_date'],
+        'total_execution_time_min': _round(row['execution_seconds'] / 60) if row['execution_seconds'] is not None else None,
+        'avg_execution_time_sec': _round(row['avg_execution_seconds']),
+        'success_count': row['success_count'],
+        'failure_count': row['failure_count']
+    }
+
+def get_all_stats(window_days=None):
+    """
+    Consolidated mode: every JOBS_BY_PROJECT card and series from a single scan.
+
+    One GROUPING SETS query returns the totals, month, day, user and
+    destination table groups in one result, the dataset count and the table
+    list come from the (metadata only) SCHEMATA and TABLES views. Job stats
+    cover the last window_days (BIGQUERY_STATS_WINDOW_DAYS by default).
+    Returns the same keys as the per-metric functions, or None on failure.
+    """
+    try:
+        logger.info('Getting all stats in one scan...')
+        jobs_query = """
+        SELECT
+            GROUPING(month) = 0 AS by_month,
+            GROUPING(day) = 0 AS by_day,
+            GROUPING(user_email) = 0 AS by_user,
+            GROUPING(dataset) = 0 AS by_table,
+            month, day, user_email, dataset, table_name,
+            COUNT(*) AS query_count,
+            COUNTIF(error_result IS NOT NULL) AS failure_count,
+            COUNTIF(state = 'DONE') AS success_count,
+            IFNULL(SUM(total_bytes_billed), 0) AS bytes_billed,
+            AVG(total_bytes_billed) AS avg_bytes_billed,
+            SUM(TIMESTAMP_DIFF(end_time, start_time, SECOND)) AS execution_seconds,
+            AVG(TIMESTAMP_DIFF(end_time, start_time, SECOND)) AS avg_execution_seconds,
+            MIN(creation_time) AS first_query_date,
+            MAX(creation_time) AS last_query_date
+        FROM (
+            SELECT
+                user_email, creation_time, start_time, end_time, state, error_result, total_bytes_billed,
+                IF(DATE(creation_time) >= DATE_SUB({today}, INTERVAL 6 MONTH), FORMAT_TIMESTAMP('%Y-%m', creation_time), NULL) AS month,
+                IF(creation_time >= TIMESTAMP_SUB({now}, INTERVAL 30 DAY), FORMAT_TIMESTAMP('%Y-%m-%d', creation_time, 'UTC'), NULL) AS day,
+                destination_table.dataset_id AS dataset,
+                destination_table.table_id AS table_name
+            FROM `{location}.INFORMATION_SCHEMA.JOBS_BY_PROJECT`
+            WHERE job_type = 'QUERY' AND {window}
+        )
+        GROUP BY GROUPING SETS ((), (month), (day), (user_email), (dataset, table_name))
+        """
+        with track_bytes_billed() as billing:
+            rows = run_bigquery_query(jobs_query, raise_errors=True, window_days=window_days, datetime_format=DATETIME_FORMAT, label='all_stats')
+            dataset_rows = run_bigquery_query("""
+            SELECT COUNT(*) AS dataset_count FROM `{location}.INFORMATION_SCHEMA.SCHEMATA`;
+            """, raise_errors=True, label='all_stats_datasets')
+            table_rows = run_bigquery_query("""
+            SELECT table_schema, table_name, table_type FROM `{location}.INFORMATION_SCHEMA.TABLES`;
+            """, raise_errors=True, label='all_stats_tables')
+        logger.info(f"Consolidated stats billed {billing['bytes_billed']} bytes over {billing['queries']} queries")
+
+        base_tables = {(t['table_schema'], t['table_name']) for t in table_rows if t['table_type'] == 'BASE TABLE'}
+        totals = next((r for r in rows if not (r['by_month'] or r['by_day'] or r['by_user'] or r['by_table'])), None)
+        query_count = totals['query_count'] if totals else 0
+
+        months = sorted((r for r in rows if r['by_month'] and r['month'] is not None), key=lambda r: r['month'])
+        days = sorted((r for r in rows if r['by_day'] and r['day'] is not None), key=lambda r: r['day'])
+        users = sorted((r for r in rows if r['by_user']), key=lambda r: r['bytes_billed'], reverse=True)[:15]
+        tables = sorted(
+            (r for r in rows if r['by_table'] and (r['dataset'], r['table_name']) in base_tables),
+            key=lambda r: r['bytes_billed'], reverse=True)
+
+        return {
+            # cards
+            'dataset_count': dataset_rows[0]['dataset_count'] if dataset_rows else None,
+            'total_query_executed': query_count if totals else None,
+            'table_count': len(table_rows),
+            'avg_execution_time_seconds': _round(totals['avg_execution_seconds']) if totals else None,
+            'failure_rate_percentage': round(100 * totals['failure_count'] / query_count, 2) if query_count else None,
+            # charts
+            'query_cost_by_months_chart': dumps([
+                {'month': r['month'], 'query_count': r['query_count'], 'total_cost_gb': _gb(r['bytes_billed'])} for r in months]),
+            'query_cost_by_days_chart': dumps([
+                {'day': r['day'], 'query_count': r['query_count'], 'total_cost_gb': _gb(r['bytes_billed'])} for r in days]),
+            # tables
+            'total_cost_gb_by_users': dumps([_group_row(r, {'user_email': r['user_email']}) for r in users], datetime_format=DATETIME_FORMAT),
+            'total_cost_gb_by_table': dumps([_group_row(r, {'dataset': r['dataset'], 'table': r['table_name']}) for r in tables], datetime_format=DATETIME_FORMAT)
+        }
+    except Exception as e:
+        logger.error(f'Error in get_all_stats: {e}')
+        return None
+
+def compare_stats_modes():
+    """Run both collection modes once and return the bytes billed by each."""
+    per_metric_functions = [
+        get_dataset_count, get_table_count, get_total_query_executed, get_avg_execution_time_seconds,
+        get_failure_rate_percentage, get_query_cost_by_month, get_query_cost_for_last_30_days,
+        get_total_cost_gb_by_users, get_total_cost_gb_by_table
+    ]
+    with track_bytes_billed() as per_metric:
+        for function in per_metric_functions:
+            function()
+    with track_bytes_billed() as consolidated:
+        get_all_stats()
+    return {'per_metric': per_metric, 'consolidated': consolidated}
+
+def get_console_query_costs(days=1):
+    """Cost of the queries this console's service account ran over the last days, from JOBS_BY_PROJECT."""
+    try:
+        query = f"""
+        SELECT COUNT(*) AS queries, IFNULL(SUM(total_bytes_processed), 0) AS bytes_scanned, IFNULL(SUM(TIMESTAMP_DIFF(end_time, start_time, MILLISECOND)), 0) AS elapsed_ms, COUNTIF(cache_hit) AS cache_hits, IFNULL(SUM(total_bytes_billed), 0) AS bytes_billed, IFNULL(SUM(total_slot_ms), 0) AS slot_ms FROM `{{location}}.INFORMATION_SCHEMA.JOBS_BY_PROJECT` WHERE creation_time >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {int(days)} DAY) AND user_email = SESSION_USER()
+        """
+        results = run_bigquery_query(query, raise_errors=True)
+        return results[0] if results else None
+    except Exception as e:
+        logger.error(f'Error in get_console_query_costs: {e}')
+        return None
+
+def get_daily_rollup(since_day):
+    """Per day x user x destination table query aggregates since since_day, or None on failure."""
+    try:
+        logger.info(f'Getting daily rollup since {since_day}...')
+        query = f"""
+        SELECT
+            DATE(creation_time) AS day,
+            IFNULL(user_email, '') AS user_name,
+            IF(destination_table.dataset_id IS NULL OR STARTS_WITH(destination_table.dataset_id, '_'), '', destination_table.dataset_id) AS dataset,
+            IF(destination_table.dataset_id IS NULL OR STARTS_WITH(destination_table.dataset_id, '_'), '', IFNULL(destination_table.table_id, '')) AS table_name,
+            COUNT(*) AS query_count,
+            COUNTIF(error_result IS NOT NULL) AS failure_count,
+            COUNTIF(end_time IS NOT NULL) AS finished_count,
+            IFNULL(SUM(total_bytes_billed), 0) AS bytes_billed,
+            IFNULL(SUM(TIMESTAMP_DIFF(end_time, start_time, SECOND)), 0) AS execution_seconds,
+            MIN(creation_time) AS first_query_time,
+            MAX(creation_time) AS last_query_time
+        FROM `{{location}}.INFORMATION_SCHEMA.JOBS_BY_PROJECT`
+        WHERE job_type = 'QUERY' AND creation_time >= TIMESTAMP('{since_day.isoformat()}')
+        GROUP BY day, user_name, dataset, table_name
+        """
+        return run_bigquery_query(query, raise_errors=True)
+    except Exception as e:
+        logger.error(f'Error in get_daily_rollup: {e}')
+        return None
+
+# Debug Local testing: python -m app.datawarehouse_stats.bigquery_stats [--compare-modes]
+if __name__ == "__main__":
+    import sys
+    if '--compare-modes' in sys.argv:
+        for mode, billing in compare_stats_modes().items():
+            print(f"{mode}: {billing['bytes_billed']} bytes billed over {billing['queries']} queries")
+    else:
+        print(json.dumps(get_all_stats(), indent=2))
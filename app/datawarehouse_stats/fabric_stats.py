@@ -1,85 +1,142 @@
-import os
 import pyodbc
-import json
-from datetime import datetime
 import logging
+from contextlib import contextmanager
+from app.config import Config
+from app.json_utils import dumps
+from app.datawarehouse_stats.secret_provider import get_secret_provider
+from app.datawarehouse_stats.adapters import get_adapter
+from app.datawarehouse_stats.query_metrics import query_tag
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 logger = logging.getLogger(__name__)
 
-def load_fabric_secrets():
-    secrets_path = '/fastbi/secrets/fabric/'
-    required_secrets = [
-        'FABRIC_SERVER',
-        'FABRIC_PORT',
-        'FABRIC_DATABASE',
-        'FABRIC_USER',
-        'FABRIC_PASSWORD'
-    ]
-    secrets = {}
+# ODBC driver manager connection pooling, must be set before the first connect
+pyodbc.pooling = Config.FABRIC_ODBC_POOLING
+
+FABRIC_REQUIRED_SECRETS = [
+    'FABRIC_SERVER',
+    'FABRIC_PORT',
+    'FABRIC_DATABASE',
+    'FABRIC_USER',
+    'FABRIC_PASSWORD'
+]
+
+def _on_secrets_changed(provider):
+    # The new connection string gets its own driver-manager pool, the old pooled connections time out unused
+    logger.warning('Fabric secrets changed, new connections use the updated credentials')
+
+def get_secrets():
+    """Fabric secrets, cached and re-read only after the secret files change."""
+    provider = get_secret_provider('fabric', FABRIC_REQUIRED_SECRETS)
+    provider.subscribe(_on_secrets_changed)
     try:
-        for secret_name in required_secrets:
-            secret_path = os.path.join(secrets_path, secret_name)
-            try:
-                with open(secret_path, 'r') as f:
-                    secrets[secret_name] = f.read().strip()
-            except Exception as e:
-                logger.error(f"Error reading secret {secret_name}: {e}")
-                raise
-        return secrets
+        return provider.get_all()
     except Exception as e:
         logger.error(f"Error loading Fabric secrets: {e}")
         raise
 
-def get_connection():
-    secrets = load_fabric_secrets()
+def get_connection(statement_timeout=None):
+    secrets = get_secrets()
     try:
         conn_str = (
-            f"DRIVER={{ODBC Driver 17 for SQL Server}};"
+            f"DRIVER={{{Config.FABRIC_ODBC_DRIVER}}};"
             f"SERVER={secrets['FABRIC_SERVER']},{secrets['FABRIC_PORT']};"
             f"DATABASE={secrets['FABRIC_DATABASE']};"
             f"UID={secrets['FABRIC_USER']};"
-            f"PWD={secrets['FABRIC_PASSWORD']}"
+            f"PWD={secrets['FABRIC_PASSWORD']};"
+            f"APP={query_tag()}"
         )
-        conn = pyodbc.connect(conn_str)
-        logger.info('Successfully connected to Fabric!')
+        # With pooling the driver manager hands back an idle connection with the same string
+        conn = pyodbc.connect(conn_str, timeout=Config.FABRIC_LOGIN_TIMEOUT)
+        # Query timeout applied by the driver to every statement on this connection
+        conn.timeout = statement_timeout or 0
+        logger.debug('Connected to Fabric')
         return conn
     except Exception as e:
         logger.error(f'Failed to connect to Fabric: {e}')
         raise
 
-def run_query(query):
-    try:
-        conn = get_connection()
-        try:
-            cur = conn.cursor()
-            logger.debug(f'Executing query: {query.strip().splitlines()[0]}...')
-            cur.execute(query)
-            columns = [col[0] for col in cur.description]
-            results = [dict(zip(columns, row)) for row in cur.fetchall()]
-            logger.debug(f'Raw result: {results}')
+def fetch_rows(cur):
+    """Rows of the current result set as dicts, fetched FABRIC_FETCH_ARRAYSIZE rows per round trip."""
+    cur.arraysize = Config.FABRIC_FETCH_ARRAYSIZE
+    columns = [col[0] for col in cur.description]
+    results = []
+    while True:
+        rows = cur.fetchmany(cur.arraysize)
+        if not rows:
             return results
-        finally:
-            conn.close()
-    except Exception as e:
-        logger.error(f'Error running query: {e}\nQuery: {query}')
-        return []
-
-def convert_types(obj):
-    if isinstance(obj, list):
-        return [convert_types(i) for i in obj]
-    elif isinstance(obj, dict):
-        return {k: convert_types(v) for k, v in obj.items()}
-    elif isinstance(obj, datetime):
-        return obj.strftime('%Y-%m-%d %H:%M:%S')
-    else:
-        return obj
+        results.extend(dict(zip(columns, row)) for row in rows)
+
+@contextmanager
+def connection(statement_timeout=None):
+    """A connection for the block, handed back to the ODBC pool when pooling is on."""
+    conn = get_connection(statement_timeout)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def execute(conn, query, label=None):
+    """Run a query and return its rows as dicts, the session is tagged through APP= instead of per statement."""
+    cur = conn.cursor()
+    cur.execute(query)
+    return fetch_rows(cur)
+
+def execute_batch(conn, queries):
+    """
+    Send every statement of {name: query} as one batch and walk the result sets
+    with nextset(), one round trip for all of them. Returns {name: rows}.
+    """
+    batch = 'SET NOCOUNT ON;\n' + ';\n'.join(query.strip().rstrip(';') for query in queries.values()) + ';'
+    cur = conn.cursor()
+    cur.execute(batch)
+    results = {}
+    for name in queries:
+        # Skip any result-less set (row counts) before the next SELECT
+        while cur.description is None and cur.nextset():
+            pass
+        results[name] = fetch_rows(cur)
+        cur.nextset()
+    return results
+
+def run_query(query, label=None):
+    """Run a query through the Fabric adapter, [] when it fails."""
+    return get_adapter('fabric').run_query(query, label=label)
+
+def run_batch(queries):
+    """Run {name: query} as one batch through the Fabric adapter, {} when it fails."""
+    return get_adapter('fabric').run_batch(queries)
+
+DATASET_COUNT_QUERY = "SELECT COUNT(*) AS dataset_count FROM sys.databases"
+
+TABLE_COUNT_QUERY = "SELECT COUNT(*) AS table_count FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_TYPE='BASE TABLE'"
+
+TABLE_COSTS_QUERY = """
+        SELECT TABLE_SCHEMA, TABLE_NAME, SUM(CAST(reserved_page_count AS BIGINT)) * 8.0 / 1024 AS size_mb
+        FROM sys.dm_db_partition_stats AS ps
+        JOIN INFORMATION_SCHEMA.TABLES AS t ON OBJECT_NAME(ps.object_id) = t.TABLE_NAME
+        WHERE t.TABLE_TYPE = 'BASE TABLE'
+        GROUP BY TABLE_SCHEMA, TABLE_NAME
+        ORDER BY size_mb DESC
+        """
+
+def transform_table_costs(rows):
+    # Standardize output: dataset, table, and metrics
+    transformed = []
+    for row in rows:
+        dataset = row.get('TABLE_SCHEMA') or 'system'
+        table = row.get('TABLE_NAME') or 'unknown'
+        transformed.append({
+            'dataset': dataset,
+            'table': table,
+            'size_mb': row.get('size_mb')
+        })
+    return transformed
 
 def get_dataset_count():
     try:
         logger.info('Getting dataset count...')
-        query = "SELECT COUNT(*) AS dataset_count FROM sys.databases"
-        result = run_query(query)
+        result = run_query(DATASET_COUNT_QUERY, label='dataset_count')
         logger.debug(f'Raw result for dataset_count: {result}')
         if not result:
             return None
@@ -91,8 +148,7 @@ def get_dataset_count():
 def get_table_count():
     try:
         logger.info('Getting table count...')
-        query = "SELECT COUNT(*) AS table_count FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_TYPE='BASE TABLE'"
-        result = run_query(query)
+        result = run_query(TABLE_COUNT_QUERY, label='table_count')
         logger.debug(f'Raw result for table_count: {result}')
         if not result:
             return None
@@ -132,57 +188,91 @@ def get_query_cost_by_month():
     try:
         logger.info('Getting query cost by month...')
         # Placeholder: Not all SQL Server/Fabric environments track query history by default
-        return json.dumps([])
+        return dumps([])
     except Exception as e:
         logger.error(f'Error in get_query_cost_by_month: {e}')
-        return json.dumps([])
+        return dumps([])
 
 def get_query_cost_for_last_30_days():
     try:
         logger.info('Getting query cost for last 30 days...')
         # Placeholder: Not all SQL Server/Fabric environments track query history by default
-        return json.dumps([])
+        return dumps([])
     except Exception as e:
         logger.error(f'Error in get_query_cost_for_last_30_days: {e}')
-        return json.dumps([])
+        return dumps([])
 
 def get_total_cost_gb_by_users():
     try:
         logger.info('Getting total cost GB by users...')
         # Placeholder: Not all SQL Server/Fabric environments track query history by default
-        return json.dumps([])
+        return dumps([])
     except Exception as e:
         logger.error(f'Error in get_total_cost_gb_by_users: {e}')
-        return json.dumps([])
+        return dumps([])
 
 def get_total_cost_gb_by_table():
     try:
         logger.info('Getting total cost GB by table...')
-        query = """
-        SELECT TABLE_SCHEMA, TABLE_NAME, SUM(CAST(reserved_page_count AS BIGINT)) * 8.0 / 1024 AS size_mb
-        FROM sys.dm_db_partition_stats AS ps
-        JOIN INFORMATION_SCHEMA.TABLES AS t ON OBJECT_NAME(ps.object_id) = t.TABLE_NAME
-        WHERE t.TABLE_TYPE = 'BASE TABLE'
-        GROUP BY TABLE_SCHEMA, TABLE_NAME
-        ORDER BY size_mb DESC
-        """
-        results = run_query(query)
+        results = run_query(TABLE_COSTS_QUERY, label='total_cost_gb_by_table')
         logger.debug(f'Raw result for total_cost_gb_by_table: {results}')
-        results = convert_types(results)
-        # Standardize output: dataset, table, and metrics
-        transformed = []
-        for row in results:
-            dataset = row.get('TABLE_SCHEMA') or 'system'
-            table = row.get('TABLE_NAME') or 'unknown'
-            transformed.append({
-                'dataset': dataset,
-                'table': table,
-                'size_mb': row.get('size_mb')
-            })
-        return json.dumps(transformed)
+        return dumps(transform_table_costs(results))
     except Exception as e:
         logger.error(f'Error in get_total_cost_gb_by_table: {e}')
-        return json.dumps([])
+        return dumps([])
+
+def get_all_stats():
+    """
+    Batched mode: the metadata counts and table sizes sent as one batch over a
+    single pooled connection, returned under the stats.html keys, or None on
+    failure. Query history metrics stay placeholders like their collectors.
+    """
+    try:
+        results = run_batch({
+            'dataset_count': DATASET_COUNT_QUERY,
+            'table_count': TABLE_COUNT_QUERY,
+            'table_costs': TABLE_COSTS_QUERY
+        })
+        if not results:
+            return None
+        dataset_count = results['dataset_count'][0] if results['dataset_count'] else {}
+        table_count = results['table_count'][0] if results['table_count'] else {}
+        return {
+            # cards
+            'dataset_count': dataset_count.get('dataset_count'),
+            'table_count': table_count.get('table_count'),
+            'total_query_executed': get_total_query_executed(),
+            'avg_execution_time_seconds': get_avg_execution_time_seconds(),
+            'failure_rate_percentage': get_failure_rate_percentage(),
+            # charts
+            'query_cost_by_months_chart': get_query_cost_by_month(),
+            'query_cost_by_days_chart': get_query_cost_for_last_30_days(),
+            # tables
+            'total_cost_gb_by_users': get_total_cost_gb_by_users(),
+            'total_cost_gb_by_table': dumps(transform_table_costs(results['table_costs']))
+        }
+    except Exception as e:
+        logger.error(f'Error in get_all_stats: {e}')
+        return None
+
+def get_console_query_costs(days=1):
+    """Cost of the queries this console's login ran over the last days, from queryinsights.exec_requests_history."""
+    try:
+        query = f"""
+        SELECT
+            COUNT(*) AS queries,
+            CAST(COALESCE(SUM(data_scanned_remote_storage_mb + data_scanned_memory_mb + data_scanned_disk_mb), 0) * 1048576 AS BIGINT) AS bytes_scanned,
+            COALESCE(SUM(CAST(total_elapsed_time_ms AS BIGINT)), 0) AS elapsed_ms
+        FROM queryinsights.exec_requests_history
+        WHERE start_time >= DATEADD(day, -{int(days)}, GETUTCDATE()) AND login_name = SUSER_SNAME()
+        """
+        results = run_query(query, label='console_query_costs')
+        if not results:
+            return None
+        return {**results[0], 'cache_hits': None}
+    except Exception as e:
+        logger.error(f'Error in get_console_query_costs: {e}')
+        return None
 
 # Debug Local testing
 # if __name__ == "__main__":
@@ -0,0 +1,75 @@
+"""
+Tags and elapsed time of the console's own warehouse queries.
+
+Snowflake, Redshift and Fabric sessions carry STATS_QUERY_TAG (QUERY_TAG,
+query_group / application_name, APP=) so the console's statements can be found
+in the warehouse's monitoring. Each tagged statement's elapsed time is added to
+a Redis hash shared by the web and Celery processes, read back by /stats/costs.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+QUERY_TIMINGS_KEY = 'stats_query_timings'
+
+
+def query_tag(label=None):
+    """Tag of a console query, e.g. `fastbi-console-stats:table_count`."""
+    return f"{Config.STATS_QUERY_TAG}:{label}" if label else Config.STATS_QUERY_TAG
+
+
+def statement_timeout_seconds():
+    """Per-statement timeout in seconds, None when STATS_STATEMENT_TIMEOUT_SECONDS is 0."""
+    return Config.STATS_STATEMENT_TIMEOUT_SECONDS or None
+
+
+def record_query_time(dwh_type, label, seconds, failed=False, redis_client=None):
+    """Add one statement's elapsed time to the shared per dwh x label counters."""
+    field = f"{dwh_type}:{label or 'query'}"
+    try:
+        pipe = (redis_client or Config.SESSION_REDIS).pipeline()
+        pipe.hincrby(QUERY_TIMINGS_KEY, f"{field}:queries", 1)
+        pipe.hincrbyfloat(QUERY_TIMINGS_KEY, f"{field}:seconds", round(seconds, 3))
+        if failed:
+            pipe.hincrby(QUERY_TIMINGS_KEY, f"{field}:failures", 1)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not record the elapsed time of {field}: {e}")
+
+
+@contextmanager
+def timed_query(dwh_type, label):
+    """Record the elapsed time of the block as one statement, counted as failed when it raises."""
+    started = time.monotonic()
+    try:
+        yield
+    except Exception:
+        record_query_time(dwh_type, label, time.monotonic() - started, failed=True)
+        raise
+    record_query_time(dwh_type, label, time.monotonic() - started)
+
+
+def get_query_timings(dwh_type=None, redis_client=None):
+    """
+    Recorded timings as {dwh: {label: {queries, failures, total_seconds, avg_seconds}}},
+    only for dwh_type when given.
+    """
+    raw = (redis_client or Config.SESSION_REDIS).hgetall(QUERY_TIMINGS_KEY) or {}
+    timings = {}
+    for key, value in raw.items():
+        key = key.decode() if isinstance(key, bytes) else key
+        dwh, label, measure = key.rsplit(':', 2)
+        if dwh_type and dwh != dwh_type:
+            continue
+        entry = timings.setdefault(dwh, {}).setdefault(label, {'queries': 0, 'failures': 0, 'total_seconds': 0.0})
+        if measure == 'seconds':
+            entry['total_seconds'] = round(float(value), 3)
+        else:
+            entry[measure] = int(value)
+    for labels in timings.values():
+        for entry in labels.values():
+            entry['avg_seconds'] = round(entry['total_seconds'] / entry['queries'], 3) if entry['queries'] else None
+    return timings
@@ -1,45 +1,40 @@
 import os
 import psycopg2
-import json
-from datetime import datetime
+import threading
+import weakref
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from psycopg2.pool import ThreadedConnectionPool
 import logging
+from app.config import Config
+from app.json_utils import dumps
+from app.datawarehouse_stats.secret_provider import get_secret_provider
+from app.datawarehouse_stats.adapters import get_adapter
+from app.datawarehouse_stats.query_metrics import query_tag
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 logger = logging.getLogger(__name__)
 
+REDSHIFT_REQUIRED_SECRETS = [
+    'REDSHIFT_DATABASE',
+    'REDSHIFT_USER',
+    'REDSHIFT_PASSWORD',
+    'REDSHIFT_HOST',
+    'REDSHIFT_PORT'
+]
+
+def get_redshift_secret_provider():
+    # Environment variables first, /fastbi/secrets/redshift/ files for the missing ones
+    provider = get_secret_provider('redshift', REDSHIFT_REQUIRED_SECRETS, env_first=True)
+    provider.subscribe(_retire_pool)
+    return provider
+
 def load_redshift_secrets():
-    # First try environment variables
-    secrets = {
-        'REDSHIFT_DATABASE': os.getenv('REDSHIFT_DATABASE'),
-        'REDSHIFT_USER': os.getenv('REDSHIFT_USER'),
-        'REDSHIFT_PASSWORD': os.getenv('REDSHIFT_PASSWORD'),
-        'REDSHIFT_HOST': os.getenv('REDSHIFT_HOST'),
-        'REDSHIFT_PORT': os.getenv('REDSHIFT_PORT')
-    }
-    
-    # If any secret is missing from env vars, try reading from files
-    if not all(secrets.values()):
-        secrets_path = '/fastbi/secrets/redshift/'
-        required_secrets = [
-            'REDSHIFT_DATABASE',
-            'REDSHIFT_USER',
-            'REDSHIFT_PASSWORD',
-            'REDSHIFT_HOST',
-            'REDSHIFT_PORT'
-        ]
-        try:
-            for secret_name in required_secrets:
-                if not secrets.get(secret_name):
-                    secret_path = os.path.join(secrets_path, secret_name)
-                    try:
-                        with open(secret_path, 'r') as f:
-                            secrets[secret_name] = f.read().strip()
-                    except Exception as e:
-                        logger.error(f"Error reading secret {secret_name}: {e}")
-                        raise
-        except Exception as e:
-            logger.error(f"Error loading Redshift secrets: {e}")
-            raise
+    try:
+        secrets = get_redshift_secret_provider().get_all()
+    except Exception as e:
+        logger.error(f"Error loading Redshift secrets: {e}")
+        raise
     
     # Validate all secrets are present
     missing_secrets = [k for k, v in secrets.items() if not v]
@@ -48,44 +43,195 @@ def load_redshift_secrets():
     
     return secrets
 
-def get_connection():
-    secrets = load_redshift_secrets()
+_pool = None
+_pool_pid = None
+# Reentrant: reading the secrets while building a pool may notify _retire_pool
+_pool_lock = threading.RLock()
+_checkout_slots = None
+# Pooled connections whose session settings are applied. Held weakly by object,
+# not by id(): a closed connection's id can be reused by the next one opened
+_prepared = weakref.WeakSet()
+# Pool each checked-out connection came from, it goes back to that one
+_owners = {}
+# Pools built with rotated-out secrets, closed once their last connection is returned
+_retired = []
+_pinned = threading.local()
+
+def _retire_pool(provider=None):
+    """Secrets changed: the next checkout builds a new pool, the old one closes as it drains."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            return
+        old_pool, _pool = _pool, None
+        if any(owner is old_pool for owner in _owners.values()):
+            _retired.append(old_pool)
+        else:
+            old_pool.closeall()
+    logger.warning('Redshift secrets changed, rebuilding the connection pool')
+
+def get_pool():
+    """
+    Per-process pool of Redshift connections, created with the cached secrets.
+    Rebuilt after a fork so Celery children never share a parent's sockets, and
+    after the secrets change on disk.
+    """
+    global _pool, _pool_pid, _checkout_slots
+    if _pool_pid == os.getpid():
+        # Picks up rotated credentials, at most every SECRETS_CHECK_SECONDS
+        get_redshift_secret_provider().check()
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                secrets = load_redshift_secrets()
+                if _pool_pid != os.getpid():
+                    # Slots, owners and retired pools of the parent process are meaningless here
+                    _checkout_slots = threading.BoundedSemaphore(Config.REDSHIFT_POOL_SIZE)
+                    _prepared.clear()
+                    _owners.clear()
+                    _retired.clear()
+                _pool = ThreadedConnectionPool(
+                    0, Config.REDSHIFT_POOL_SIZE,
+                    dbname=secrets['REDSHIFT_DATABASE'],
+                    user=secrets['REDSHIFT_USER'],
+                    password=secrets['REDSHIFT_PASSWORD'],
+                    host=secrets['REDSHIFT_HOST'],
+                    port=secrets['REDSHIFT_PORT'],
+                    application_name=query_tag(),
+                    keepalives=1,
+                    keepalives_idle=Config.REDSHIFT_KEEPALIVES_IDLE,
+                    keepalives_interval=10,
+                    keepalives_count=3
+                )
+                _pool_pid = os.getpid()
+                logger.info(f'Created Redshift connection pool (size {Config.REDSHIFT_POOL_SIZE})')
+    return _pool
+
+def _prepare(conn, statement_timeout=None):
+    """Session setup of a new pooled connection, runs once per connection."""
+    conn.autocommit = True
+    if statement_timeout:
+        with conn.cursor() as cur:
+            cur.execute(f"SET statement_timeout TO {int(statement_timeout * 1000)}")
+    _prepared.add(conn)
+
+def _healthy(conn):
+    if conn.closed:
+        return False
     try:
-        conn = psycopg2.connect(
-            dbname=secrets['REDSHIFT_DATABASE'],
-            user=secrets['REDSHIFT_USER'],
-            password=secrets['REDSHIFT_PASSWORD'],
-            host=secrets['REDSHIFT_HOST'],
-            port=secrets['REDSHIFT_PORT']
-        )
-        logger.info('Successfully connected to Redshift!')
-        return conn
-    except Exception as e:
-        logger.error(f'Failed to connect to Redshift: {e}')
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        return True
+    except psycopg2.Error:
+        return False
+
+def checkout(statement_timeout=None):
+    """
+    Take a healthy connection from the pool, waiting up to REDSHIFT_POOL_TIMEOUT
+    for a free one. New connections stop statements after statement_timeout seconds.
+    """
+    pool = get_pool()
+    if not _checkout_slots.acquire(timeout=Config.REDSHIFT_POOL_TIMEOUT):
+        raise TimeoutError(f'No Redshift connection free after {Config.REDSHIFT_POOL_TIMEOUT}s (pool size {Config.REDSHIFT_POOL_SIZE})')
+    try:
+        # A stale connection is dropped and replaced once, the next one is freshly opened
+        for _ in range(2):
+            conn = pool.getconn()
+            if conn not in _prepared:
+                _prepare(conn, statement_timeout)
+                _owners[id(conn)] = pool
+                return conn
+            if _healthy(conn):
+                _owners[id(conn)] = pool
+                return conn
+            logger.warning('Discarding broken pooled Redshift connection')
+            _prepared.discard(conn)
+            pool.putconn(conn, close=True)
+        raise psycopg2.OperationalError('No healthy Redshift connection available')
+    except Exception:
+        _checkout_slots.release()
         raise
 
-def run_query(query):
+def checkin(conn, discard=False):
+    discard = discard or bool(conn.closed)
+    if discard:
+        _prepared.discard(conn)
     try:
-        conn = get_connection()
+        with _pool_lock:
+            pool = _owners.pop(id(conn), None)
+            retired = pool is not None and pool is not _pool
+        if pool is None:
+            conn.close()
+        elif retired:
+            # Opened with rotated-out secrets, never reused
+            _prepared.discard(conn)
+            pool.putconn(conn, close=True)
+            with _pool_lock:
+                if pool in _retired and not any(owner is pool for owner in _owners.values()):
+                    _retired.remove(pool)
+                    pool.closeall()
+        else:
+            pool.putconn(conn, close=discard)
+    finally:
+        _checkout_slots.release()
+
+@contextmanager
+def connection(statement_timeout=None):
+    """A pooled connection for the block, or the pinned one inside single_session()."""
+    pinned = getattr(_pinned, 'conn', None)
+    if pinned is not None:
+        yield pinned
+        return
+    conn = checkout(statement_timeout)
+    try:
+        yield conn
+    except psycopg2.Error:
+        checkin(conn, discard=True)
+        raise
+    except Exception:
+        checkin(conn)
+        raise
+    checkin(conn)
+
+@contextmanager
+def single_session():
+    """Run every run_query of this thread inside the block on one pooled connection."""
+    with get_adapter('redshift').connection() as conn:
+        _pinned.conn = conn
         try:
-            cur = conn.cursor()
-            logger.debug(f'Executing query: {query.strip().splitlines()[0]}...')
-            cur.execute(query)
-            columns = [desc[0] for desc in cur.description]
-            results = [dict(zip(columns, row)) for row in cur.fetchall()]
-            logger.debug(f'Raw result: {results}')
-            return results
+            yield conn
         finally:
-            conn.close()
-    except Exception as e:
-        logger.error(f'Error running query: {e}\nQuery: {query}')
-        return []
+            _pinned.conn = None
+
+def execute(conn, query, label=None):
+    """Run a query tagged with label (query_group) and return its rows as dicts."""
+    with conn.cursor() as cur:
+        cur.execute("SET query_group TO %s", (query_tag(label),))
+        cur.execute(query)
+        columns = [desc[0] for desc in cur.description]
+        return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+def run_query(query, raise_errors=False, label=None):
+    """Run a query through the Redshift adapter, [] when it fails unless raise_errors."""
+    return get_adapter('redshift').run_query(query, label=label, raise_errors=raise_errors)
+
+def clean_table_name(table):
+    """Strip system prefixes and schema qualifiers from a SYS_QUERY_DETAIL table name."""
+    table = table.replace('$', '').replace('..', '.').strip('.')
+    if table.startswith('dev.'):
+        table = table[4:]
+    if table.startswith('raw_sys_'):
+        table = table[8:]
+    # Remove any remaining schema prefixes
+    if '.' in table:
+        table = table.split('.')[-1]
+    return table
 
 def get_dataset_count():
     try:
         logger.info('Getting dataset count...')
         query = "SELECT COUNT(DISTINCT datname) AS dataset_count FROM pg_database"
-        result = run_query(query)
+        result = run_query(query, label='dataset_count')
         logger.debug(f'Raw result for dataset_count: {result}')
         if not result:
             return None
@@ -98,7 +244,7 @@ def get_table_count():
     try:
         logger.info('Getting table count...')
         query = "SELECT COUNT(*) AS table_count FROM svv_tables WHERE table_type='BASE TABLE'"
-        result = run_query(query)
+        result = run_query(query, label='table_count')
         logger.debug(f'Raw result for table_count: {result}')
         if not result:
             return None
@@ -115,7 +261,7 @@ def get_total_query_executed():
         FROM SYS_QUERY_HISTORY 
         WHERE status != 'failed'
         """
-        result = run_query(query)
+        result = run_query(query, label='total_query_executed')
         if not result:
             return None
         return result[0].get('total_queries_executed') or result[0].get('TOTAL_QUERIES_EXECUTED')
@@ -131,7 +277,7 @@ def get_avg_execution_time_seconds():
         FROM SYS_QUERY_HISTORY
         WHERE status != 'failed'
         """
-        result = run_query(query)
+        result = run_query(query, label='avg_execution_time_seconds')
         if not result:
             return None
         return result[0].get('avg_execution_time_seconds') or result[0].get('AVG_EXECUTION_TIME_SECONDS')
@@ -147,7 +293,7 @@ def get_failure_rate_percentage():
             NULLIF(COUNT(*), 0), 2) AS query_failure_rate_percentage
         FROM SYS_QUERY_HISTORY
         """
-        result = run_query(query)
+        result = run_query(query, label='failure_rate_percentage')
         if not result:
             return None
         return result[0].get('query_failure_rate_percentage') or result[0].get('QUERY_FAILURE_RATE_PERCENTAGE')
@@ -183,7 +329,7 @@ def get_query_cost_by_month():
         CROSS JOIN table_sizes t
         ORDER BY month
         """
-        result = run_query(query)
+        result = run_query(query, label='query_cost_by_months_chart')
         transformed = [
             {
                 'month': row.get('month') or row.get('MONTH'),
@@ -195,10 +341,10 @@ def get_query_cost_by_month():
             }
             for row in result
         ]
-        return json.dumps(transformed)
+        return dumps(transformed)
     except Exception as e:
         logger.error(f'Error in get_query_cost_by_month: {e}')
-        return json.dumps([])
+        return dumps([])
 
 def get_query_cost_for_last_30_days():
     try:
@@ -228,7 +374,7 @@ def get_query_cost_for_last_30_days():
         CROSS JOIN table_sizes t
         ORDER BY day
         """
-        result = run_query(query)
+        result = run_query(query, label='query_cost_by_days_chart')
         transformed = [
             {
                 'day': row.get('day') or row.get('DAY'),
@@ -240,10 +386,10 @@ def get_query_cost_for_last_30_days():
             }
             for row in result
         ]
-        return json.dumps(transformed)
+        return dumps(transformed)
     except Exception as e:
         logger.error(f'Error in get_query_cost_for_last_30_days: {e}')
-        return json.dumps([])
+        return dumps([])
 
 def get_total_cost_gb_by_users():
     try:
@@ -281,7 +427,7 @@ def get_total_cost_gb_by_users():
         ORDER BY total_cost_gb DESC
         LIMIT 15
         """
-        results = run_query(query)
+        results = run_query(query, label='total_cost_gb_by_users')
         transformed = [
             {
                 'user_email': (row.get('user_email') or row.get('USER_EMAIL') or '').strip(),
@@ -297,10 +443,10 @@ def get_total_cost_gb_by_users():
             }
             for row in results
         ]
-        return json.dumps(transformed)
+        return dumps(transformed)
     except Exception as e:
         logger.error(f'Error in get_total_cost_gb_by_users: {e}')
-        return json.dumps([])
+        return dumps([])
 
 def get_total_cost_gb_by_table():
     try:
@@ -343,7 +489,7 @@ def get_total_cost_gb_by_table():
         ORDER BY total_cost_gb DESC
         LIMIT 50
         """
-        results = run_query(query)
+        results = run_query(query, label='total_cost_gb_by_table')
         
         transformed = []
         seen_tables = set()  # Track unique table names
@@ -358,14 +504,7 @@ def get_total_cost_gb_by_table():
             
             # Clean up table name
             original_table = table
-            table = table.replace('$', '').replace('..', '.').strip('.')
-            if table.startswith('dev.'):
-                table = table[4:]
-            if table.startswith('raw_sys_'):
-                table = table[8:]
-            # Remove any remaining schema prefixes
-            if '.' in table:
-                table = table.split('.')[-1]
+            table = clean_table_name(table)
             
             # Skip if we've seen this table before
             table_key = f"{dataset}.{table}"
@@ -398,10 +537,173 @@ def get_total_cost_gb_by_table():
             transformed.append(transformed_row)
         
         logger.info(f'Processed {len(transformed)} tables')
-        return json.dumps(transformed, default=str)
+        return dumps(transformed, datetime_format='%Y-%m-%d %H:%M:%S')
     except Exception as e:
         logger.error(f'Error in get_total_cost_gb_by_table: {e}')
-        return json.dumps([])
+        return dumps([])
+
+def get_storage_gb():
+    try:
+        query = """
+        SELECT CAST(SUM(size) AS FLOAT) / 1024.0 / 1024.0 AS total_table_size_gb  -- 1MB blocks to GB
+        FROM SVV_TABLE_INFO
+        WHERE "table" NOT LIKE 'pg_%'  -- Exclude system tables
+        """
+        result = run_query(query, label='storage_gb')
+        if not result:
+            return 0.0
+        return float(result[0].get('total_table_size_gb') or result[0].get('TOTAL_TABLE_SIZE_GB') or 0)
+    except Exception as e:
+        logger.error(f'Error in get_storage_gb: {e}')
+        return 0.0
+
+def get_console_query_costs(days=1):
+    """Cost of the queries this console's user ran over the last days, from SYS_QUERY_HISTORY."""
+    try:
+        query = f"""
+        WITH scanned AS (
+            SELECT query_id, SUM(input_bytes) AS input_bytes
+            FROM SYS_QUERY_DETAIL
+            WHERE start_time >= DATEADD(day, -{int(days)}, GETDATE())
+            GROUP BY query_id
+        )
+        SELECT
+            COUNT(*) AS queries,
+            COALESCE(SUM(s.input_bytes), 0) AS bytes_scanned,
+            COALESCE(SUM(h.elapsed_time), 0) / 1000 AS elapsed_ms,
+            SUM(CASE WHEN h.result_cache_hit THEN 1 ELSE 0 END) AS cache_hits
+        FROM SYS_QUERY_HISTORY h
+        LEFT JOIN scanned s ON s.query_id = h.query_id
+        WHERE h.start_time >= DATEADD(day, -{int(days)}, GETDATE()) AND h.user_id = CURRENT_USER_ID
+        """
+        results = run_query(query, raise_errors=True, label='console_query_costs')
+        return results[0] if results else None
+    except Exception as e:
+        logger.error(f'Error in get_console_query_costs: {e}')
+        return None
+
+# SYS_QUERY_HISTORY statuses of queries that have not finished yet
+OPEN_QUERY_STATUSES = ('planning', 'queued', 'running', 'returning')
+
+def open_query_filter(alias=''):
+    statuses = ', '.join(f"'{status}'" for status in OPEN_QUERY_STATUSES)
+    return f"({alias}end_time IS NULL OR {alias}status IN ({statuses}))"
+
+def rollup_query(since, until=None):
+    """
+    Per day x user x table aggregates of the queries started after since (and up
+    to until). Increments (with until) only count finished queries, the rest are
+    left to a later increment by get_increment_until().
+    """
+    until_filter = f" AND h.start_time <= '{until.isoformat()}' AND NOT {open_query_filter('h.')}" if until else ''
+    since_filter = f"start_time > '{since.isoformat()}'" if isinstance(since, datetime) else f"start_time >= '{since.isoformat()}'"
+    # Each query is attributed to one table so cards do not double count multi-table queries.
+    # Query steps start after their query, so the detail scan needs no upper bound.
+    return f"""
+        WITH query_tables AS (
+            SELECT
+                query_id,
+                MIN(REGEXP_REPLACE(REGEXP_REPLACE(table_name, '^[^.]+\\.', ''), '^[^.]+\\.', '')) AS table_name
+            FROM SYS_QUERY_DETAIL
+            WHERE table_name IS NOT NULL AND {since_filter}
+            GROUP BY query_id
+        )
+        SELECT
+            TRUNC(h.start_time) AS day,
+            COALESCE(TRIM(h.username), '') AS user_name,
+            CASE WHEN q.table_name IS NULL THEN '' ELSE COALESCE(h.database_name, 'system') END AS dataset,
+            COALESCE(q.table_name, '') AS table_name,
+            COUNT(*) AS query_count,
+            SUM(CASE WHEN h.status = 'failed' THEN 1 ELSE 0 END) AS failure_count,
+            SUM(CASE WHEN h.end_time IS NOT NULL THEN 1 ELSE 0 END) AS finished_count,
+            COALESCE(SUM(h.returned_bytes), 0) AS bytes_billed,
+            COALESCE(SUM(h.execution_time), 0) / 1000000.0 AS execution_seconds,
+            MIN(h.start_time) AS first_query_time,
+            MAX(h.start_time) AS last_query_time
+        FROM SYS_QUERY_HISTORY h
+        LEFT JOIN query_tables q ON q.query_id = h.query_id
+        WHERE h.{since_filter}{until_filter}
+        GROUP BY 1, 2, 3, 4
+        """
+
+def _rollup_rows(results):
+    rows = []
+    for row in results:
+        table = row.get('table_name') or ''
+        rows.append({
+            **row,
+            'table_name': clean_table_name(table) if table.strip() else '',
+            'execution_seconds': float(row.get('execution_seconds') or 0)
+        })
+    return rows
+
+def get_daily_rollup(since_day):
+    """Per day x user x table query aggregates since since_day, or None on failure."""
+    try:
+        logger.info(f'Getting daily rollup since {since_day}...')
+        return _rollup_rows(run_query(rollup_query(since_day), raise_errors=True, label='daily_rollup'))
+    except Exception as e:
+        logger.error(f'Error in get_daily_rollup: {e}')
+        return None
+
+def get_increment_until(since_time, until_time):
+    """
+    until_time, or just before the earliest query started after since_time that
+    is still queued or running, so the start time watermark never passes a query
+    before it has finished. None on failure.
+    """
+    try:
+        results = run_query(f"""
+            SELECT MIN(start_time) AS open_start_time
+            FROM SYS_QUERY_HISTORY
+            WHERE start_time > '{since_time.isoformat()}' AND start_time <= '{until_time.isoformat()}'
+                AND {open_query_filter()}
+            """, raise_errors=True, label='rollup_open_queries')
+        open_start_time = results[0].get('open_start_time') if results else None
+        if open_start_time is None:
+            return until_time
+        logger.info(f'Redshift queries open since {open_start_time}, rollup increment stops before them')
+        return min(until_time, open_start_time - timedelta(microseconds=1))
+    except Exception as e:
+        logger.error(f'Error in get_increment_until: {e}')
+        return None
+
+def get_rollup_increment(since_time, until_time):
+    """
+    Aggregates of the queries with since_time < start_time <= until_time only,
+    added onto the summary instead of re-reading whole days. None on failure.
+    """
+    try:
+        logger.info(f'Getting rollup increment from {since_time} to {until_time}...')
+        return _rollup_rows(run_query(rollup_query(since_time, until_time), raise_errors=True, label='rollup_increment'))
+    except Exception as e:
+        logger.error(f'Error in get_rollup_increment: {e}')
+        return None
+
+def get_all_stats():
+    """
+    Batched mode: every /stats metric over one pooled session, returned under the
+    stats.html keys. A metric whose query fails is None, like its collector.
+    """
+    try:
+        with single_session():
+            return {
+                # cards
+                'dataset_count': get_dataset_count(),
+                'table_count': get_table_count(),
+                'total_query_executed': get_total_query_executed(),
+                'avg_execution_time_seconds': get_avg_execution_time_seconds(),
+                'failure_rate_percentage': get_failure_rate_percentage(),
+                # charts
+                'query_cost_by_months_chart': get_query_cost_by_month(),
+                'query_cost_by_days_chart': get_query_cost_for_last_30_days(),
+                # tables
+                'total_cost_gb_by_users': get_total_cost_gb_by_users(),
+                'total_cost_gb_by_table': get_total_cost_gb_by_table()
+            }
+    except Exception as e:
+        logger.error(f'Error in get_all_stats: {e}')
+        return None
 
 # Debug Local testing
 # if __name__ == "__main__":
@@ -0,0 +1,508 @@
+import logging
+import psycopg2
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from psycopg2 import extras
+from app.config import Config
+from app.datawarehouse_stats.adapters import get_adapter
+from app.json_utils import dumps
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_KEY_COLUMNS = ('day', 'user_name', 'dataset', 'table_name')
+ROLLUP_SUM_COLUMNS = ('query_count', 'failure_count', 'finished_count', 'bytes_billed', 'execution_seconds')
+
+
+class StatsRollupStore:
+    """
+    Daily (day x user x table) query aggregates kept in the console's Postgres.
+
+    Past days of warehouse query history never change, so refreshes only pull
+    the days after the last complete watermark and merge them in here; cards
+    and charts are then computed locally.
+    """
+    def __init__(self, db_config):
+        self.db_config = db_config
+        self.rollup_table = 'dwh_stats_daily_rollup'
+        self.watermark_table = 'dwh_stats_rollup_watermark'
+        self.storage_table = 'dwh_stats_storage_snapshot'
+        self.ensure_rollup_tables_exist()
+
+    def get_connection(self):
+        return psycopg2.connect(**self.db_config)
+
+    def ensure_rollup_tables_exist(self):
+        with self.get_connection() as connection:
+            with connection.cursor() as cur:
+                cur.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {self.rollup_table} (
+                        dwh_type VARCHAR(32) NOT NULL,
+                        day DATE NOT NULL,
+                        user_name VARCHAR(256) NOT NULL DEFAULT '',
+                        dataset VARCHAR(256) NOT NULL DEFAULT '',
+                        table_name VARCHAR(512) NOT NULL DEFAULT '',
+                        query_count BIGINT NOT NULL DEFAULT 0,
+                        failure_count BIGINT NOT NULL DEFAULT 0,
+                        finished_count BIGINT NOT NULL DEFAULT 0,
+                        bytes_billed NUMERIC NOT NULL DEFAULT 0,
+                        execution_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+                        first_query_time TIMESTAMP,
+                        last_query_time TIMESTAMP,
+                        PRIMARY KEY (dwh_type, day, user_name, dataset, table_name)
+                    );
+                    CREATE TABLE IF NOT EXISTS {self.watermark_table} (
+                        dwh_type VARCHAR(32) PRIMARY KEY,
+                        last_complete_day DATE NOT NULL,
+                        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                    );
+                    -- Start time of the last query added by an incremental refresh
+                    ALTER TABLE {self.watermark_table} ADD COLUMN IF NOT EXISTS last_start_time TIMESTAMP;
+                    CREATE TABLE IF NOT EXISTS {self.storage_table} (
+                        dwh_type VARCHAR(32) PRIMARY KEY,
+                        storage_gb DOUBLE PRECISION NOT NULL DEFAULT 0,
+                        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                    );
+                """)
+                connection.commit()
+
+    def get_watermark(self, dwh_type):
+        with self.get_connection() as connection:
+            with connection.cursor() as cur:
+                cur.execute(f"""
+                    SELECT last_complete_day FROM {self.watermark_table} WHERE dwh_type = %s;
+                """, (dwh_type,))
+                row = cur.fetchone()
+                return row[0] if row else None
+
+    def merge_days(self, dwh_type, since_day, rows, last_complete_day, retention_days):
+        """
+        Replace every rollup row from since_day onwards with rows and move the
+        watermark to last_complete_day, in one transaction.
+        """
+        merged = {}
+        for row in rows:
+            key = tuple(row.get(column) or '' for column in ROLLUP_KEY_COLUMNS)
+            current = merged.get(key)
+            if current is None:
+                merged[key] = dict(row)
+                continue
+            for column in ROLLUP_SUM_COLUMNS:
+                current[column] = (current.get(column) or 0) + (row.get(column) or 0)
+            current['first_query_time'] = min(filter(None, [current.get('first_query_time'), row.get('first_query_time')]), default=None)
+            current['last_query_time'] = max(filter(None, [current.get('last_query_time'), row.get('last_query_time')]), default=None)
+
+        values = [
+            (dwh_type, key[0], key[1], key[2], key[3],
+             row.get('query_count') or 0, row.get('failure_count') or 0, row.get('finished_count') or 0,
+             row.get('bytes_billed') or 0, row.get('execution_seconds') or 0,
+             row.get('first_query_time'), row.get('last_query_time'))
+            for key, row in merged.items()
+        ]
+
+        with self.get_connection() as connection:
+            with connection.cursor() as cur:
+                cur.execute(f"""
+                    DELETE FROM {self.rollup_table} WHERE dwh_type = %s AND (day >= %s OR day < %s);
+                """, (dwh_type, since_day, last_complete_day - timedelta(days=retention_days)))
+                if values:
+                    extras.execute_values(cur, f"""
+                        INSERT INTO {self.rollup_table} (dwh_type, day, user_name, dataset, table_name,
+                            query_count, failure_count, finished_count, bytes_billed, execution_seconds,
+                            first_query_time, last_query_time)
+                        VALUES %s
+                        ON CONFLICT (dwh_type, day, user_name, dataset, table_name) DO UPDATE SET
+                            query_count = EXCLUDED.query_count,
+                            failure_count = EXCLUDED.failure_count,
+                            finished_count = EXCLUDED.finished_count,
+                            bytes_billed = EXCLUDED.bytes_billed,
+                            execution_seconds = EXCLUDED.execution_seconds,
+                            first_query_time = EXCLUDED.first_query_time,
+                            last_query_time = EXCLUDED.last_query_time;
+                    """, values)
+                cur.execute(f"""
+                    INSERT INTO {self.watermark_table} (dwh_type, last_complete_day, updated_at)
+                    VALUES (%s, %s, CURRENT_TIMESTAMP)
+                    ON CONFLICT (dwh_type) DO UPDATE SET
+                        last_complete_day = EXCLUDED.last_complete_day,
+                        updated_at = EXCLUDED.updated_at;
+                """, (dwh_type, last_complete_day))
+                connection.commit()
+        return len(values)
+
+    def _lock_key(self, purpose, dwh_type):
+        return f'{self.watermark_table}:{purpose}:{dwh_type}'
+
+    @contextmanager
+    def refresh_lock(self, dwh_type):
+        """
+        Hold a Postgres advisory lock for the block. Every process using the
+        console database (web workers, Celery prefork children) takes the same
+        lock, so one rollup refresh per warehouse runs at a time.
+        """
+        connection = self.get_connection()
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cur:
+                cur.execute("SELECT pg_advisory_lock(hashtext(%s));", (self._lock_key('refresh', dwh_type),))
+            yield
+        finally:
+            # Closing the session releases its advisory locks
+            connection.close()
+
+    def get_start_watermark(self, dwh_type):
+        """Start time of the last query merged by add_increment, None before the first increment."""
+        with self.get_connection() as connection:
+            with connection.cursor() as cur:
+                cur.execute(f"""
+                    SELECT last_start_time FROM {self.watermark_table} WHERE dwh_type = %s;
+                """, (dwh_type,))
+                row = cur.fetchone()
+                return row[0] if row else None
+
+    def add_increment(self, dwh_type, rows, since_time, last_start_time, retention_days, replace_since_day=None):
+        """
+        Add the aggregates of newly finished queries onto the existing day rows and
+        move the start time watermark, in one transaction. replace_since_day first
+        drops the rows a day-based refresh left from that day on.
+
+        since_time is the start watermark the rows were read from (None before the
+        first increment). The transaction locks the watermark and adds nothing when
+        another process moved it meanwhile.
+
+        Returns:
+            int: rows added, or None when the watermark was no longer since_time
+        """
+        values = [
+            (dwh_type, row.get('day'), row.get('user_name') or '', row.get('dataset') or '', row.get('table_name') or '',
+             row.get('query_count') or 0, row.get('failure_count') or 0, row.get('finished_count') or 0,
+             row.get('bytes_billed') or 0, row.get('execution_seconds') or 0,
+             row.get('first_query_time'), row.get('last_query_time'))
+            for row in rows
+        ]
+        last_complete_day = last_start_time.date() - timedelta(days=1)
+
+        with self.get_connection() as connection:
+            with connection.cursor() as cur:
+                # Also serializes first increments, before a watermark row exists to lock
+                cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s));", (self._lock_key('increment', dwh_type),))
+                cur.execute(f"""
+                    SELECT last_start_time FROM {self.watermark_table} WHERE dwh_type = %s FOR UPDATE;
+                """, (dwh_type,))
+                row = cur.fetchone()
+                if (row[0] if row else None) != since_time:
+                    connection.rollback()
+                    return None
+                if replace_since_day:
+                    cur.execute(f"""
+                        DELETE FROM {self.rollup_table} WHERE dwh_type = %s AND day >= %s;
+                    """, (dwh_type, replace_since_day))
+                cur.execute(f"""
+                    DELETE FROM {self.rollup_table} WHERE dwh_type = %s AND day < %s;
+                """, (dwh_type, last_complete_day - timedelta(days=retention_days)))
+                if values:
+                    # Several rows of one increment can share a key (table names cleaned after grouping)
+                    extras.execute_values(cur, f"""
+                        INSERT INTO {self.rollup_table} AS r (dwh_type, day, user_name, dataset, table_name,
+                            query_count, failure_count, finished_count, bytes_billed, execution_seconds,
+                            first_query_time, last_query_time)
+                        SELECT dwh_type, day::DATE, user_name, dataset, table_name,
+                            SUM(query_count), SUM(failure_count), SUM(finished_count), SUM(bytes_billed::NUMERIC),
+                            SUM(execution_seconds), MIN(first_query_time::TIMESTAMP), MAX(last_query_time::TIMESTAMP)
+                        FROM (VALUES %s) AS v (dwh_type, day, user_name, dataset, table_name,
+                            query_count, failure_count, finished_count, bytes_billed, execution_seconds,
+                            first_query_time, last_query_time)
+                        GROUP BY 1, 2, 3, 4, 5
+                        ON CONFLICT (dwh_type, day, user_name, dataset, table_name) DO UPDATE SET
+                            query_count = r.query_count + EXCLUDED.query_count,
+                            failure_count = r.failure_count + EXCLUDED.failure_count,
+                            finished_count = r.finished_count + EXCLUDED.finished_count,
+                            bytes_billed = r.bytes_billed + EXCLUDED.bytes_billed,
+                            execution_seconds = r.execution_seconds + EXCLUDED.execution_seconds,
+                            first_query_time = LEAST(r.first_query_time, EXCLUDED.first_query_time),
+                            last_query_time = GREATEST(r.last_query_time, EXCLUDED.last_query_time);
+                    """, values)
+                cur.execute(f"""
+                    INSERT INTO {self.watermark_table} (dwh_type, last_complete_day, last_start_time, updated_at)
+                    VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+                    ON CONFLICT (dwh_type) DO UPDATE SET
+                        last_complete_day = EXCLUDED.last_complete_day,
+                        last_start_time = EXCLUDED.last_start_time,
+                        updated_at = EXCLUDED.updated_at;
+                """, (dwh_type, last_complete_day, last_start_time))
+                connection.commit()
+        return len(values)
+
+    def set_storage_gb(self, dwh_type, storage_gb):
+        with self.get_connection() as connection:
+            with connection.cursor() as cur:
+                cur.execute(f"""
+                    INSERT INTO {self.storage_table} (dwh_type, storage_gb, updated_at)
+                    VALUES (%s, %s, CURRENT_TIMESTAMP)
+                    ON CONFLICT (dwh_type) DO UPDATE SET
+                        storage_gb = EXCLUDED.storage_gb,
+                        updated_at = EXCLUDED.updated_at;
+                """, (dwh_type, storage_gb))
+                connection.commit()
+
+    def get_storage_gb(self, dwh_type):
+        with self.get_connection() as connection:
+            with connection.cursor() as cur:
+                cur.execute(f"""
+                    SELECT storage_gb FROM {self.storage_table} WHERE dwh_type = %s;
+                """, (dwh_type,))
+                row = cur.fetchone()
+                return float(row[0]) if row else None
+
+    def get_refresh_age_seconds(self, dwh_type):
+        with self.get_connection() as connection:
+            with connection.cursor() as cur:
+                cur.execute(f"""
+                    SELECT EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - updated_at)) FROM {self.watermark_table} WHERE dwh_type = %s;
+                """, (dwh_type,))
+                row = cur.fetchone()
+                return float(row[0]) if row else None
+
+    def _fetch(self, query, params):
+        with self.get_connection() as connection:
+            with connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.execute(query, params)
+                return cur.fetchall()
+
+    def get_totals(self, dwh_type):
+        rows = self._fetch(f"""
+            SELECT
+                COALESCE(SUM(query_count), 0) AS query_count,
+                COALESCE(SUM(failure_count), 0) AS failure_count,
+                COALESCE(SUM(finished_count), 0) AS finished_count,
+                COALESCE(SUM(execution_seconds), 0) AS execution_seconds
+            FROM {self.rollup_table}
+            WHERE dwh_type = %s;
+        """, (dwh_type,))
+        return rows[0] if rows else {}
+
+    def get_cost_by_period(self, dwh_type, period):
+        if period == 'month':
+            label, date_format, since = 'month', 'YYYY-MM', "CURRENT_DATE - INTERVAL '6 months'"
+        else:
+            label, date_format, since = 'day', 'YYYY-MM-DD', "CURRENT_DATE - INTERVAL '30 days'"
+        return self._fetch(f"""
+            SELECT
+                TO_CHAR(DATE_TRUNC('{period}', day), '{date_format}') AS {label},
+                SUM(query_count) AS query_count,
+                SUM(bytes_billed) / 1073741824.0 AS query_cost_gb
+            FROM {self.rollup_table}
+            WHERE dwh_type = %s AND day >= {since}
+            GROUP BY 1
+            ORDER BY 1;
+        """, (dwh_type,))
+
+    def get_cost_by_group(self, dwh_type, group_columns, limit=None, exclude_untracked_tables=False):
+        group_by = ', '.join(group_columns)
+        where_tables = "AND dataset <> ''" if exclude_untracked_tables else ''
+        limit_clause = f'LIMIT {int(limit)}' if limit else ''
+        return self._fetch(f"""
+            SELECT
+                {group_by},
+                SUM(bytes_billed) / 1073741824.0 AS total_cost_gb,
+                SUM(query_count) AS total_queries,
+                SUM(finished_count) AS finished_count,
+                SUM(execution_seconds) AS execution_seconds,
+                TO_CHAR(MIN(first_query_time), 'YYYY-MM-DD HH24:MI:SS') AS first_query_date,
+                TO_CHAR(MAX(last_query_time), 'YYYY-MM-DD HH24:MI:SS') AS last_query_date,
+                SUM(query_count) - SUM(failure_count) AS success_count,
+                SUM(failure_count) AS failure_count
+            FROM {self.rollup_table}
+            WHERE dwh_type = %s {where_tables}
+            GROUP BY {group_by}
+            ORDER BY total_cost_gb DESC
+            {limit_clause};
+        """, (dwh_type,))
+
+
+_store = None
+
+def get_rollup_store():
+    global _store
+    if _store is None:
+        _store = StatsRollupStore({
+            'dbname': Config.DB_NAME,
+            'user': Config.DB_USER,
+            'password': Config.DB_PASSWORD,
+            'host': Config.DB_HOST,
+            'port': Config.DB_PORT
+        })
+    return _store
+
+def get_last_complete_day():
+    # Query history views lag behind real time, give the previous day time to settle
+    settled = datetime.now(timezone.utc) - timedelta(hours=Config.STATS_ROLLUP_SETTLE_HOURS)
+    return settled.date() - timedelta(days=1)
+
+def refresh_storage(dwh_type, dwh, store):
+    """Snapshot the warehouse storage size once per refresh, the month and day charts read it from the store."""
+    if hasattr(dwh, 'get_storage_gb'):
+        store.set_storage_gb(dwh_type, _to_float(dwh.get_storage_gb()))
+
+def refresh_increment(dwh_type, dwh, store):
+    """
+    Add only the queries started since the last processed start time. Queries
+    younger than STATS_ROLLUP_INCREMENT_SETTLE_MINUTES are left for the next
+    refresh. So are queries still queued or running, and every query started
+    after the earliest of them, when the module can find them
+    (get_increment_until): the watermark stops before them and each query is
+    counted once, after it has finished.
+    """
+    until_time = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(minutes=Config.STATS_ROLLUP_INCREMENT_SETTLE_MINUTES)
+    start_watermark = since_time = store.get_start_watermark(dwh_type)
+    replace_since_day = None
+    if since_time is None:
+        # First increment: continue from the day watermark (or backfill), replacing its partial days
+        watermark = store.get_watermark(dwh_type)
+        replace_since_day = watermark + timedelta(days=1) if watermark else get_last_complete_day() - timedelta(days=Config.STATS_ROLLUP_RETENTION_DAYS)
+        since_time = datetime.combine(replace_since_day, datetime.min.time()) - timedelta(microseconds=1)
+    if until_time <= since_time:
+        return True
+    if hasattr(dwh, 'get_increment_until'):
+        until_time = dwh.get_increment_until(since_time, until_time)
+        if until_time is None:
+            logger.error(f'Open queries of {dwh_type} could not be read, keeping watermark at {since_time}')
+            return False
+        if until_time <= since_time:
+            return True
+
+    rows = dwh.get_rollup_increment(since_time, until_time)
+    if rows is None:
+        logger.error(f'Rollup increment for {dwh_type} failed, keeping watermark at {since_time}')
+        return False
+    added = store.add_increment(dwh_type, rows, start_watermark, until_time, Config.STATS_ROLLUP_RETENTION_DAYS, replace_since_day)
+    if added is None:
+        logger.info(f'Rollup increment for {dwh_type} from {since_time} was already added by another process')
+        return True
+    logger.info(f'Rollup increment for {dwh_type} added {added} rows from {since_time} to {until_time}')
+    return True
+
+def refresh_rollups(dwh_type, store=None):
+    """Pull the days after the watermark from the warehouse and merge them into the store."""
+    store = store or get_rollup_store()
+    # Adapters with rollups = True have modules providing get_daily_rollup(since_day)
+    dwh = get_adapter(dwh_type).module
+    refresh_storage(dwh_type, dwh, store)
+    # Warehouses with a start time increment (Redshift) never re-read whole days
+    if hasattr(dwh, 'get_rollup_increment'):
+        return refresh_increment(dwh_type, dwh, store)
+    last_complete_day = get_last_complete_day()
+    watermark = store.get_watermark(dwh_type)
+    if watermark is None:
+        since_day = last_complete_day - timedelta(days=Config.STATS_ROLLUP_RETENTION_DAYS)
+    else:
+        since_day = watermark + timedelta(days=1)
+
+    rows = dwh.get_daily_rollup(since_day)
+    if rows is None:
+        logger.error(f'Rollup refresh for {dwh_type} failed, keeping watermark at {watermark}')
+        return False
+    merged = store.merge_days(dwh_type, since_day, rows, max(last_complete_day, watermark or last_complete_day), Config.STATS_ROLLUP_RETENTION_DAYS)
+    logger.info(f'Rollup refresh for {dwh_type} merged {merged} rows since {since_day}')
+    return True
+
+def _to_float(value):
+    return float(value) if value is not None else 0.0
+
+def _cost_rows(rows, storage_gb):
+    return [{
+        **{k: v for k, v in row.items() if k not in ('query_count', 'query_cost_gb')},
+        'query_count': int(row['query_count'] or 0),
+        'query_cost_gb': round(_to_float(row['query_cost_gb']), 2),
+        'storage_cost_gb': round(storage_gb, 2),
+        'total_cost_gb': round(_to_float(row['query_cost_gb']) + storage_gb, 2)
+    } for row in rows]
+
+def _group_rows(rows, label_columns):
+    transformed = []
+    for row in rows:
+        total_queries = int(row['total_queries'] or 0)
+        finished_count = int(row['finished_count'] or 0)
+        total_cost_gb = _to_float(row['total_cost_gb'])
+        execution_seconds = _to_float(row['execution_seconds'])
+        transformed.append({
+            **{label: row[column] for label, column in label_columns.items()},
+            'total_cost_gb': round(total_cost_gb, 2),
+            'total_queries': total_queries,
+            'avg_query_cost_gb': round(total_cost_gb / total_queries, 4) if total_queries > 0 else 0,
+            'first_query_date': row['first_query_date'],
+            'last_query_date': row['last_query_date'],
+            'total_execution_time_min': round(execution_seconds / 60, 2),
+            'avg_execution_time_sec': round(execution_seconds / finished_count, 2) if finished_count > 0 else 0,
+            'success_count': int(row['success_count'] or 0),
+            'failure_count': int(row['failure_count'] or 0)
+        })
+    return transformed
+
+def _refresh_due(dwh_type, store):
+    age = store.get_refresh_age_seconds(dwh_type)
+    return age is None or age >= Config.STATS_ROLLUP_REFRESH_SECONDS
+
+def ensure_rollups_fresh(dwh_type, store):
+    """Refresh the rollups unless another metric, in any process, already did within STATS_ROLLUP_REFRESH_SECONDS."""
+    if not _refresh_due(dwh_type, store):
+        return
+    with store.refresh_lock(dwh_type):
+        # Whoever held the lock before may just have refreshed
+        if _refresh_due(dwh_type, store):
+            refresh_rollups(dwh_type, store)
+
+def rollup_total_query_executed(dwh_type, store):
+    totals = store.get_totals(dwh_type)
+    return int(totals.get('query_count') or 0)
+
+def rollup_avg_execution_time_seconds(dwh_type, store):
+    totals = store.get_totals(dwh_type)
+    finished_count = int(totals.get('finished_count') or 0)
+    return round(_to_float(totals.get('execution_seconds')) / finished_count, 2) if finished_count > 0 else None
+
+def rollup_failure_rate_percentage(dwh_type, store):
+    totals = store.get_totals(dwh_type)
+    query_count = int(totals.get('query_count') or 0)
+    return round(100 * int(totals.get('failure_count') or 0) / query_count, 2) if query_count > 0 else None
+
+def _storage_gb(dwh_type, store):
+    storage_gb = store.get_storage_gb(dwh_type)
+    if storage_gb is None:
+        # No snapshot yet (rollups refreshed before snapshots existed), read it live once
+        dwh = get_adapter(dwh_type).module
+        refresh_storage(dwh_type, dwh, store)
+        storage_gb = store.get_storage_gb(dwh_type)
+    return storage_gb if storage_gb is not None else 0.0
+
+def rollup_query_cost_by_month(dwh_type, store):
+    return dumps(_cost_rows(store.get_cost_by_period(dwh_type, 'month'), _storage_gb(dwh_type, store)))
+
+def rollup_query_cost_for_last_30_days(dwh_type, store):
+    return dumps(_cost_rows(store.get_cost_by_period(dwh_type, 'day'), _storage_gb(dwh_type, store)))
+
+def rollup_total_cost_gb_by_users(dwh_type, store):
+    return dumps(_group_rows(
+        store.get_cost_by_group(dwh_type, ['user_name'], limit=15),
+        {'user_email': 'user_name'}))
+
+def rollup_total_cost_gb_by_table(dwh_type, store):
+    return dumps(_group_rows(
+        store.get_cost_by_group(dwh_type, ['dataset', 'table_name'], exclude_untracked_tables=True),
+        {'dataset': 'dataset', 'table': 'table_name'}))
+
+# Metrics built from the local rollups. Dataset and table counts are cheap
+# metadata lookups and are still read live from the warehouse.
+ROLLUP_METRICS = {
+    'total_query_executed': rollup_total_query_executed,
+    'avg_execution_time_seconds': rollup_avg_execution_time_seconds,
+    'failure_rate_percentage': rollup_failure_rate_percentage,
+    'query_cost_by_months_chart': rollup_query_cost_by_month,
+    'query_cost_by_days_chart': rollup_query_cost_for_last_30_days,
+    'total_cost_gb_by_users': rollup_total_cost_gb_by_users,
+    'total_cost_gb_by_table': rollup_total_cost_gb_by_table,
+}
+
+def get_rollup_metric(dwh_type, metric, store=None):
+    store = store or get_rollup_store()
+    ensure_rollups_fresh(dwh_type, store)
+    return ROLLUP_METRICS[metric](dwh_type, store)
@@ -0,0 +1,128 @@
+"""
+Cached warehouse secrets with change detection.
+
+Warehouse credentials are Kubernetes secrets mounted under /fastbi/secrets/<dwh>/.
+They change rarely and, when they do, the kubelet swaps the `..data` symlink to
+a new directory instead of editing files in place. A SecretProvider reads a
+directory once, then at most every SECRETS_CHECK_SECONDS compares the `..data`
+target (or each file's inode, mtime and size when the directory is not a
+projected mount). On a change it reloads the values and calls its subscribers,
+so client pools can drop sessions opened with the old credentials.
+"""
+import logging
+import os
+import threading
+import time
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+SECRETS_ROOT = '/fastbi/secrets'
+
+
+class SecretProvider:
+    def __init__(self, path, names, env_first=False):
+        """
+        Args:
+            path: directory holding one file per secret
+            names: the secret file names to load
+            env_first: take each secret from the environment when set there,
+                reading only the missing ones from the files
+        """
+        self.path = path
+        self.names = list(names)
+        self.env_first = env_first
+        self._lock = threading.Lock()
+        self._values = None
+        self._fingerprint = None
+        self._checked_at = 0.0
+        self._subscribers = []
+
+    def _read(self):
+        values = {}
+        for name in self.names:
+            if self.env_first and os.getenv(name):
+                values[name] = os.getenv(name)
+                continue
+            try:
+                with open(os.path.join(self.path, name), 'r') as f:
+                    values[name] = f.read().strip()
+            except Exception as e:
+                logger.error(f"Error reading secret {name}: {e}")
+                raise
+        return values
+
+    def fingerprint(self):
+        # Projected secret volumes swap the ..data symlink atomically on every update
+        data_link = os.path.join(self.path, '..data')
+        if os.path.islink(data_link):
+            return ('..data', os.readlink(data_link))
+        fingerprint = []
+        for name in self.names:
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+                fingerprint.append((name, stat.st_ino, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                fingerprint.append((name, None))
+        return tuple(fingerprint)
+
+    def get_all(self):
+        """All secrets as a dict, read from disk only on first use and after a detected change."""
+        self.check()
+        with self._lock:
+            if self._values is None:
+                self._fingerprint = self.fingerprint()
+                self._values = self._read()
+                self._checked_at = time.monotonic()
+            return dict(self._values)
+
+    def get(self, name):
+        return self.get_all()[name]
+
+    def subscribe(self, callback):
+        """Call callback(provider) after the secrets changed on disk, subscribing twice is a no-op."""
+        with self._lock:
+            if callback not in self._subscribers:
+                self._subscribers.append(callback)
+
+    def check(self):
+        """
+        Look for a change at most every SECRETS_CHECK_SECONDS, reload and notify
+        the subscribers when there is one. Returns True when the secrets changed.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._values is None or now - self._checked_at < Config.SECRETS_CHECK_SECONDS:
+                return False
+            self._checked_at = now
+            fingerprint = self.fingerprint()
+            if fingerprint == self._fingerprint:
+                return False
+            try:
+                self._values = self._read()
+            except Exception as e:
+                # Keep serving the previous values, the next check tries again
+                logger.error(f"Secrets in {self.path} changed but could not be reloaded: {e}")
+                return False
+            self._fingerprint = fingerprint
+            subscribers = list(self._subscribers)
+        logger.warning(f"Secrets in {self.path} changed, notifying {len(subscribers)} subscriber(s)")
+        for callback in subscribers:
+            try:
+                callback(self)
+            except Exception as e:
+                logger.error(f"Secret change subscriber {callback} failed: {e}")
+        return True
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+def get_secret_provider(dwh_type, names, env_first=False, path=None):
+    """The process-wide provider of /fastbi/secrets/<dwh_type>/ (or path), created on first use."""
+    with _providers_lock:
+        provider = _providers.get(dwh_type)
+        if provider is None:
+            provider = SecretProvider(path or os.path.join(SECRETS_ROOT, dwh_type), names, env_first=env_first)
+            _providers[dwh_type] = provider
+        return provider
@@ -1,102 +1,265 @@
-import os
 import snowflake.connector
-import json
 from datetime import datetime
 import logging
+import threading
+import time
 from decimal import Decimal
 from contextlib import contextmanager
+from snowflake.connector.errors import NotSupportedError, ProgrammingError
+from app.config import Config
+from app.datawarehouse_stats.adapters import get_adapter
+from app.datawarehouse_stats.arrow_results import arrow_batches_to_records
+from app.datawarehouse_stats.secret_provider import get_secret_provider
+from app.datawarehouse_stats.query_metrics import query_tag, record_query_time
+from app.json_utils import dumps
 
 # Disable Snowflake connector logging
 snowflake.connector.logging.getLogger().setLevel(logging.WARNING)
 logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(message)s')
 logger = logging.getLogger(__name__)
 
+SNOWFLAKE_REQUIRED_SECRETS = [
+    'SNOWFLAKE_ACCOUNT',
+    'SNOWFLAKE_DATABASE',
+    'SNOWFLAKE_USER',
+    'SNOWFLAKE_PASSWORD',
+    'SNOWFLAKE_WAREHOUSE'
+]
+
 class SnowflakeConnection:
+    """
+    Bounded pool of keep-alive Snowflake sessions. Role and warehouse are set
+    when a session is created; every batch of statements checks one session
+    out and returns it afterwards. Sessions idle longer than
+    SNOWFLAKE_POOL_IDLE_SECONDS or older than SNOWFLAKE_POOL_MAX_AGE_SECONDS
+    are closed instead of being reused.
+    """
     _instance = None
-    _connection = None
+    _instance_lock = threading.Lock()
 
     @classmethod
     def get_instance(cls):
         if cls._instance is None:
-            cls._instance = cls()
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
         return cls._instance
 
     def __init__(self):
+        # Environment variables first, /fastbi/secrets/snowflake/ files for the missing ones
+        self.secret_provider = get_secret_provider('snowflake', SNOWFLAKE_REQUIRED_SECRETS, env_first=True)
         self.secrets = self._load_secrets()
-        self._connect()
+        self._secrets_changed_at = 0.0
+        self.secret_provider.subscribe(self._on_secrets_changed)
+        self.max_size = max(1, Config.SNOWFLAKE_POOL_SIZE)
+        # Idle sessions as (connection, created_at, last_used), most recently used last
+        self._idle = []
+        self._open = 0
+        self._available = threading.Condition(threading.Lock())
+        # Resolved by table_attribution() in auto mode
+        self.table_attribution = None
 
     def _load_secrets(self):
-        secrets = {
-            'SNOWFLAKE_ACCOUNT': os.getenv('SNOWFLAKE_ACCOUNT'),
-            'SNOWFLAKE_DATABASE': os.getenv('SNOWFLAKE_DATABASE'),
-            'SNOWFLAKE_USER': os.getenv('SNOWFLAKE_USER'),
-            'SNOWFLAKE_PASSWORD': os.getenv('SNOWFLAKE_PASSWORD'),
-            'SNOWFLAKE_WAREHOUSE': os.getenv('SNOWFLAKE_WAREHOUSE')
-        }
-        
-        if not all(secrets.values()):
-            secrets_path = '/fastbi/secrets/snowflake/'
-            required_secrets = [
-                'SNOWFLAKE_ACCOUNT',
-                'SNOWFLAKE_DATABASE',
-                'SNOWFLAKE_USER',
-                'SNOWFLAKE_PASSWORD',
-                'SNOWFLAKE_WAREHOUSE'
-            ]
-            try:
-                for secret_name in required_secrets:
-                    if not secrets.get(secret_name):
-                        secret_path = os.path.join(secrets_path, secret_name)
-                        try:
-                            with open(secret_path, 'r') as f:
-                                secrets[secret_name] = f.read().strip()
-                        except Exception as e:
-                            logger.error(f"Error reading secret {secret_name}: {e}")
-                            raise
-            except Exception as e:
-                logger.error(f"Error loading Snowflake secrets: {e}")
-                raise
-        
+        try:
+            secrets = self.secret_provider.get_all()
+        except Exception as e:
+            logger.error(f"Error loading Snowflake secrets: {e}")
+            raise
+
         missing_secrets = [k for k, v in secrets.items() if not v]
         if missing_secrets:
             raise ValueError(f"Missing required secrets: {', '.join(missing_secrets)}")
-        
+
         return secrets
 
-    def _connect(self):
+    def _on_secrets_changed(self, provider):
+        """New credentials: sessions opened before now are closed instead of being reused."""
+        self.secrets = self._load_secrets()
+        self._secrets_changed_at = time.monotonic()
+        self.close_all()
+
+    def _connect(self, statement_timeout=None):
+        session_parameters = {'QUERY_TAG': query_tag()}
+        if statement_timeout:
+            session_parameters['STATEMENT_TIMEOUT_IN_SECONDS'] = statement_timeout
         try:
-            self._connection = snowflake.connector.connect(
+            return snowflake.connector.connect(
                 user=self.secrets['SNOWFLAKE_USER'],
                 password=self.secrets.get('SNOWFLAKE_PASSWORD'),
                 account=self.secrets['SNOWFLAKE_ACCOUNT'],
                 warehouse=self.secrets['SNOWFLAKE_WAREHOUSE'],
                 database=self.secrets['SNOWFLAKE_DATABASE'],
+                # ACCOUNTADMIN by default for the storage metrics
+                role=Config.SNOWFLAKE_ROLE,
+                client_session_keep_alive=True,
+                session_parameters=session_parameters
             )
-            # Switch to ACCOUNTADMIN role for storage metrics
-            self._connection.cursor().execute("USE ROLE ACCOUNTADMIN;")
         except Exception as e:
             logger.error(f'Failed to connect to Snowflake: {e}')
             raise
 
-    def get_connection(self):
-        if not self._connection or self._connection.is_closed():
-            self._connect()
-        return self._connection
+    def _expired(self, created_at, last_used, now):
+        return (now - last_used > Config.SNOWFLAKE_POOL_IDLE_SECONDS
+                or now - created_at > Config.SNOWFLAKE_POOL_MAX_AGE_SECONDS
+                or created_at < self._secrets_changed_at)
 
-    def execute_queries(self, queries):
-        """Execute multiple queries in a single connection"""
+    def _close(self, connection):
         try:
-            conn = self.get_connection()
-            results = {}
-            cur = conn.cursor()
-            for name, query in queries.items():
-                cur.execute(query)
-                columns = [col[0] for col in cur.description]
-                results[name] = [dict(zip(columns, row)) for row in cur.fetchall()]
-            return {k: normalize_keys(v) for k, v in results.items()}
+            connection.close()
         except Exception as e:
-            logger.error(f'Error executing queries: {e}')
-            return {}
+            logger.warning(f'Error closing Snowflake session: {e}')
+
+    def _evict_expired(self, now):
+        """Drop expired idle sessions, called with the pool lock held. Returns the sessions to close."""
+        expired = [entry for entry in self._idle if self._expired(entry[1], entry[2], now) or entry[0].is_closed()]
+        if expired:
+            self._idle = [entry for entry in self._idle if entry not in expired]
+            self._open -= len(expired)
+        return [entry[0] for entry in expired]
+
+    def checkout(self, statement_timeout=None):
+        """
+        Return (connection, created_at), reusing an idle session or opening one
+        while below max_size. New sessions stop statements after statement_timeout seconds.
+        """
+        # Picks up rotated credentials, at most every SECRETS_CHECK_SECONDS
+        self.secret_provider.check()
+        deadline = time.monotonic() + Config.SNOWFLAKE_POOL_TIMEOUT
+        with self._available:
+            while True:
+                stale = self._evict_expired(time.monotonic())
+                if self._idle:
+                    connection, created_at, _ = self._idle.pop()
+                    break
+                if self._open < self.max_size:
+                    self._open += 1
+                    connection = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f'No Snowflake session free after {Config.SNOWFLAKE_POOL_TIMEOUT}s (pool size {self.max_size})')
+                self._available.wait(remaining)
+        for expired in stale:
+            self._close(expired)
+
+        if connection is None:
+            try:
+                connection, created_at = self._connect(statement_timeout), time.monotonic()
+            except Exception:
+                with self._available:
+                    self._open -= 1
+                    self._available.notify()
+                raise
+        return connection, created_at
+
+    def checkin(self, connection, created_at, discard=False):
+        """Return a session to the pool, closing it when discarded, closed or past its age limit."""
+        now = time.monotonic()
+        discard = discard or connection.is_closed() or self._expired(created_at, now, now)
+        with self._available:
+            if discard:
+                self._open -= 1
+            else:
+                self._idle.append((connection, created_at, now))
+            self._available.notify()
+        if discard:
+            self._close(connection)
+
+    @contextmanager
+    def session(self, statement_timeout=None):
+        """Check a session out for the block, it is discarded if the block raises."""
+        connection, created_at = self.checkout(statement_timeout)
+        try:
+            yield connection
+        except Exception:
+            self.checkin(connection, created_at, discard=True)
+            raise
+        self.checkin(connection, created_at)
+
+    def close_all(self):
+        with self._available:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for connection, _, _ in idle:
+            self._close(connection)
+
+def connection(statement_timeout=None):
+    """A pooled session for the block, the warehouse adapter's connection hook."""
+    return SnowflakeConnection.get_instance().session(statement_timeout)
+
+def execute(conn, query, label=None):
+    cur = conn.cursor()
+    cur.execute(query, _statement_params={'QUERY_TAG': query_tag(label)})
+    return fetch_records(cur)
+
+def execute_batch(conn, queries):
+    """
+    Submit every statement with execute_async, then poll the query ids
+    together and fetch each result as soon as it completes, so the batch
+    takes about as long as its slowest statement on the same session.
+    Each statement's time from submission to completion is recorded here,
+    the adapter only sees the batch.
+    """
+    cur = conn.cursor()
+    pending = {}
+    submitted = time.monotonic()
+    for name, query in queries.items():
+        cur.execute_async(query, _statement_params={'QUERY_TAG': query_tag(name)})
+        pending[cur.sfqid] = name
+    logger.info(f'Submitted {len(pending)} Snowflake queries asynchronously')
+
+    results = {}
+    while pending:
+        for query_id, name in list(pending.items()):
+            try:
+                # Raises for failed, aborted or timed out queries
+                status = conn.get_query_status_throw_if_error(query_id)
+            except Exception:
+                record_query_time('snowflake', name, time.monotonic() - submitted, failed=True)
+                raise
+            if conn.is_still_running(status):
+                continue
+            record_query_time('snowflake', name, time.monotonic() - submitted)
+            cur.get_results_from_sfqid(query_id)
+            results[name] = fetch_records(cur)
+            del pending[query_id]
+        if pending:
+            time.sleep(Config.SNOWFLAKE_ASYNC_POLL_SECONDS)
+    return {name: results[name] for name in queries}
+
+def run_queries(queries):
+    """Execute multiple queries on one pooled session, {} when any of them fails"""
+    return get_adapter('snowflake').run_batch(queries)
+
+_tracked = threading.local()
+
+@contextmanager
+def track_queries():
+    """Collect the ids of every query run in this thread inside the block."""
+    query_ids = []
+    previous = getattr(_tracked, 'query_ids', None)
+    _tracked.query_ids = query_ids
+    try:
+        yield query_ids
+    finally:
+        _tracked.query_ids = previous
+
+def fetch_records(cur):
+    """
+    Rows of the executed query as dicts with upper case keys. With STATS_ARROW_FETCH
+    the result is read with fetch_arrow_batches() and converted column-wise
+    (decimals to float), falling back to rows for results not sent as Arrow.
+    """
+    query_ids = getattr(_tracked, 'query_ids', None)
+    if query_ids is not None:
+        query_ids.append(cur.sfqid)
+    if Config.STATS_ARROW_FETCH:
+        try:
+            return arrow_batches_to_records(cur.fetch_arrow_batches(), upper_keys=True)
+        except NotSupportedError as e:
+            logger.warning(f'Arrow fetch not available for this result, fetching rows: {e}')
+    columns = [col[0] for col in cur.description]
+    return normalize_keys([dict(zip(columns, row)) for row in cur.fetchall()])
 
 def normalize_keys(results):
     """Convert all dictionary keys to uppercase for consistent access."""
@@ -118,19 +281,56 @@ def convert_decimals(obj):
     else:
         return obj
 
-def get_all_stats():
-    """Get all statistics in a single connection"""
-    conn = SnowflakeConnection.get_instance()
-    
-    # Get database name for table costs query
-    database = conn.secrets['SNOWFLAKE_DATABASE']
-    
-    # Create the table costs query with proper database filtering - matching restore.py
-    table_costs_query = f"""
+STORAGE_METRICS_CTE = """
+    storage_metrics AS (
+        SELECT
+            SUM(((ACTIVE_BYTES + TIME_TRAVEL_BYTES + FAILSAFE_BYTES + RETAINED_FOR_CLONE_BYTES) / 1024)/1024)/1024 AS total_storage_gb
+        FROM "INFORMATION_SCHEMA".TABLE_STORAGE_METRICS
+        WHERE TABLE_CATALOG = CURRENT_DATABASE()
+    )"""
+
+ACCESS_HISTORY_PROBE = 'SELECT 1 FROM SNOWFLAKE.ACCOUNT_USAGE.ACCESS_HISTORY LIMIT 0'
+# Object does not exist or not authorized, insufficient privileges: the account cannot read ACCESS_HISTORY
+ACCESS_DENIED_SQLSTATES = ('42S02', '42501')
+
+def table_attribution(conn):
+    """
+    How table costs are attributed: 'access_history' or 'regex'. In the default
+    'auto' mode ACCESS_HISTORY (Enterprise edition and up) is probed once per
+    pool and the QUERY_TEXT regex is used when it cannot be read. A probe that
+    fails for another reason (network, suspended warehouse, timeout) falls back
+    to the regex for this refresh only and is retried on the next one.
+    """
+    mode = Config.SNOWFLAKE_TABLE_ATTRIBUTION
+    if mode in ('access_history', 'regex'):
+        return mode
+    if conn.table_attribution is None:
+        try:
+            get_adapter('snowflake').run_query(ACCESS_HISTORY_PROBE, label='access_history_probe', raise_errors=True)
+            conn.table_attribution = 'access_history'
+        except Exception as e:
+            if not (isinstance(e, ProgrammingError) and e.sqlstate in ACCESS_DENIED_SQLSTATES):
+                logger.warning(f'Could not probe ACCESS_HISTORY, attributing table costs with regex until the next refresh: {e}')
+                return 'regex'
+            conn.table_attribution = 'regex'
+        logger.info(f'Snowflake table costs attributed with {conn.table_attribution}')
+    return conn.table_attribution
+
+def table_costs_query(database, attribution='regex', window_days=None):
+    """
+    Per-table costs over the last SNOWFLAKE_ACCESS_HISTORY_DAYS (or window_days)
+    of query start times, the same window for both attributions so they can be
+    compared like for like.
+    """
+    window_days = int(window_days or Config.SNOWFLAKE_ACCESS_HISTORY_DAYS)
+    if attribution == 'access_history':
+        return access_history_table_costs_query(database, window_days)
+    # Raw string formatted afterwards - matching restore.py apart from the start time window
+    query = r"""
         SELECT
             CASE
-                WHEN REGEXP_SUBSTR(QUERY_TEXT, '\\\\bFROM\\\\s+{database}\\\\.([\\\\w\\\\.]+)', 1, 1, 'i', 1) IS NULL THEN 'temporary_table'
-                ELSE REGEXP_SUBSTR(QUERY_TEXT, '\\\\bFROM\\\\s+{database}\\\\.([\\\\w\\\\.]+)', 1, 1, 'i', 1)
+                WHEN REGEXP_SUBSTR(QUERY_TEXT, '\\bFROM\\s+{0}\\.([\\w\\.]+)', 1, 1, 'i', 1) IS NULL THEN 'temporary_table'
+                ELSE REGEXP_SUBSTR(QUERY_TEXT, '\\bFROM\\s+{0}\\.([\\w\\.]+)', 1, 1, 'i', 1)
             END AS table_name,
             COUNT(*) AS total_queries,
             SUM(bytes_scanned) / 1073741824 AS total_cost_gb,
@@ -142,149 +342,98 @@ def get_all_stats():
             SUM(CASE WHEN error_code IS NULL THEN 1 ELSE 0 END) AS success_count,
             SUM(CASE WHEN error_code IS NOT NULL THEN 1 ELSE 0 END) AS failure_count
         FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
-        WHERE QUERY_TEXT ILIKE '%FROM%{database}.%' AND bytes_scanned IS NOT NULL
+        WHERE QUERY_TEXT ILIKE '%FROM%{0}.%' AND bytes_scanned IS NOT NULL
+            AND start_time >= DATEADD('day', -{1}, CURRENT_TIMESTAMP())
         GROUP BY table_name
         ORDER BY total_cost_gb DESC
+        """
+    return query.format(database, window_days)
+
+def access_history_table_costs_query(database, window_days=None):
     """
-    
-    queries = {
-        'basic_metrics': """
-            SELECT 
-                (SELECT COUNT(*) FROM INFORMATION_SCHEMA.SCHEMATA) AS dataset_count,
-                (SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES) AS table_count,
-                (SELECT COUNT(*) FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY) AS total_queries_executed,
-                (SELECT ROUND(AVG(DATEDIFF('second', start_time, end_time)), 2) 
-                 FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY) AS avg_execution_time_seconds,
-                (SELECT ROUND(100 * COUNT_IF(error_code IS NOT NULL) / COUNT(*), 2) 
-                 FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY) AS query_failure_rate_percentage
-        """,
-        'monthly_costs': """
-            WITH monthly_queries AS (
-                SELECT 
-                    TO_VARCHAR(DATE_TRUNC('month', start_time), 'YYYY-MM') AS month,
-                    COUNT(*) AS query_count,
-                    SUM(bytes_scanned) / 1073741824.0 AS query_cost_gb
-                FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
-                WHERE start_time >= DATEADD(month, -6, CURRENT_DATE())
-                GROUP BY month
-            ),
-            storage_metrics AS (
-                SELECT 
-                    SUM(((ACTIVE_BYTES + TIME_TRAVEL_BYTES + FAILSAFE_BYTES + RETAINED_FOR_CLONE_BYTES) / 1024)/1024)/1024 AS total_storage_gb
-                FROM "INFORMATION_SCHEMA".TABLE_STORAGE_METRICS
-                WHERE TABLE_CATALOG = CURRENT_DATABASE()
-            )
-            SELECT 
-                m.month,
-                m.query_count,
-                m.query_cost_gb,
-                COALESCE(s.total_storage_gb, 0) AS storage_cost_gb,
-                COALESCE(m.query_cost_gb, 0) + COALESCE(s.total_storage_gb, 0) AS total_cost_gb
-            FROM monthly_queries m
-            CROSS JOIN storage_metrics s
-            ORDER BY month
-        """,
-        'daily_costs': """
-            WITH daily_queries AS (
-                SELECT 
-                    TO_VARCHAR(DATE_TRUNC('day', start_time), 'YYYY-MM-DD') AS day,
-                    COUNT(*) AS query_count,
-                    SUM(bytes_scanned) / 1073741824.0 AS query_cost_gb
-                FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
-                WHERE start_time >= DATEADD(day, -30, CURRENT_DATE())
-                GROUP BY day
-            ),
-            storage_metrics AS (
-                SELECT 
-                    SUM(((ACTIVE_BYTES + TIME_TRAVEL_BYTES + FAILSAFE_BYTES + RETAINED_FOR_CLONE_BYTES) / 1024)/1024)/1024 AS total_storage_gb
-                FROM "INFORMATION_SCHEMA".TABLE_STORAGE_METRICS
-                WHERE TABLE_CATALOG = CURRENT_DATABASE()
-            )
-            SELECT 
-                d.day,
-                d.query_count,
-                d.query_cost_gb,
-                COALESCE(s.total_storage_gb, 0) AS storage_cost_gb,
-                COALESCE(d.query_cost_gb, 0) + COALESCE(s.total_storage_gb, 0) AS total_cost_gb
-            FROM daily_queries d
-            CROSS JOIN storage_metrics s
-            ORDER BY day
-        """,
-        'user_costs': """
-            SELECT 
-                USER_NAME as user_email,
-                COUNT(*) AS total_queries,
-                SUM(bytes_scanned) / 1073741824.0 AS total_cost_gb,
-                TO_CHAR(MIN(start_time), 'YYYY-MM-DD HH24:MI:SS') AS first_query_date,
-                TO_CHAR(MAX(start_time), 'YYYY-MM-DD HH24:MI:SS') AS last_query_date,
-                ROUND(AVG(DATEDIFF('second', start_time, end_time)), 2) AS avg_execution_time_sec,
-                SUM(CASE WHEN error_code IS NULL THEN 1 ELSE 0 END) AS success_count,
-                SUM(CASE WHEN error_code IS NOT NULL THEN 1 ELSE 0 END) AS failure_count
-            FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
-            GROUP BY user_email
-            ORDER BY total_cost_gb DESC
-            LIMIT 15
-        """,
-        'table_costs': table_costs_query
-    }
-    
-    results = conn.execute_queries(queries)
-    
-    # Process results and convert decimals
-    basic_metrics = convert_decimals(results.get('basic_metrics', [{}])[0])
-    monthly_costs = convert_decimals(results.get('monthly_costs', []))
-    daily_costs = convert_decimals(results.get('daily_costs', []))
-    user_costs = convert_decimals(results.get('user_costs', []))
-    table_costs = convert_decimals(results.get('table_costs', []))
-    
-    # Transform table costs to match restore.py format exactly
-    transformed_table_costs = []
-    for row in table_costs:
-        table_name = row.get('TABLE_NAME')
-        dataset = 'system'
-        table = table_name
-        if table_name:
-            parts = table_name.split('.')
-            if len(parts) == 2:
-                dataset, table = parts
-            elif len(parts) == 1:
-                table = parts[0]
-        transformed_table_costs.append({
-            'dataset': dataset,
-            'table': table,
-            'total_cost_gb': row.get('TOTAL_COST_GB'),
-            'total_queries': row.get('TOTAL_QUERIES'),
-            'avg_query_cost_gb': row.get('AVG_QUERY_COST_GB'),
-            'first_query_date': row.get('FIRST_QUERY_DATE'),
-            'last_query_date': row.get('LAST_QUERY_DATE'),
-            'total_execution_time_min': row.get('TOTAL_EXECUTION_TIME_MIN'),
-            'avg_execution_time_sec': row.get('AVG_EXECUTION_TIME_SEC'),
-            'success_count': row.get('SUCCESS_COUNT'),
-            'failure_count': row.get('FAILURE_COUNT')
-        })
-    
-    # Transform monthly and daily costs to match format
-    transformed_monthly_costs = [{
-        'month': row.get('MONTH'),
-        'query_count': int(row.get('QUERY_COUNT', 0)),
-        'total_cost_gb': float(row.get('TOTAL_COST_GB', 0))
-    } for row in monthly_costs]
-    
-    transformed_daily_costs = [{
-        'day': row.get('DAY'),
+    Table costs from ACCESS_HISTORY.base_objects_accessed joined to QUERY_HISTORY
+    by query id, so joins, CTEs and quoted identifiers are attributed without
+    scanning QUERY_TEXT. Objects are resolved through their objectId in
+    ACCOUNT_USAGE.TABLES instead of splitting objectName, whose quoted parts
+    may contain dots. A query reading several tables counts once for each,
+    its bytes are split evenly between them.
+    """
+    window_days = int(window_days or Config.SNOWFLAKE_ACCESS_HISTORY_DAYS)
+    return f"""
+        WITH accessed AS (
+            SELECT DISTINCT
+                ah.query_id,
+                t.table_schema,
+                t.table_name
+            FROM SNOWFLAKE.ACCOUNT_USAGE.ACCESS_HISTORY ah,
+                LATERAL FLATTEN(input => ah.base_objects_accessed) obj,
+                SNOWFLAKE.ACCOUNT_USAGE.TABLES t
+            WHERE t.table_id = obj.value:"objectId"::NUMBER
+                AND ah.query_start_time >= DATEADD('day', -{window_days}, CURRENT_TIMESTAMP())
+                AND obj.value:"objectDomain"::STRING IN ('Table', 'View', 'Materialized view', 'External table')
+                AND UPPER(t.table_catalog) = UPPER('{database}')
+        ),
+        attributed AS (
+            SELECT
+                a.table_schema,
+                a.table_name,
+                q.bytes_scanned / COUNT(*) OVER (PARTITION BY a.query_id) AS bytes_attributed,
+                q.start_time,
+                q.end_time,
+                q.error_code
+            FROM accessed a
+            JOIN SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY q ON q.query_id = a.query_id
+            WHERE q.start_time >= DATEADD('day', -{window_days}, CURRENT_TIMESTAMP()) AND q.bytes_scanned IS NOT NULL
+        )
+        SELECT
+            table_schema,
+            table_name,
+            COUNT(*) AS total_queries,
+            SUM(bytes_attributed) / 1073741824 AS total_cost_gb,
+            AVG(bytes_attributed) / 1073741824 AS avg_query_cost_gb,
+            MIN(start_time) AS first_query_date,
+            MAX(start_time) AS last_query_date,
+            SUM(DATEDIFF('second', start_time, end_time)) / 60 AS total_execution_time_min,
+            ROUND(AVG(DATEDIFF('second', start_time, end_time)), 2) AS avg_execution_time_sec,
+            SUM(CASE WHEN error_code IS NULL THEN 1 ELSE 0 END) AS success_count,
+            SUM(CASE WHEN error_code IS NOT NULL THEN 1 ELSE 0 END) AS failure_count
+        FROM attributed
+        GROUP BY table_schema, table_name
+        ORDER BY total_cost_gb DESC
+        """
+
+USER_COSTS_QUERY = """
+        SELECT
+            USER_NAME as user_email,
+            COUNT(*) AS total_queries,
+            SUM(bytes_scanned) / 1073741824.0 AS total_cost_gb,
+            TO_CHAR(MIN(start_time), 'YYYY-MM-DD HH24:MI:SS') AS first_query_date,
+            TO_CHAR(MAX(start_time), 'YYYY-MM-DD HH24:MI:SS') AS last_query_date,
+            ROUND(AVG(DATEDIFF('second', start_time, end_time)), 2) AS avg_execution_time_sec,
+            SUM(CASE WHEN error_code IS NULL THEN 1 ELSE 0 END) AS success_count,
+            SUM(CASE WHEN error_code IS NOT NULL THEN 1 ELSE 0 END) AS failure_count
+        FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
+        GROUP BY user_email
+        ORDER BY total_cost_gb DESC
+        LIMIT 15
+        """
+
+def transform_period_costs(rows, period):
+    return [{
+        period: row.get(period.upper()),
         'query_count': int(row.get('QUERY_COUNT', 0)),
         'total_cost_gb': float(row.get('TOTAL_COST_GB', 0))
-    } for row in daily_costs]
-    
-    # Transform user costs to match format
-    transformed_user_costs = []
-    for row in user_costs:
+    } for row in rows]
+
+def transform_user_costs(rows):
+    transformed = []
+    for row in rows:
         total_cost_gb = float(row.get('TOTAL_COST_GB', 0))
         total_queries = int(row.get('TOTAL_QUERIES', 0))
         avg_execution_time_sec = float(row.get('AVG_EXECUTION_TIME_SEC', 0))
         avg_query_cost_gb = total_cost_gb / total_queries if total_queries > 0 else 0
         total_execution_time_min = (avg_execution_time_sec * total_queries) / 60 if total_queries > 0 else 0
-        transformed_user_costs.append({
+        transformed.append({
             'user_email': row.get('USER_EMAIL'),
             'total_cost_gb': total_cost_gb,
             'total_queries': total_queries,
@@ -296,24 +445,124 @@ def get_all_stats():
             'success_count': int(row.get('SUCCESS_COUNT', 0)),
             'failure_count': int(row.get('FAILURE_COUNT', 0))
         })
-    
-    return {
-        'dataset_count': int(basic_metrics.get('DATASET_COUNT', 0)),
-        'table_count': int(basic_metrics.get('TABLE_COUNT', 0)),
-        'total_queries': int(basic_metrics.get('TOTAL_QUERIES_EXECUTED', 0)),
-        'avg_execution_time': float(basic_metrics.get('AVG_EXECUTION_TIME_SECONDS', 0)),
-        'failure_rate': float(basic_metrics.get('QUERY_FAILURE_RATE_PERCENTAGE', 0)),
-        'monthly_costs': json.dumps(transformed_monthly_costs),
-        'daily_costs': json.dumps(transformed_daily_costs),
-        'user_costs': json.dumps(transformed_user_costs),
-        'table_costs': json.dumps(transformed_table_costs)
-    }
+    return transformed
+
+def transform_table_costs(rows):
+    transformed = []
+    for row in rows:
+        if row.get('TABLE_SCHEMA'):
+            # ACCESS_HISTORY attribution returns the schema and table separately
+            dataset, table = row['TABLE_SCHEMA'], row.get('TABLE_NAME')
+        else:
+            dataset, table = split_table_reference(row.get('TABLE_NAME'))
+        transformed.append({
+            'dataset': dataset,
+            'table': table,
+            'total_cost_gb': float(row.get('TOTAL_COST_GB') or 0),
+            'total_queries': int(row.get('TOTAL_QUERIES') or 0),
+            'avg_query_cost_gb': float(row.get('AVG_QUERY_COST_GB') or 0),
+            'first_query_date': row.get('FIRST_QUERY_DATE'),
+            'last_query_date': row.get('LAST_QUERY_DATE'),
+            'total_execution_time_min': float(row.get('TOTAL_EXECUTION_TIME_MIN') or 0),
+            'avg_execution_time_sec': float(row.get('AVG_EXECUTION_TIME_SEC') or 0),
+            'success_count': int(row.get('SUCCESS_COUNT') or 0),
+            'failure_count': int(row.get('FAILURE_COUNT') or 0)
+        })
+    return transformed
+
+def get_all_stats():
+    """
+    Canonical Snowflake collector: every /stats card, chart and table over the
+    session pool, returned under the stats.html keys, or None on failure.
+
+    QUERY_HISTORY totals come from one scan, and the month and day charts share
+    a single storage_metrics CTE instead of computing it once per chart.
+    """
+    try:
+        conn = SnowflakeConnection.get_instance()
+        database = conn.secrets['SNOWFLAKE_DATABASE']
+        queries = {
+            'basic_metrics': """
+                SELECT
+                    (SELECT COUNT(*) FROM INFORMATION_SCHEMA.SCHEMATA) AS dataset_count,
+                    (SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES) AS table_count,
+                    q.total_queries_executed,
+                    q.avg_execution_time_seconds,
+                    q.query_failure_rate_percentage
+                FROM (
+                    SELECT
+                        COUNT(*) AS total_queries_executed,
+                        ROUND(AVG(DATEDIFF('second', start_time, end_time)), 2) AS avg_execution_time_seconds,
+                        ROUND(100 * COUNT_IF(error_code IS NOT NULL) / NULLIF(COUNT(*), 0), 2) AS query_failure_rate_percentage
+                    FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
+                ) q
+            """,
+            'period_costs': f"""
+                WITH period_queries AS (
+                    SELECT
+                        'month' AS period,
+                        TO_VARCHAR(DATE_TRUNC('month', start_time), 'YYYY-MM') AS period_label,
+                        COUNT(*) AS query_count,
+                        SUM(bytes_scanned) / 1073741824.0 AS query_cost_gb
+                    FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
+                    WHERE start_time >= DATEADD(month, -6, CURRENT_DATE())
+                    GROUP BY period_label
+                    UNION ALL
+                    SELECT
+                        'day' AS period,
+                        TO_VARCHAR(DATE_TRUNC('day', start_time), 'YYYY-MM-DD') AS period_label,
+                        COUNT(*) AS query_count,
+                        SUM(bytes_scanned) / 1073741824.0 AS query_cost_gb
+                    FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
+                    WHERE start_time >= DATEADD(day, -30, CURRENT_DATE())
+                    GROUP BY period_label
+                ),{STORAGE_METRICS_CTE}
+                SELECT
+                    p.period,
+                    p.period_label,
+                    p.query_count,
+                    p.query_cost_gb,
+                    COALESCE(s.total_storage_gb, 0) AS storage_cost_gb,
+                    COALESCE(p.query_cost_gb, 0) + COALESCE(s.total_storage_gb, 0) AS total_cost_gb
+                FROM period_queries p
+                CROSS JOIN storage_metrics s
+                ORDER BY p.period, p.period_label
+            """,
+            'user_costs': USER_COSTS_QUERY,
+            'table_costs': table_costs_query(database, table_attribution(conn))
+        }
+        results = run_queries(queries)
+        if any(name not in results for name in queries):
+            return None
+
+        basic_metrics = results['basic_metrics'][0] if results['basic_metrics'] else {}
+        period_costs = results['period_costs']
+        monthly_costs = [{**row, 'MONTH': row.get('PERIOD_LABEL')} for row in period_costs if row.get('PERIOD') == 'month']
+        daily_costs = [{**row, 'DAY': row.get('PERIOD_LABEL')} for row in period_costs if row.get('PERIOD') == 'day']
+        avg_execution_time = basic_metrics.get('AVG_EXECUTION_TIME_SECONDS')
+        failure_rate = basic_metrics.get('QUERY_FAILURE_RATE_PERCENTAGE')
+        return {
+            # cards
+            'dataset_count': int(basic_metrics.get('DATASET_COUNT', 0)),
+            'table_count': int(basic_metrics.get('TABLE_COUNT', 0)),
+            'total_query_executed': int(basic_metrics.get('TOTAL_QUERIES_EXECUTED', 0)),
+            'avg_execution_time_seconds': float(avg_execution_time) if avg_execution_time is not None else None,
+            'failure_rate_percentage': float(failure_rate) if failure_rate is not None else None,
+            # charts
+            'query_cost_by_months_chart': dumps(transform_period_costs(monthly_costs, 'month')),
+            'query_cost_by_days_chart': dumps(transform_period_costs(daily_costs, 'day')),
+            # tables
+            'total_cost_gb_by_users': dumps(transform_user_costs(results['user_costs'])),
+            'total_cost_gb_by_table': dumps(transform_table_costs(results['table_costs']))
+        }
+    except Exception as e:
+        logger.error(f'Error in get_all_stats: {e}')
+        return None
 
 def get_dataset_count():
     try:
         query = "SELECT COUNT(*) AS dataset_count FROM INFORMATION_SCHEMA.SCHEMATA"
-        conn = SnowflakeConnection.get_instance()
-        results = conn.execute_queries({'dataset_count': query})
+        results = run_queries({'dataset_count': query})
         if not results.get('dataset_count'):
             return None
         return int(results['dataset_count'][0].get('DATASET_COUNT', 0))
@@ -324,8 +573,7 @@ def get_dataset_count():
 def get_table_count():
     try:
         query = "SELECT COUNT(*) AS table_count FROM INFORMATION_SCHEMA.TABLES"
-        conn = SnowflakeConnection.get_instance()
-        results = conn.execute_queries({'table_count': query})
+        results = run_queries({'table_count': query})
         if not results.get('table_count'):
             return None
         return int(results['table_count'][0].get('TABLE_COUNT', 0))
@@ -336,8 +584,7 @@ def get_table_count():
 def get_total_query_executed():
     try:
         query = "SELECT COUNT(*) AS total_queries_executed FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY"
-        conn = SnowflakeConnection.get_instance()
-        results = conn.execute_queries({'total_queries': query})
+        results = run_queries({'total_queries': query})
         if not results.get('total_queries'):
             return None
         return int(results['total_queries'][0].get('TOTAL_QUERIES_EXECUTED', 0))
@@ -352,8 +599,7 @@ def get_avg_execution_time_seconds():
         FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
         WHERE end_time IS NOT NULL
         """
-        conn = SnowflakeConnection.get_instance()
-        results = conn.execute_queries({'avg_time': query})
+        results = run_queries({'avg_time': query})
         if not results.get('avg_time'):
             return None
         return float(results['avg_time'][0].get('AVG_EXECUTION_TIME_SECONDS', 0))
@@ -367,8 +613,7 @@ def get_failure_rate_percentage():
         SELECT ROUND(100 * COUNT_IF(error_code IS NOT NULL) / COUNT(*), 2) AS query_failure_rate_percentage
         FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
         """
-        conn = SnowflakeConnection.get_instance()
-        results = conn.execute_queries({'failure_rate': query})
+        results = run_queries({'failure_rate': query})
         if not results.get('failure_rate'):
             return None
         return float(results['failure_rate'][0].get('QUERY_FAILURE_RATE_PERCENTAGE', 0))
@@ -378,7 +623,7 @@ def get_failure_rate_percentage():
 
 def get_query_cost_by_month():
     try:
-        query = """
+        query = f"""
         WITH monthly_queries AS (
             SELECT 
                 TO_VARCHAR(DATE_TRUNC('month', start_time), 'YYYY-MM') AS month,
@@ -387,13 +632,7 @@ def get_query_cost_by_month():
             FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
             WHERE start_time >= DATEADD(month, -6, CURRENT_DATE())
             GROUP BY month
-        ),
-        storage_metrics AS (
-            SELECT 
-                SUM(((ACTIVE_BYTES + TIME_TRAVEL_BYTES + FAILSAFE_BYTES + RETAINED_FOR_CLONE_BYTES) / 1024)/1024)/1024 AS total_storage_gb
-            FROM "INFORMATION_SCHEMA".TABLE_STORAGE_METRICS
-            WHERE TABLE_CATALOG = CURRENT_DATABASE()
-        )
+        ),{STORAGE_METRICS_CTE}
         SELECT 
             m.month,
             m.query_count,
@@ -404,22 +643,15 @@ def get_query_cost_by_month():
         CROSS JOIN storage_metrics s
         ORDER BY month
         """
-        conn = SnowflakeConnection.get_instance()
-        results = conn.execute_queries({'monthly_costs': query})
-        monthly_costs = convert_decimals(results.get('monthly_costs', []))
-        transformed = [{
-            'month': row.get('MONTH'),
-            'query_count': int(row.get('QUERY_COUNT', 0)),
-            'total_cost_gb': float(row.get('TOTAL_COST_GB', 0))
-        } for row in monthly_costs]
-        return json.dumps(transformed)
+        results = run_queries({'monthly_costs': query})
+        return dumps(transform_period_costs(results.get('monthly_costs', []), 'month'))
     except Exception as e:
         logger.error(f'Error in get_query_cost_by_month: {e}')
-        return json.dumps([])
+        return dumps([])
 
 def get_query_cost_for_last_30_days():
     try:
-        query = """
+        query = f"""
         WITH daily_queries AS (
             SELECT 
                 TO_VARCHAR(DATE_TRUNC('day', start_time), 'YYYY-MM-DD') AS day,
@@ -428,13 +660,7 @@ def get_query_cost_for_last_30_days():
             FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
             WHERE start_time >= DATEADD(day, -30, CURRENT_DATE())
             GROUP BY day
-        ),
-        storage_metrics AS (
-            SELECT 
-                SUM(((ACTIVE_BYTES + TIME_TRAVEL_BYTES + FAILSAFE_BYTES + RETAINED_FOR_CLONE_BYTES) / 1024)/1024)/1024 AS total_storage_gb
-            FROM "INFORMATION_SCHEMA".TABLE_STORAGE_METRICS
-            WHERE TABLE_CATALOG = CURRENT_DATABASE()
-        )
+        ),{STORAGE_METRICS_CTE}
         SELECT 
             d.day,
             d.query_count,
@@ -445,175 +671,197 @@ def get_query_cost_for_last_30_days():
         CROSS JOIN storage_metrics s
         ORDER BY day
         """
-        conn = SnowflakeConnection.get_instance()
-        results = conn.execute_queries({'daily_costs': query})
-        daily_costs = convert_decimals(results.get('daily_costs', []))
-        transformed = [{
-            'day': row.get('DAY'),
-            'query_count': int(row.get('QUERY_COUNT', 0)),
-            'total_cost_gb': float(row.get('TOTAL_COST_GB', 0))
-        } for row in daily_costs]
-        return json.dumps(transformed)
+        results = run_queries({'daily_costs': query})
+        return dumps(transform_period_costs(results.get('daily_costs', []), 'day'))
     except Exception as e:
         logger.error(f'Error in get_query_cost_for_last_30_days: {e}')
-        return json.dumps([])
+        return dumps([])
 
 def get_total_cost_gb_by_users():
+    try:
+        results = run_queries({'user_costs': USER_COSTS_QUERY})
+        return dumps(transform_user_costs(results.get('user_costs', [])))
+    except Exception as e:
+        logger.error(f'Error in get_total_cost_gb_by_users: {e}')
+        return dumps([])
+
+def get_total_cost_gb_by_table():
+    try:
+        conn = SnowflakeConnection.get_instance()
+        results = run_queries({'table_costs': table_costs_query(conn.secrets['SNOWFLAKE_DATABASE'], table_attribution(conn))})
+        return dumps(transform_table_costs(results.get('table_costs', [])))
+    except Exception as e:
+        logger.error(f'Error in get_total_cost_gb_by_table: {e}')
+        return dumps([])
+
+def split_table_reference(table_name):
+    """Split a matched `schema.table` reference into (dataset, table) like the table costs output."""
+    dataset = 'system'
+    table = table_name
+    if table_name:
+        parts = table_name.split('.')
+        if len(parts) == 2:
+            dataset, table = parts
+        elif len(parts) == 1:
+            table = parts[0]
+    return dataset, table
+
+def get_storage_gb():
     try:
         query = """
         SELECT 
-            USER_NAME as user_email,
-            COUNT(*) AS total_queries,
-            SUM(bytes_scanned) / 1073741824.0 AS total_cost_gb,
-            TO_CHAR(MIN(start_time), 'YYYY-MM-DD HH24:MI:SS') AS first_query_date,
-            TO_CHAR(MAX(start_time), 'YYYY-MM-DD HH24:MI:SS') AS last_query_date,
-            ROUND(AVG(DATEDIFF('second', start_time, end_time)), 2) AS avg_execution_time_sec,
-            SUM(CASE WHEN error_code IS NULL THEN 1 ELSE 0 END) AS success_count,
-            SUM(CASE WHEN error_code IS NOT NULL THEN 1 ELSE 0 END) AS failure_count
-        FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
-        GROUP BY user_email
-        ORDER BY total_cost_gb DESC
-        LIMIT 15
+            SUM(((ACTIVE_BYTES + TIME_TRAVEL_BYTES + FAILSAFE_BYTES + RETAINED_FOR_CLONE_BYTES) / 1024)/1024)/1024 AS total_storage_gb
+        FROM "INFORMATION_SCHEMA".TABLE_STORAGE_METRICS
+        WHERE TABLE_CATALOG = CURRENT_DATABASE()
         """
-        conn = SnowflakeConnection.get_instance()
-        results = conn.execute_queries({'user_costs': query})
-        user_costs = convert_decimals(results.get('user_costs', []))
-        transformed = []
-        for row in user_costs:
-            total_cost_gb = float(row.get('TOTAL_COST_GB', 0))
-            total_queries = int(row.get('TOTAL_QUERIES', 0))
-            avg_execution_time_sec = float(row.get('AVG_EXECUTION_TIME_SEC', 0))
-            avg_query_cost_gb = total_cost_gb / total_queries if total_queries > 0 else 0
-            total_execution_time_min = (avg_execution_time_sec * total_queries) / 60 if total_queries > 0 else 0
-            transformed.append({
-                'user_email': row.get('USER_EMAIL'),
-                'total_cost_gb': total_cost_gb,
-                'total_queries': total_queries,
-                'avg_query_cost_gb': avg_query_cost_gb,
-                'first_query_date': row.get('FIRST_QUERY_DATE'),
-                'last_query_date': row.get('LAST_QUERY_DATE'),
-                'total_execution_time_min': total_execution_time_min,
-                'avg_execution_time_sec': avg_execution_time_sec,
-                'success_count': int(row.get('SUCCESS_COUNT', 0)),
-                'failure_count': int(row.get('FAILURE_COUNT', 0))
-            })
-        return json.dumps(transformed)
+        results = run_queries({'storage': query})
+        if not results.get('storage'):
+            return 0.0
+        return float(results['storage'][0].get('TOTAL_STORAGE_GB') or 0)
     except Exception as e:
-        logger.error(f'Error in get_total_cost_gb_by_users: {e}')
-        return json.dumps([])
+        logger.error(f'Error in get_storage_gb: {e}')
+        return 0.0
 
-def get_total_cost_gb_by_table():
+def get_console_query_costs(days=1):
+    """Cost of the queries this console's user ran over the last days, from ACCOUNT_USAGE.QUERY_HISTORY."""
     try:
-        print("Starting get_total_cost_gb_by_table...")
-        
-        # Get database name from secrets
-        secrets = SnowflakeConnection.get_instance().secrets
-        database = secrets['SNOWFLAKE_DATABASE']
-        print(f"Executing query for database: {database}")
-        
-        # Create the raw string with placeholders - exactly matching restore.py
-        query = r"""
+        query = f"""
         SELECT
-            CASE
-                WHEN REGEXP_SUBSTR(QUERY_TEXT, '\\bFROM\\s+{0}\\.([\\w\\.]+)', 1, 1, 'i', 1) IS NULL THEN 'temporary_table'
-                ELSE REGEXP_SUBSTR(QUERY_TEXT, '\\bFROM\\s+{0}\\.([\\w\\.]+)', 1, 1, 'i', 1)
-            END AS table_name,
-            COUNT(*) AS total_queries,
-            SUM(bytes_scanned) / 1073741824 AS total_cost_gb,
-            AVG(bytes_scanned) / 1073741824 AS avg_query_cost_gb,
-            MIN(start_time) AS first_query_date,
-            MAX(start_time) AS last_query_date,
-            SUM(DATEDIFF('second', start_time, end_time)) / 60 AS total_execution_time_min,
-            ROUND(AVG(DATEDIFF('second', start_time, end_time)), 2) AS avg_execution_time_sec,
-            SUM(CASE WHEN error_code IS NULL THEN 1 ELSE 0 END) AS success_count,
-            SUM(CASE WHEN error_code IS NOT NULL THEN 1 ELSE 0 END) AS failure_count
+            COUNT(*) AS queries,
+            COALESCE(SUM(bytes_scanned), 0) AS bytes_scanned,
+            COALESCE(SUM(total_elapsed_time), 0) AS elapsed_ms,
+            COALESCE(SUM(bytes_scanned * percentage_scanned_from_cache), 0) AS bytes_scanned_from_cache,
+            COALESCE(SUM(credits_used_cloud_services), 0) AS credits_used_cloud_services
         FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
-        WHERE QUERY_TEXT ILIKE '%FROM%{0}.%' AND bytes_scanned IS NOT NULL
-        GROUP BY table_name
-        ORDER BY total_cost_gb DESC
+        WHERE start_time >= DATEADD('day', -{int(days)}, CURRENT_TIMESTAMP()) AND user_name = CURRENT_USER()
         """
-        
-        # Format the string after defining it - exactly matching restore.py
-        query = query.format(database)
-        
-        print(f"Executing query: {query}")  # Debug print
-        
-        # Use direct connection like restore.py
-        conn = snowflake.connector.connect(
-            user=secrets['SNOWFLAKE_USER'],
-            password=secrets.get('SNOWFLAKE_PASSWORD'),
-            account=secrets['SNOWFLAKE_ACCOUNT'],
-            warehouse=secrets['SNOWFLAKE_WAREHOUSE'],
-            database=secrets['SNOWFLAKE_DATABASE'],
-        )
-        
-        try:
-            cur = conn.cursor()
-            cur.execute(query)
-            columns = [col[0] for col in cur.description]
-            results = [dict(zip(columns, row)) for row in cur.fetchall()]
-            results = normalize_keys(results)  # Normalize keys immediately like restore.py
-        finally:
-            conn.close()
-        
-        print(f"Raw results: {results}")  # Debug print
-        
+        results = convert_decimals(run_queries({'console_costs': query}).get('console_costs', []))
         if not results:
-            print("No table costs results returned from query")
-            return json.dumps([])
-            
-        results = convert_decimals(results)
-        print(f"Converted table costs: {results}")  # Debug print
-        
-        transformed = []
-        for row in results:
-            table_name = row.get('TABLE_NAME')
-            print(f"Processing table: {table_name}")  # Debug print
-            
-            dataset = 'system'
-            table = table_name
-            if table_name:
-                parts = table_name.split('.')
-                if len(parts) == 2:
-                    dataset, table = parts
-                elif len(parts) == 1:
-                    table = parts[0]
-            
-            transformed.append({
+            return None
+        # QUERY_HISTORY does not flag result cache reuse
+        return {**{k.lower(): v for k, v in results[0].items()}, 'cache_hits': None}
+    except Exception as e:
+        logger.error(f'Error in get_console_query_costs: {e}')
+        return None
+
+def get_daily_rollup(since_day):
+    """Per day x user x table query aggregates since since_day, or None on failure."""
+    try:
+        conn = SnowflakeConnection.get_instance()
+        database = conn.secrets['SNOWFLAKE_DATABASE']
+        query = f"""
+            SELECT
+                TO_DATE(start_time) AS day,
+                COALESCE(USER_NAME, '') AS user_name,
+                CASE
+                    WHEN QUERY_TEXT ILIKE '%FROM%{database}.%' AND bytes_scanned IS NOT NULL THEN
+                        COALESCE(REGEXP_SUBSTR(QUERY_TEXT, '\\\\bFROM\\\\s+{database}\\\\.([\\\\w\\\\.]+)', 1, 1, 'i', 1), 'temporary_table')
+                    ELSE ''
+                END AS table_reference,
+                COUNT(*) AS query_count,
+                COUNT_IF(error_code IS NOT NULL) AS failure_count,
+                COUNT_IF(end_time IS NOT NULL) AS finished_count,
+                COALESCE(SUM(bytes_scanned), 0) AS bytes_billed,
+                COALESCE(SUM(DATEDIFF('second', start_time, end_time)), 0) AS execution_seconds,
+                MIN(start_time) AS first_query_time,
+                MAX(start_time) AS last_query_time
+            FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
+            WHERE start_time >= '{since_day.isoformat()}'::DATE
+            GROUP BY day, user_name, table_reference
+        """
+        results = run_queries({'daily_rollup': query})
+        if 'daily_rollup' not in results:
+            return None
+        rows = []
+        for row in results['daily_rollup']:
+            table_reference = row.get('TABLE_REFERENCE')
+            dataset, table = split_table_reference(table_reference) if table_reference else ('', '')
+            rows.append({
+                'day': row.get('DAY'),
+                'user_name': row.get('USER_NAME'),
                 'dataset': dataset,
-                'table': table,
-                'total_cost_gb': float(row.get('TOTAL_COST_GB', 0)),
-                'total_queries': int(row.get('TOTAL_QUERIES', 0)),
-                'avg_query_cost_gb': float(row.get('AVG_QUERY_COST_GB', 0)),
-                'first_query_date': row.get('FIRST_QUERY_DATE'),
-                'last_query_date': row.get('LAST_QUERY_DATE'),
-                'total_execution_time_min': float(row.get('TOTAL_EXECUTION_TIME_MIN', 0)),
-                'avg_execution_time_sec': float(row.get('AVG_EXECUTION_TIME_SEC', 0)),
-                'success_count': int(row.get('SUCCESS_COUNT', 0)),
-                'failure_count': int(row.get('FAILURE_COUNT', 0))
+                'table_name': table,
+                'query_count': int(row.get('QUERY_COUNT') or 0),
+                'failure_count': int(row.get('FAILURE_COUNT') or 0),
+                'finished_count': int(row.get('FINISHED_COUNT') or 0),
+                'bytes_billed': row.get('BYTES_BILLED') or 0,
+                'execution_seconds': float(row.get('EXECUTION_SECONDS') or 0),
+                'first_query_time': row.get('FIRST_QUERY_TIME'),
+                'last_query_time': row.get('LAST_QUERY_TIME')
             })
-        
-        print(f"Final transformed results: {transformed}")  # Debug print
-        return json.dumps(transformed)
+        return rows
     except Exception as e:
-        print(f'Error in get_total_cost_gb_by_table: {str(e)}')
-        print(f'Error type: {type(e)}')
-        import traceback
-        print(f'Traceback: {traceback.format_exc()}')
-        return json.dumps([])
-
-# Debug Local testing
-# if __name__ == "__main__":
-#     try:
-#         stats = get_all_stats()
-#         print("Dataset count:", stats['dataset_count'])
-#         print("Table count:", stats['table_count'])
-#         print("Total queries executed:", stats['total_queries'])
-#         print("Average execution time (seconds):", stats['avg_execution_time'])
-#         print("Failure rate percentage:", stats['failure_rate'])
-#         print("Query cost by months chart:", stats['monthly_costs'])
-#         print("Query cost by days chart:", stats['daily_costs'])
-#         print("Total cost GB by users:", stats['user_costs'])
-#         print("Total cost GB by table:", stats['table_costs'])
-#     except Exception as e:
-#         logger.error(f'Error in main: {e}')
+        logger.error(f'Error in get_daily_rollup: {e}')
+        return None
+
+# Credits per hour by warehouse size, to estimate the warehouse credits of a run from its execution time
+WAREHOUSE_CREDITS_PER_HOUR = {
+    'X-Small': 1, 'Small': 2, 'Medium': 4, 'Large': 8, 'X-Large': 16,
+    '2X-Large': 32, '3X-Large': 64, '4X-Large': 128, '5X-Large': 256, '6X-Large': 512
+}
+
+def compare_collection_modes():
+    """Run the nine per-metric collectors and get_all_stats once each and return measure_runs() per mode."""
+    per_metric_functions = [
+        get_dataset_count, get_table_count, get_total_query_executed, get_avg_execution_time_seconds,
+        get_failure_rate_percentage, get_query_cost_by_month, get_query_cost_for_last_30_days,
+        get_total_cost_gb_by_users, get_total_cost_gb_by_table
+    ]
+    return measure_runs({
+        'per_metric': lambda: [function() for function in per_metric_functions],
+        'batched': get_all_stats
+    })
+
+def compare_table_attribution():
+    """Run the per-table cost query with ACCESS_HISTORY and with the QUERY_TEXT regex over the same window and return the same measures per approach."""
+    conn = SnowflakeConnection.get_instance()
+    database = conn.secrets['SNOWFLAKE_DATABASE']
+    return measure_runs({
+        attribution: lambda attribution=attribution: run_queries({'table_costs': table_costs_query(database, attribution)})
+        for attribution in ('access_history', 'regex')
+    })
+
+def measure_runs(runs_by_name):
+    """
+    Call each collector once and return, per name, the wall time, query count,
+    warehouse execution time, estimated warehouse credits and cloud services
+    credits read back from the user's query history.
+    """
+    runs = {}
+    for mode, collect in runs_by_name.items():
+        with track_queries() as query_ids:
+            started = time.monotonic()
+            collect()
+            runs[mode] = {'wall_seconds': round(time.monotonic() - started, 3), 'queries': len(query_ids), 'query_ids': query_ids}
+
+    all_ids = ', '.join(f"'{query_id}'" for run in runs.values() for query_id in run['query_ids'])
+    history = run_queries({'history': f"""
+        SELECT query_id, warehouse_size, execution_time, credits_used_cloud_services
+        FROM TABLE(INFORMATION_SCHEMA.QUERY_HISTORY_BY_USER(RESULT_LIMIT => 10000))
+        WHERE query_id IN ({all_ids})
+    """}).get('history', [])
+    by_id = {row['QUERY_ID']: row for row in history}
+    for run in runs.values():
+        rows = [by_id[query_id] for query_id in run.pop('query_ids') if query_id in by_id]
+        execution_ms = sum(float(row.get('EXECUTION_TIME') or 0) for row in rows)
+        run['execution_seconds'] = round(execution_ms / 1000, 3)
+        run['warehouse_credits'] = round(sum(
+            float(row.get('EXECUTION_TIME') or 0) / 3600000 * WAREHOUSE_CREDITS_PER_HOUR.get(row.get('WAREHOUSE_SIZE'), 0)
+            for row in rows), 6)
+        run['cloud_services_credits'] = round(sum(float(row.get('CREDITS_USED_CLOUD_SERVICES') or 0) for row in rows), 6)
+    return runs
+
+# Debug Local testing: python -m app.datawarehouse_stats.snowflake_stats [--compare-modes | --compare-attribution]
+if __name__ == "__main__":
+    import sys
+    comparison = None
+    if '--compare-modes' in sys.argv:
+        comparison = compare_collection_modes
+    elif '--compare-attribution' in sys.argv:
+        comparison = compare_table_attribution
+    if comparison:
+        for mode, run in comparison().items():
+            print(f"{mode}: {run['wall_seconds']}s wall, {run['queries']} queries, {run['execution_seconds']}s warehouse time, "
+                  f"~{run['warehouse_credits']} warehouse credits, {run['cloud_services_credits']} cloud services credits")
+    else:
+        print(dumps(get_all_stats(), datetime_format='%Y-%m-%d %H:%M:%S'))
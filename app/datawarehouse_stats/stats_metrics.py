@@ -0,0 +1,347 @@
+"""
+Per-metric refresh schedules and cache entries for the /stats page.
+
+Every card, chart and table on the page is cached under its own key with its
+own refresh interval and TTL, so cheap metadata counts and expensive cost
+tables no longer share one all-or-nothing 'global_stats' entry. Defaults can be
+overridden per warehouse type with the STATS_METRIC_SCHEDULES setting.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from app.config import Config
+from app.datawarehouse_stats.adapters import get_adapter, is_supported
+
+logger = logging.getLogger(__name__)
+
+# metric: (collector function, page section, default interval seconds, default ttl seconds)
+# TTLs are kept well above the interval so a failed refresh keeps showing the last value.
+STATS_METRICS = {
+    # cards
+    'dataset_count': ('get_dataset_count', 'cards', 3600, 86400),
+    'table_count': ('get_table_count', 'cards', 3600, 86400),
+    'total_query_executed': ('get_total_query_executed', 'cards', 900, 7200),
+    'avg_execution_time_seconds': ('get_avg_execution_time_seconds', 'cards', 900, 7200),
+    'failure_rate_percentage': ('get_failure_rate_percentage', 'cards', 900, 7200),
+    # charts
+    'query_cost_by_months_chart': ('get_query_cost_by_month', 'charts', 21600, 172800),
+    'query_cost_by_days_chart': ('get_query_cost_for_last_30_days', 'charts', 3600, 21600),
+    # tables
+    'total_cost_gb_by_users': ('get_total_cost_gb_by_users', 'tables', 21600, 172800),
+    'total_cost_gb_by_table': ('get_total_cost_gb_by_table', 'tables', 43200, 172800),
+}
+
+# Metrics computed over the selected creation_time window on warehouses that support one
+WINDOWED_METRICS = {
+    'total_query_executed', 'avg_execution_time_seconds', 'failure_rate_percentage',
+    'query_cost_by_months_chart', 'query_cost_by_days_chart',
+    'total_cost_gb_by_users', 'total_cost_gb_by_table',
+}
+
+METRIC_SECTIONS = {metric: section for metric, (_, section, _, _) in STATS_METRICS.items()}
+
+
+def get_metric_schedule(dwh_type, metric):
+    """Return {'interval': seconds, 'ttl': seconds} for a metric on a warehouse type."""
+    _, _, interval, ttl = STATS_METRICS[metric]
+    schedule = {'interval': interval, 'ttl': ttl}
+    # Built-in per-warehouse overrides come from the warehouse's adapter
+    if is_supported(dwh_type):
+        schedule.update(get_adapter(dwh_type).schedules.get(metric, {}))
+    schedule.update(Config.STATS_METRIC_SCHEDULES.get(dwh_type, {}).get(metric, {}))
+    return schedule
+
+def supports_window(dwh_type):
+    """True when the warehouse's job statistics can be computed over a selectable time window."""
+    return is_supported(dwh_type) and get_adapter(dwh_type).supports_window()
+
+def get_default_window(dwh_type):
+    return Config.BIGQUERY_STATS_WINDOW_DAYS if supports_window(dwh_type) else None
+
+def resolve_window(dwh_type, metric, window_days):
+    """
+    Return the window a metric is computed and cached for, None for the
+    default window (and for warehouses or metrics without one).
+    """
+    if window_days is None or not supports_window(dwh_type) or metric not in WINDOWED_METRICS:
+        return None
+    window_days = int(window_days)
+    return None if window_days == Config.BIGQUERY_STATS_WINDOW_DAYS else window_days
+
+def _window_suffix(window_days):
+    return f'_{window_days}d' if window_days else ''
+
+def metric_cache_key(dwh_type, metric, window_days=None):
+    return f'dwh_stats_{dwh_type}_{metric}{_window_suffix(resolve_window(dwh_type, metric, window_days))}'
+
+def metric_inflight_key(dwh_type, metric, window_days=None):
+    return f'dwh_stats_inflight_{dwh_type}_{metric}{_window_suffix(resolve_window(dwh_type, metric, window_days))}'
+
+def metric_duration_key(dwh_type, metric, window_days=None):
+    return f'dwh_stats_duration_{dwh_type}_{metric}{_window_suffix(resolve_window(dwh_type, metric, window_days))}'
+
+def last_refresh_key(dwh_type, window_days=None):
+    window_days = None if window_days is None or int(window_days) == get_default_window(dwh_type) else int(window_days)
+    return f'dwh_stats_last_refresh_{dwh_type}{_window_suffix(window_days)}'
+
+BUDGET_EXCEEDED = 'Byte budget exceeded'
+
+class StatsBudgetExceeded(Exception):
+    """The warehouse refused a refresh's queries as over budget, retrying cannot help."""
+
+@contextmanager
+def refresh_budget(adapter, refresh_id=None):
+    """
+    Run a refresh inside the warehouse's byte budget (refresh_budget()) when it
+    has one, raising StatsBudgetExceeded if any query was refused. Every metric
+    task of one dispatched refresh passes the same refresh_id and so draws from
+    one budget, kept in Redis by the warehouse module.
+    """
+    budget = adapter.refresh_budget()
+    if budget is None:
+        yield None
+        return
+    with budget(refresh_id) as totals:
+        yield totals
+    if totals['exceeded']:
+        raise StatsBudgetExceeded(totals['exceeded'])
+
+def is_budget_error(error):
+    return bool(error) and error.startswith(BUDGET_EXCEEDED)
+
+def uses_rollups(dwh_type):
+    """True when the warehouse's query metrics are read from the local rollups (see WarehouseAdapter.uses_rollups)."""
+    return get_adapter(dwh_type).uses_rollups()
+
+def collect_metric(dwh_type, metric, window_days=None, refresh_id=None):
+    """Compute a single metric straight from the warehouse (or the local rollups)."""
+    adapter = get_adapter(dwh_type)
+    if adapter.uses_rollups():
+        # Import rollup_store only when needed
+        from app.datawarehouse_stats.rollup_store import ROLLUP_METRICS, get_rollup_metric
+        if metric in ROLLUP_METRICS:
+            return adapter.normalize(get_rollup_metric(dwh_type, metric), METRIC_SECTIONS[metric])
+    window_days = resolve_window(dwh_type, metric, window_days)
+    with refresh_budget(adapter, refresh_id):
+        return adapter.collect(STATS_METRICS[metric][0], METRIC_SECTIONS[metric], window_days)
+
+def uses_batch_collection(dwh_type):
+    """True when the warehouse computes every metric from one batched collector (get_all_stats)."""
+    return get_adapter(dwh_type).uses_batch_collection()
+
+def store_metric_result(cache, dwh_type, metric, value, error, duration, final_attempt=True, window_days=None):
+    """
+    Store the outcome of one metric refresh under its own cache key.
+
+    A failed refresh keeps the previously cached value and its last_success
+    timestamp, only last_attempt and error are updated. When final_attempt is
+    False (the task will be retried) a failure leaves the cache untouched so
+    pollers keep waiting on the inflight marker.
+
+    Returns:
+        dict: The cache entry with value, last_success, last_attempt, error and duration_seconds.
+    """
+    cache_key = metric_cache_key(dwh_type, metric, window_days)
+    schedule = get_metric_schedule(dwh_type, metric)
+    entry = cache.get(cache_key) or {'value': None, 'last_success': None}
+    now = datetime.now(timezone.utc).isoformat()
+
+    entry['last_attempt'] = now
+    entry['duration_seconds'] = duration
+    entry['error'] = error
+    if error is None:
+        entry['value'] = value
+        entry['last_success'] = now
+        logger.info(f"Refreshed {cache_key} in {entry['duration_seconds']}s")
+    elif not final_attempt:
+        logger.warning(f"Refresh of {cache_key} failed, retrying: {error}")
+        return entry
+    else:
+        logger.error(f"Refresh of {cache_key} failed, keeping last value from {entry['last_success']}: {error}")
+    cache.set(cache_key, entry, timeout=schedule['ttl'])
+    # Kept without expiry so a cold cache can still estimate how long a refresh takes
+    cache.set(metric_duration_key(dwh_type, metric, window_days), entry['duration_seconds'], timeout=0)
+    cache.delete(metric_inflight_key(dwh_type, metric, window_days))
+    return entry
+
+def refresh_metric(cache, dwh_type, metric, final_attempt=True, window_days=None, refresh_id=None):
+    """Recompute one metric and store it, see store_metric_result."""
+    started = time.monotonic()
+    try:
+        value = collect_metric(dwh_type, metric, window_days, refresh_id)
+        error = None if value is not None else 'No data returned'
+    except StatsBudgetExceeded as e:
+        # Keep the cached snapshot right away instead of retrying a refused query
+        value, error, final_attempt = None, f'{BUDGET_EXCEEDED}: {e}', True
+    except Exception as e:
+        value, error = None, str(e)
+    duration = round(time.monotonic() - started, 3)
+    return store_metric_result(cache, dwh_type, metric, value, error, duration, final_attempt, window_days)
+
+def refresh_metrics_batch(cache, dwh_type, metrics=None, final_attempt=True, window_days=None, refresh_id=None):
+    """
+    Recompute several metrics with the warehouse's batched collector and store each one.
+
+    Returns:
+        dict: {metric: cache entry}
+    """
+    metrics = list(metrics or STATS_METRICS)
+    adapter = get_adapter(dwh_type)
+    started = time.monotonic()
+    try:
+        with refresh_budget(adapter, refresh_id):
+            stats = adapter.collect_all(METRIC_SECTIONS, window_days)
+        error = None if stats else 'No data returned'
+    except StatsBudgetExceeded as e:
+        stats, error, final_attempt = None, f'{BUDGET_EXCEEDED}: {e}', True
+    except Exception as e:
+        stats, error = None, str(e)
+    duration = round(time.monotonic() - started, 3)
+
+    entries = {}
+    for metric in metrics:
+        value = stats.get(metric) if stats else None
+        metric_error = error or (None if value is not None else 'No data returned')
+        entries[metric] = store_metric_result(cache, dwh_type, metric, value, metric_error, duration, final_attempt, window_days)
+    return entries
+
+def get_cached_metrics(cache, dwh_type, metrics=None, window_days=None):
+    """Return {metric: cache entry or None} for the given metrics in one round trip."""
+    metrics = list(metrics or STATS_METRICS)
+    entries = cache.get_many(*[metric_cache_key(dwh_type, metric, window_days) for metric in metrics])
+    return dict(zip(metrics, entries))
+
+def assemble_stats(dwh_type, entries):
+    """
+    Build the stats.html context from per-metric cache entries.
+
+    Returns:
+        tuple: (stats_data, stats_freshness) where stats_data maps every metric
+        to its value and stats_freshness maps every metric to its section,
+        last_success and a stale flag (older than twice its refresh interval).
+    """
+    now = datetime.now(timezone.utc)
+    stats_data = {}
+    stats_freshness = {}
+    for metric, (_, section, _, _) in STATS_METRICS.items():
+        entry = entries.get(metric) or {}
+        last_success = entry.get('last_success')
+        if last_success:
+            age = (now - datetime.fromisoformat(last_success)).total_seconds()
+            stale = age > 2 * get_metric_schedule(dwh_type, metric)['interval']
+        else:
+            stale = True
+        value = entry.get('value')
+        if value is None and section != 'cards':
+            # Charts and tables are embedded as JSON in the page scripts
+            value = '[]'
+        stats_data[metric] = value
+        stats_freshness[metric] = {
+            'section': section,
+            'last_success': last_success,
+            'stale': stale,
+            'error': entry.get('error')
+        }
+    return stats_data, stats_freshness
+
+def get_dwh_stats(cache, dwh_type, window_days=None):
+    """Assemble the /stats payload from cache only, missing metrics are left empty."""
+    if not is_supported(dwh_type):
+        logger.error(f"Unsupported data warehouse type: {dwh_type}")
+        return assemble_stats(dwh_type, {})
+    return assemble_stats(dwh_type, get_cached_metrics(cache, dwh_type, window_days=window_days))
+
+def get_time_limit(dwh_type):
+    # Each warehouse gets its own budget so a slow one cannot starve the others
+    return int(Config.STATS_WAREHOUSE_TIME_LIMITS.get(dwh_type, Config.STATS_METRIC_TIME_LIMIT))
+
+def get_inflight_timeout(dwh_type):
+    # Covers every attempt of a metric task including the backoff between retries
+    attempts = Config.STATS_METRIC_MAX_RETRIES + 1
+    backoff = sum(Config.STATS_METRIC_RETRY_DELAY * 2 ** retry for retry in range(Config.STATS_METRIC_MAX_RETRIES))
+    return get_time_limit(dwh_type) * attempts + backoff
+
+def queue_metric_refresh(cache, dwh_type, metrics, release_lock=False, window_days=None):
+    """
+    Queue a Celery refresh for the given metrics as one chord.
+
+    Each metric gets an inflight marker set with an atomic add, metrics that
+    already have one are joined instead of being queued again. release_lock
+    makes the chord's finalizer release the cache_dwh_stats mutex.
+
+    Returns:
+        list: The metrics that were queued by this call.
+    """
+    # Import tasks only when needed
+    from app.tasks import dispatch_stats_refresh
+    queued = []
+    for metric in metrics:
+        marker = {'started_at': datetime.now(timezone.utc).isoformat()}
+        if cache.add(metric_inflight_key(dwh_type, metric, window_days), marker, timeout=get_inflight_timeout(dwh_type)):
+            queued.append(metric)
+    if queued:
+        dispatch_stats_refresh(dwh_type, queued, release_lock=release_lock, window_days=window_days)
+        logger.info(f"Queued refresh of {dwh_type} stats metrics: {queued}")
+    return queued
+
+def get_stats_progress(cache, dwh_type, window_days=None):
+    """
+    Return per-metric results for the /stats/data endpoint, starting the
+    computation of missing metrics on first call. Metrics of a non-default
+    window are not refreshed by beat, so they are also recomputed once stale.
+
+    Returns:
+        dict: dwh_type, overall status ('running' or 'complete'), eta_seconds and
+        metrics mapping each metric to its status ('ready', 'pending' or
+        'failed'), value, freshness and an eta_seconds estimate while pending.
+    """
+    if not is_supported(dwh_type):
+        return {'dwh_type': dwh_type, 'status': 'complete', 'eta_seconds': None, 'metrics': {}, 'error': f'Unsupported data warehouse type: {dwh_type}'}
+
+    entries = get_cached_metrics(cache, dwh_type, window_days=window_days)
+    stats_data, stats_freshness = assemble_stats(dwh_type, entries)
+    refresh = [
+        metric for metric, entry in entries.items()
+        if entry is None or (resolve_window(dwh_type, metric, window_days) and stats_freshness[metric]['stale'])
+    ]
+    queue_metric_refresh(cache, dwh_type, refresh, window_days=window_days)
+
+    pending = [metric for metric, entry in entries.items() if entry is None]
+    markers = dict(zip(pending, cache.get_many(*[metric_inflight_key(dwh_type, metric, window_days) for metric in pending]))) if pending else {}
+    durations = dict(zip(pending, cache.get_many(*[metric_duration_key(dwh_type, metric, window_days) for metric in pending]))) if pending else {}
+    now = datetime.now(timezone.utc)
+
+    metrics = {}
+    for metric, entry in entries.items():
+        item = dict(stats_freshness[metric], value=stats_data[metric], eta_seconds=None)
+        if entry is None:
+            item['status'] = 'pending'
+            marker, duration = markers.get(metric), durations.get(metric)
+            if marker and duration is not None:
+                elapsed = (now - datetime.fromisoformat(marker['started_at'])).total_seconds()
+                item['eta_seconds'] = round(max(duration - elapsed, 0), 1)
+        elif entry.get('last_success') is None:
+            item['status'] = 'failed'
+        else:
+            item['status'] = 'ready'
+        metrics[metric] = item
+
+    etas = [item['eta_seconds'] for item in metrics.values() if item['eta_seconds'] is not None]
+    return {
+        'dwh_type': dwh_type,
+        'window_days': window_days or get_default_window(dwh_type),
+        'status': 'running' if pending else 'complete',
+        'eta_seconds': max(etas) if etas else None,
+        'metrics': metrics,
+        'last_refresh': cache.get(last_refresh_key(dwh_type, window_days))
+    }
+
+def get_console_query_costs(dwh_type, days=1):
+    """
+    What the console's own queries cost the warehouse over the last days, read
+    from its query history: queries, bytes_scanned, elapsed_ms and cache_hits
+    (None where the history does not record result cache reuse), plus any
+    warehouse specific figures such as BigQuery's bytes_billed and slot_ms.
+    """
+    return get_adapter(dwh_type).console_query_costs(days)
@@ -1,5 +1,6 @@
 import json
 from app.config import SourceConfig
+from app.json_utils import loads
 import requests
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -16,7 +17,7 @@ def get_dbt_project_model_count(name):
     try:
         response = requests.get(url, headers=headers)
         response.raise_for_status()
-        data = response.json()
+        data = loads(response.content)
         models_count = data["models_count"]
 
         return models_count
@@ -39,7 +40,7 @@ def get_dbt_project_seed_count(name):
     try:
         response = requests.get(url, headers=headers)
         response.raise_for_status()
-        data = response.json()
+        data = loads(response.content)
         seeds_count = data["seeds_count"]
 
         return seeds_count
@@ -62,7 +63,7 @@ def get_dbt_project_snapshot_count(name):
     try:
         response = requests.get(url, headers=headers)
         response.raise_for_status()
-        data = response.json()
+        data = loads(response.content)
         shapshots_count = data["snapshots_count"]
 
         return shapshots_count
@@ -85,7 +86,7 @@ def get_dbt_project_source_count(name):
     try:
         response = requests.get(url, headers=headers)
         response.raise_for_status()
-        data = response.json()
+        data = loads(response.content)
         sources_count = data["sources_count"]
 
         return sources_count
@@ -108,7 +109,7 @@ def get_dbt_project_task_count(name):
     try:
         response = requests.get(url, headers=headers)
         response.raise_for_status()
-        data = response.json()
+        data = loads(response.content)
         tasks = data["tasks"]
 
         return tasks
@@ -131,7 +132,7 @@ def get_dbt_project_test_count(name):
     try:
         response = requests.get(url, headers=headers)
         response.raise_for_status()
-        data = response.json()
+        data = loads(response.content)
         test_count = data["test_count"]
 
         return test_count
@@ -154,7 +155,7 @@ def get_dbt_project_variables(name):
     try:
         response = requests.get(url, headers=headers)
         response.raise_for_status()
-        data = response.json()
+        data = loads(response.content)
         key, value = next(iter(data['variables'].items()))
 
         return value
@@ -177,7 +178,7 @@ def get_dbt_project_status(name):
     try:
         response = requests.get(url, headers=headers)
         response.raise_for_status()
-        data = response.json()
+        data = loads(response.content)
 
         return data
     except requests.exceptions.RequestException as req_err:
@@ -200,7 +201,7 @@ def get_dbt_project_owner(name):
         response = requests.get(url, headers=headers)
         response.raise_for_status()
 
-        return response.json()
+        return loads(response.content)
     except requests.exceptions.RequestException as req_err:
         print(f"Request error: {req_err}")
     except ValueError as json_err:
@@ -221,7 +222,7 @@ def get_dbt_project_info(name):
         response = requests.get(url, headers=headers)
         response.raise_for_status()
 
-        return response.json()
+        return loads(response.content)
     except requests.exceptions.RequestException as req_err:
         print(f"Request error: {req_err}")
     except ValueError as json_err:
@@ -253,7 +254,7 @@ def get_dbt_projects():
     try:
         response = requests.get(url, headers=headers)
         response.raise_for_status()
-        projects = response.json()
+        projects = loads(response.content)
 
         # Use ThreadPoolExecutor for concurrent I/O tasks
         with ThreadPoolExecutor() as executor:
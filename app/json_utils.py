@@ -0,0 +1,129 @@
+"""
+orjson based JSON encoding for the console.
+
+OrjsonProvider replaces Flask's stdlib provider for jsonify / request.get_json,
+dumps() and loads() are shared by the stats modules and the API clients.
+Datetimes and Decimals are encoded by the serializer itself, so results no
+longer need a recursive convert_types / convert_decimals pass first.
+"""
+import dataclasses
+import decimal
+import uuid
+from datetime import date, datetime
+import orjson
+from flask.json.provider import JSONProvider
+from werkzeug.http import http_date
+
+
+def _stats_default(datetime_format):
+    def default(obj):
+        if isinstance(obj, decimal.Decimal):
+            return float(obj)
+        if isinstance(obj, datetime):
+            return obj.strftime(datetime_format)
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+    return default
+
+def _float_default(obj):
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def dumps(obj, datetime_format=None):
+    """
+    Serialize a stats payload to a JSON string.
+
+    Decimals become floats. Datetimes are written as ISO 8601 by orjson, or
+    with datetime_format (e.g. '%Y-%m-%d %H:%M:%S') when one is given.
+    """
+    if datetime_format:
+        return orjson.dumps(obj, default=_stats_default(datetime_format), option=orjson.OPT_PASSTHROUGH_DATETIME).decode()
+    return orjson.dumps(obj, default=_float_default).decode()
+
+def loads(data):
+    """Parse JSON from str or bytes (e.g. response.content), raises a ValueError subclass on bad input."""
+    return orjson.loads(data)
+
+
+def _flask_default(obj):
+    # Same conversions as Flask's DefaultJSONProvider
+    if isinstance(obj, date):
+        return http_date(obj)
+    if isinstance(obj, (decimal.Decimal, uuid.UUID)):
+        return str(obj)
+    if dataclasses.is_dataclass(obj):
+        return dataclasses.asdict(obj)
+    if hasattr(obj, "__html__"):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class OrjsonProvider(JSONProvider):
+    """
+    Flask JSON provider backed by orjson. Output matches the default provider
+    (sorted keys, dates as HTTP dates, Decimal and UUID as strings), it is only
+    produced faster.
+    """
+    sort_keys = True
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_NON_STR_KEYS
+        if kwargs.pop('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=kwargs.pop('default', _flask_default), option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(f"{self.dumps(obj)}\n", mimetype="application/json")
+
+
+def benchmark(rows=10000, repeat=5):
+    """
+    Compare the stdlib path (convert_types pre-walk + json.dumps) with dumps()
+    on a synthetic cost table and return the best time in seconds of each.
+    """
+    import json
+    import time
+    from datetime import timedelta, timezone
+    from app.datawarehouse_stats.bigquery_stats import DATETIME_FORMAT, convert_types
+
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    table = [{
+        'dataset': f'dataset_{i % 50}',
+        'table': f'table_{i}',
+        'total_cost_gb': decimal.Decimal(i) / 100,
+        'total_queries': i,
+        'avg_query_cost_gb': i / 13,
+        'first_query_date': start + timedelta(minutes=i),
+        'last_query_date': start + timedelta(minutes=2 * i),
+        'total_execution_time_min': i / 11,
+        'avg_execution_time_sec': i / 7,
+        'success_count': i,
+        'failure_count': i % 3
+    } for i in range(rows)]
+
+    paths = {
+        'stdlib': lambda: json.dumps(convert_types(table), default=float),
+        'orjson': lambda: dumps(table, datetime_format=DATETIME_FORMAT)
+    }
+    timings = {}
+    for name, function in paths.items():
+        best = None
+        for _ in range(repeat):
+            began = time.perf_counter()
+            function()
+            elapsed = time.perf_counter() - began
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = round(best, 4)
+    return timings
+
+
+# Benchmark: python -m app.json_utils [rows]
+if __name__ == "__main__":
+    import sys
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    for path, seconds in benchmark(rows).items():
+        print(f"{path}: {seconds}s for {rows} rows")
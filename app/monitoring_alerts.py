@@ -0,0 +1,45 @@
+import requests
+from datetime import datetime
+from app.config import SourceConfig
+from app.json_utils import loads
+
+
+def get_alert_summary():
+    """
+    Fetch Grafana alert rules and summarise them for the homepage cards.
+
+    Returns:
+        dict: Alert counters and dates, or None if Grafana did not answer with 200.
+
+    Raises:
+        requests.exceptions.RequestException: If Grafana could not be reached.
+        ValueError: If Grafana answered with a body that is not JSON.
+    """
+    env_variables = SourceConfig.get_environment_variables()
+    monitoring_link = env_variables.get('monitoring_link')
+    monitoring_basic_auth_user = env_variables.get('monitoring_basic_auth_user')
+    monitoring_basic_auth_pass = env_variables.get('monitoring_basic_auth_pass')
+    grafana_url = f"{monitoring_link}/api/prometheus/grafana/api/v1/alerts?includeInternalLabels=false"
+
+    response = requests.get(grafana_url, headers={'accept': 'application/json'}, auth=(monitoring_basic_auth_user, monitoring_basic_auth_pass))
+    if response.status_code != 200:
+        return None
+
+    alert_data = loads(response.content)
+    alerts = alert_data['data']['alerts']
+    # Treat both 'Normal' and 'Normal (NoData)' as normal
+    normal_alerts = [alert for alert in alerts if alert['state'] == 'Normal' or alert['state'] == 'Normal (NoData)']
+    non_normal_alerts = [alert for alert in alerts if alert['state'] != 'Normal' and alert['state'] != 'Normal (NoData)']
+    error_alerts = [alert for alert in non_normal_alerts if alert['state'] == 'Error']
+    error_dates = [datetime.fromisoformat(alert['activeAt'][:-1]) for alert in error_alerts]
+    non_normal_dates = [datetime.fromisoformat(alert['activeAt'][:-1]) for alert in non_normal_alerts]
+    normal_dates = [datetime.fromisoformat(alert['activeAt'][:-1]) for alert in normal_alerts]
+
+    return {
+        'alert_amount': len(alerts),
+        'non_normal_alerts': len(non_normal_alerts),
+        'alerts_count_errors': len(error_alerts),
+        'oldest_error_date': min(error_dates) if error_dates else None,
+        'latest_non_normal_date': max(non_normal_dates) if non_normal_dates else None,
+        'latest_normal_date': max(normal_dates) if normal_dates else None
+    }
@@ -1,143 +1,202 @@
-import redis
-import pickle
+import os
+import logging
+import socket
+import uuid
 from app.celery_app import celery
 from app.config import Config
-from celery.schedules import crontab
-from celery.signals import beat_init
-from concurrent.futures import ThreadPoolExecutor
+from celery import chord
+from celery.signals import beat_init, worker_ready
+from datetime import datetime, timezone
 from flask import Flask
 from flask_caching import Cache
 
-def get_bq_stats():
-    # Import bigquery_stats only when needed
-    import app.datawarehouse_stats.bigquery_stats as bq
-    with ThreadPoolExecutor() as executor:
-        futures = {
-            # cards
-            'dataset_count': executor.submit(bq.get_dataset_count),
-            'total_query_executed': executor.submit(bq.get_total_query_executed),
-            'table_count': executor.submit(bq.get_table_count),
-            'avg_execution_time_seconds': executor.submit(bq.get_avg_execution_time_seconds),
-            'failure_rate_percentage': executor.submit(bq.get_failure_rate_percentage),
-            # charts
-            'query_cost_by_months_chart': executor.submit(bq.get_query_cost_by_month),
-            'query_cost_by_days_chart': executor.submit(bq.get_query_cost_for_last_30_days),
-            # tables
-            'total_cost_gb_by_users': executor.submit(bq.get_total_cost_gb_by_users),
-            'total_cost_gb_by_table': executor.submit(bq.get_total_cost_gb_by_table)
-        }
-        results = {key: future.result() for key, future in futures.items()}
-    return results
-
-def get_sf_stats():
-    # Import snowflake_stats only when needed
-    import app.datawarehouse_stats.snowflake_stats as sf
-    with ThreadPoolExecutor() as executor:
-        futures = {
-            # cards
-            'dataset_count': executor.submit(sf.get_dataset_count),
-            'total_query_executed': executor.submit(sf.get_total_query_executed),
-            'table_count': executor.submit(sf.get_table_count),
-            'avg_execution_time_seconds': executor.submit(sf.get_avg_execution_time_seconds),
-            'failure_rate_percentage': executor.submit(sf.get_failure_rate_percentage),
-            # charts
-            'query_cost_by_months_chart': executor.submit(sf.get_query_cost_by_month),
-            'query_cost_by_days_chart': executor.submit(sf.get_query_cost_for_last_30_days),
-            # tables
-            'total_cost_gb_by_users': executor.submit(sf.get_total_cost_gb_by_users),
-            'total_cost_gb_by_table': executor.submit(sf.get_total_cost_gb_by_table)
-        }
-        results = {key: future.result() for key, future in futures.items()}
-    return results
-
-def get_rd_stats():
-    # Import redshift_stats only when needed
-    import app.datawarehouse_stats.redshift_stats as rd
-    with ThreadPoolExecutor() as executor:
-        futures = {
-            # cards
-            'dataset_count': executor.submit(rd.get_dataset_count),
-            'total_query_executed': executor.submit(rd.get_total_query_executed),
-            'table_count': executor.submit(rd.get_table_count),
-            'avg_execution_time_seconds': executor.submit(rd.get_avg_execution_time_seconds),
-            'failure_rate_percentage': executor.submit(rd.get_failure_rate_percentage),
-            # charts
-            'query_cost_by_months_chart': executor.submit(rd.get_query_cost_by_month),
-            'query_cost_by_days_chart': executor.submit(rd.get_query_cost_for_last_30_days),
-            # tables
-            'total_cost_gb_by_users': executor.submit(rd.get_total_cost_gb_by_users),
-            'total_cost_gb_by_table': executor.submit(rd.get_total_cost_gb_by_table)
-        }
-        results = {key: future.result() for key, future in futures.items()}
-    return results
-
-def get_ft_stats():
-    # Import fabric_stats only when needed
-    import app.datawarehouse_stats.fabric_stats as ft
-    with ThreadPoolExecutor() as executor:
-        futures = {
-            # cards
-            'dataset_count': executor.submit(ft.get_dataset_count),
-            'total_query_executed': executor.submit(ft.get_total_query_executed),
-            'table_count': executor.submit(ft.get_table_count),
-            'avg_execution_time_seconds': executor.submit(ft.get_avg_execution_time_seconds),
-            'failure_rate_percentage': executor.submit(ft.get_failure_rate_percentage),
-            # charts
-            'query_cost_by_months_chart': executor.submit(ft.get_query_cost_by_month),
-            'query_cost_by_days_chart': executor.submit(ft.get_query_cost_for_last_30_days),
-            # tables
-            'total_cost_gb_by_users': executor.submit(ft.get_total_cost_gb_by_users),
-            'total_cost_gb_by_table': executor.submit(ft.get_total_cost_gb_by_table)
-        }
-        results = {key: future.result() for key, future in futures.items()}
-    return results
+logger = logging.getLogger(__name__)
+
+def get_cache():
+    # Create a Flask app instance and configure it
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    cache = Cache(app, config={'CACHE_TYPE': 'RedisCache'})
+    return app, cache
+
+@celery.task(
+    bind=True,
+    soft_time_limit=Config.STATS_METRIC_TIME_LIMIT,
+    time_limit=Config.STATS_METRIC_TIME_LIMIT + 60,
+    max_retries=Config.STATS_METRIC_MAX_RETRIES
+)
+def refresh_stats_metric(self, dwh_type, metric, window_days=None, refresh_id=None):
+    # Import stats_metrics only when needed
+    from app.datawarehouse_stats.stats_metrics import is_budget_error, refresh_metric
+    # Never raise past the retries, a failed metric must not fail the chord
+    try:
+        app, cache = get_cache()
+        with app.app_context():
+            final_attempt = self.request.retries >= self.max_retries
+            entry = refresh_metric(cache, dwh_type, metric, final_attempt=final_attempt, window_days=window_days, refresh_id=refresh_id)
+    except Exception as e:
+        logger.error(f"Error in refresh_stats_metric for {dwh_type}.{metric}: {e}")
+        return {'metric': metric, 'last_success': None, 'error': str(e)}
+    if entry['error'] and not final_attempt and not is_budget_error(entry['error']):
+        raise self.retry(countdown=Config.STATS_METRIC_RETRY_DELAY * 2 ** self.request.retries)
+    return {
+        'metric': metric,
+        'last_success': entry['last_success'],
+        'error': entry['error'],
+        'duration_seconds': entry['duration_seconds']
+    }
+
+def cache_dwh_stats_lock_key(dwh_type):
+    return f'cache_dwh_stats_running_{dwh_type}'
+
+@celery.task(bind=True, max_retries=Config.STATS_METRIC_MAX_RETRIES)
+def refresh_stats_batch(self, dwh_type, metrics, window_days=None, refresh_id=None):
+    # Import stats_metrics only when needed
+    from app.datawarehouse_stats.stats_metrics import is_budget_error, refresh_metrics_batch
+    try:
+        app, cache = get_cache()
+        with app.app_context():
+            final_attempt = self.request.retries >= self.max_retries
+            entries = refresh_metrics_batch(cache, dwh_type, metrics, final_attempt=final_attempt, window_days=window_days, refresh_id=refresh_id)
+    except Exception as e:
+        logger.error(f"Error in refresh_stats_batch for {dwh_type}: {e}")
+        return [{'metric': metric, 'last_success': None, 'error': str(e)} for metric in metrics]
+    if not final_attempt and all(entry['error'] and not is_budget_error(entry['error']) for entry in entries.values()):
+        raise self.retry(countdown=Config.STATS_METRIC_RETRY_DELAY * 2 ** self.request.retries)
+    return [{
+        'metric': metric,
+        'last_success': entry['last_success'],
+        'error': entry['error'],
+        'duration_seconds': entry['duration_seconds']
+    } for metric, entry in entries.items()]
+
+@celery.task
+def finalize_dwh_stats(results, dwh_type, release_lock=False, window_days=None):
+    # Import stats_metrics only when needed
+    from app.datawarehouse_stats.stats_metrics import assemble_stats, get_cached_metrics, last_refresh_key
+    try:
+        app, cache = get_cache()
+        with app.app_context():
+            failed = [result['metric'] for result in results if result and result['error']]
+            summary = {
+                'completed_at': datetime.now(timezone.utc).isoformat(),
+                'metrics': [result['metric'] for result in results if result],
+                'failed': failed,
+                'duration_seconds': max((result.get('duration_seconds') or 0 for result in results if result), default=0)
+            }
+            cache.set(last_refresh_key(dwh_type, window_days), summary, timeout=0)
+            if release_lock:
+                cache.delete(cache_dwh_stats_lock_key(dwh_type))
+            logger.info(f"Stats refresh for {dwh_type} finished, {len(summary['metrics']) - len(failed)}/{len(summary['metrics'])} metrics succeeded. Failed: {failed}")
+            stats_data, stats_freshness = assemble_stats(dwh_type, get_cached_metrics(cache, dwh_type, window_days=window_days))
+            return {'dwh_type': dwh_type, 'stats': stats_data, 'freshness': stats_freshness, 'summary': summary}
+    except Exception as e:
+        logger.error(f"Error in finalize_dwh_stats for {dwh_type}: {e}")
+        return None
+
+def metric_task_signature(dwh_type, metric, window_days=None, refresh_id=None):
+    # Import stats_metrics only when needed
+    from app.datawarehouse_stats.stats_metrics import get_time_limit
+    time_limit = get_time_limit(dwh_type)
+    return refresh_stats_metric.s(dwh_type, metric, window_days, refresh_id).set(soft_time_limit=time_limit, time_limit=time_limit + 60)
+
+def batch_task_signature(dwh_type, metrics, window_days=None, refresh_id=None):
+    # Import stats_metrics only when needed
+    from app.datawarehouse_stats.stats_metrics import get_time_limit
+    time_limit = get_time_limit(dwh_type)
+    return refresh_stats_batch.s(dwh_type, list(metrics), window_days, refresh_id).set(soft_time_limit=time_limit, time_limit=time_limit + 60)
+
+def dispatch_stats_refresh(dwh_type, metrics, release_lock=False, window_days=None):
+    # Import stats_metrics only when needed
+    from app.datawarehouse_stats.stats_metrics import uses_batch_collection
+    # The tasks of one refresh share its byte budget under this id
+    refresh_id = uuid.uuid4().hex
+    if uses_batch_collection(dwh_type):
+        # One batched collector computes every metric, no point in fanning out
+        return (batch_task_signature(dwh_type, metrics, window_days, refresh_id) | finalize_dwh_stats.s(dwh_type, release_lock, window_days)).delay()
+    # Fan the metrics out over the workers, partial results are cached as each task finishes.
+    # One chord per warehouse, so a slow warehouse never holds back another one's finalizer.
+    return chord(metric_task_signature(dwh_type, metric, window_days, refresh_id) for metric in metrics)(finalize_dwh_stats.s(dwh_type, release_lock, window_days))
 
 @celery.task
 def cache_dwh_stats():
+    # Import stats_metrics only when needed
+    from app.datawarehouse_stats.stats_metrics import STATS_METRICS, get_inflight_timeout, queue_metric_refresh
     try:
-        # Create a Flask app instance and configure it
-        app = Flask(__name__)
-        app.config.from_object(Config)
-        cache = Cache(app, config={'CACHE_TYPE': 'RedisCache'})
+        app, cache = get_cache()
+        results = {}
 
         with app.app_context():
-            # Get stats only for the configured data warehouse type
-            dwh_type = app.config['FASTBI_PLATFORM_DWH']
-            stats = None
-            
-            if dwh_type == 'bigquery':
-                stats = get_bq_stats()
-            elif dwh_type == 'snowflake':
-                stats = get_sf_stats()
-            elif dwh_type == 'redshift':
-                stats = get_rd_stats()
-            elif dwh_type == 'fabric':
-                stats = get_ft_stats()
-            else:
-                print(f"Unsupported data warehouse type: {dwh_type}")
-                return None
-
-            if stats:
-                # Cache the stats with a consistent key
-                cache_key = 'global_stats'
-                cache.set(cache_key, stats, timeout=7200)
-                print(f"cache_dwh_stats executed and set {cache_key} in Redis for {dwh_type}.")
-                return stats
-            return None
+            for dwh_type in app.config['FASTBI_PLATFORM_DWH_LIST']:
+                # Drop duplicate runs (other replicas, beat restarts) while one is in progress
+                lock_key = cache_dwh_stats_lock_key(dwh_type)
+                lock = {'node': f"{socket.gethostname()}:{os.getpid()}", 'started_at': datetime.now(timezone.utc).isoformat()}
+                if not cache.add(lock_key, lock, timeout=get_inflight_timeout(dwh_type)):
+                    logger.warning(f"cache_dwh_stats already running for {dwh_type}: {cache.get(lock_key)}, skipping.")
+                    results[dwh_type] = None
+                    continue
+
+                queued = queue_metric_refresh(cache, dwh_type, list(STATS_METRICS), release_lock=True)
+                if not queued:
+                    cache.delete(lock_key)
+                logger.info(f"cache_dwh_stats queued {len(queued)}/{len(STATS_METRICS)} metrics for {dwh_type}.")
+                results[dwh_type] = queued
+        return results
     except Exception as e:
-        print(f"Error in cache_dwh_stats: {e}")
+        logger.error(f"Error in cache_dwh_stats: {e}")
+        return None
+
+@celery.task
+def warm_caches(force=False):
+    # Import cache_warmup only when needed
+    from app.cache_warmup import run_cache_warmup
+    try:
+        app, cache = get_cache()
+        with app.app_context():
+            return run_cache_warmup(cache, force=force)
+    except Exception as e:
+        logger.error(f"Error in warm_caches: {e}")
         return None
 
 @celery.on_after_finalize.connect
 def setup_periodic_tasks(sender, **kwargs):
-    # Schedule cache_dwh_stats to run every 24 hours
-    sender.add_periodic_task(
-        crontab(hour=0, minute=0),  # Every day at midnight
-        cache_dwh_stats.s(),
-        name='cache_dwh_stats_every_24_hours'
-    )
+    # Each stats metric runs on its own interval (see stats_metrics.STATS_METRICS)
+    from app.datawarehouse_stats.stats_metrics import STATS_METRICS, get_metric_schedule, uses_batch_collection
+    for dwh_type in Config.FASTBI_PLATFORM_DWH_LIST:
+        intervals = {metric: get_metric_schedule(dwh_type, metric)['interval'] for metric in STATS_METRICS}
+        batch_interval = 0
+        if uses_batch_collection(dwh_type):
+            # The batch recomputes every metric, run it at the slowest interval (the table tier)
+            # and refresh the faster metrics in between with their own tasks
+            batch_interval = max(intervals.values())
+            sender.add_periodic_task(
+                batch_interval,
+                batch_task_signature(dwh_type, STATS_METRICS),
+                name=f'refresh_stats_{dwh_type}_batch'
+            )
+        for metric, interval in intervals.items():
+            if batch_interval and interval >= batch_interval:
+                continue
+            sender.add_periodic_task(
+                interval,
+                metric_task_signature(dwh_type, metric),
+                name=f'refresh_stats_{dwh_type}_{metric}'
+            )
 
 @beat_init.connect
 def at_beat_start(sender, **kwargs):
-    print("Celery Beat started, triggering cache_dwh_stats")
+    if Config.BEAT_LEADER_ELECTION:
+        # Import beat_leader only when needed
+        from app.beat_leader import get_beat_lease
+        lease = get_beat_lease()
+        if not lease.acquire_or_renew():
+            logger.warning(f"Celery Beat started on {lease.node_id} as follower, not triggering cache_dwh_stats")
+            return
+    logger.warning("Celery Beat started, triggering cache_dwh_stats")
     cache_dwh_stats.delay()
+
+@worker_ready.connect
+def at_worker_start(sender, **kwargs):
+    if Config.CACHE_WARMUP_ON_WORKER_START:
+        logger.warning("Celery worker ready, triggering warm_caches")
+        warm_caches.delay()
@@ -0,0 +1,102 @@
+"""
+Shared fixtures. app.config reads its required settings at import time, so
+placeholder values are set here before any app module is imported. Redis is
+replaced by fakeredis; warehouses and Postgres are mocked in the tests.
+"""
+import os
+
+for _name, _value in {
+    'FN_FLASK_SECRET_KEY': 'test-secret',
+    'MAIL_SERVER': 'localhost',
+    'MAIL_PORT': '25',
+    'MAIL_USE_TLS': 'false',
+    'MAIL_USE_SSL': 'false',
+    'MAIL_USERNAME': 'test',
+    'MAIL_PASSWORD': 'test',
+    'MAIL_DEFAULT_SENDER': 'test@localhost',
+    'DB_HOST': 'localhost',
+    'DB_PORT': '5432',
+    'DB_USER': 'test',
+    'DB_PASSWORD': 'test',
+    'DB_NAME': 'test',
+    'REDIS_HOST': 'localhost',
+    'REDIS_DB': '0',
+    'DC_DQ_BEARER_TOKEN': 'test',
+}.items():
+    os.environ.setdefault(_name, _value)
+
+import fakeredis
+import pytest
+from flask_caching.backends.rediscache import RedisCache
+from app.config import Config
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    """A fakeredis client standing in for Config.SESSION_REDIS."""
+    client = fakeredis.FakeStrictRedis()
+    monkeypatch.setattr(Config, 'SESSION_REDIS', client)
+    return client
+
+
+@pytest.fixture
+def cache(redis_client):
+    """The Flask-Caching Redis backend the tasks use, on top of fakeredis."""
+    return RedisCache(host=redis_client, default_timeout=0, key_prefix='flask_cache_')
+
+
+class FakeCursor:
+    """Records every statement; fetchone/fetchall answer from the connection's queued results."""
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        self.connection.executed.append((' '.join(query.split()), params))
+
+    def fetchone(self):
+        return self.connection.results.pop(0) if self.connection.results else None
+
+    def fetchall(self):
+        return self.connection.results.pop(0) if self.connection.results else []
+
+
+class FakeConnection:
+    """A psycopg2 connection stand-in shared by every get_connection() call of a test."""
+    def __init__(self):
+        self.executed = []
+        self.results = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.closed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def cursor(self, cursor_factory=None):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed += 1
+
+    def statements(self, fragment):
+        return [(query, params) for query, params in self.executed if fragment in query]
+
+
+@pytest.fixture
+def pg():
+    return FakeConnection()
@@ -0,0 +1,119 @@
+import decimal
+from contextlib import contextmanager
+import pytest
+from app.config import Config
+from app.datawarehouse_stats import adapters
+from app.datawarehouse_stats.adapters import WarehouseAdapter, get_adapter, is_supported
+from app.datawarehouse_stats.query_metrics import get_query_timings
+
+
+@pytest.mark.parametrize('dwh_type, setting', [
+    ('snowflake', 'SNOWFLAKE_STATS_BATCHED'),
+    ('redshift', 'REDSHIFT_STATS_BATCHED'),
+    ('fabric', 'FABRIC_STATS_BATCHED'),
+])
+def test_batched_collection_follows_its_setting(dwh_type, setting, monkeypatch):
+    monkeypatch.setattr(Config, 'STATS_ROLLUP_ENABLED', False)
+    monkeypatch.setattr(Config, 'REDSHIFT_STATS_SUMMARY', False)
+    monkeypatch.setattr(Config, setting, False)
+    assert not get_adapter(dwh_type).uses_batch_collection()
+    monkeypatch.setattr(Config, setting, True)
+    assert get_adapter(dwh_type).uses_batch_collection()
+
+
+def test_snowflake_is_collected_in_batches_by_default(monkeypatch):
+    monkeypatch.setattr(Config, 'STATS_ROLLUP_ENABLED', False)
+    assert Config.SNOWFLAKE_STATS_BATCHED is True
+    assert get_adapter('snowflake').uses_batch_collection()
+
+
+def test_rollups_take_precedence_over_batching(monkeypatch):
+    monkeypatch.setattr(Config, 'SNOWFLAKE_STATS_BATCHED', True)
+    monkeypatch.setattr(Config, 'STATS_ROLLUP_ENABLED', True)
+    assert not get_adapter('snowflake').uses_batch_collection()
+
+
+def test_extra_adapters_are_registered_and_broken_ones_skipped(monkeypatch):
+    monkeypatch.setattr(adapters, 'WAREHOUSE_ADAPTERS', dict(adapters.WAREHOUSE_ADAPTERS))
+    adapters.load_extra_adapters([f'{__name__}:ExampleAdapter', 'missing.module:Adapter', 'no-colon'])
+    assert isinstance(get_adapter('example'), ExampleAdapter)
+    assert adapters.get_warehouse_labels()['example'] == 'Example'
+    assert not is_supported('missing')
+    with pytest.raises(KeyError):
+        get_adapter('missing')
+
+
+def test_normalize_gives_one_shape_for_every_warehouse():
+    adapter = get_adapter('snowflake')
+    assert adapter.normalize(decimal.Decimal('12'), 'cards') == 12
+    assert adapter.normalize(decimal.Decimal('1.5'), 'cards') == 1.5
+    assert adapter.normalize([{'cost': decimal.Decimal('2.5')}], 'tables') == '[{"cost":2.5}]'
+    assert adapter.normalize('[]', 'charts') == '[]'
+    assert adapter.normalize(None, 'cards') is None
+
+
+
+class ExampleModule:
+    """Stats module hooks recording the connections opened and the statements run on them."""
+    def __init__(self, native=False):
+        self.timeouts = []
+        self.executed = []
+        if native:
+            self.execute_batch = lambda conn, queries: {name: [{'batched': query}] for name, query in queries.items()}
+
+    @contextmanager
+    def connection(self, statement_timeout=None):
+        self.timeouts.append(statement_timeout)
+        yield 'conn'
+
+    def execute(self, conn, query, label=None):
+        if query == 'FAIL':
+            raise RuntimeError('statement timeout')
+        self.executed.append((conn, query, label))
+        return [{'n': 1}]
+
+
+def example_adapter(module):
+    adapter = ExampleAdapter()
+    adapter._module = module
+    return adapter
+
+
+def test_queries_run_with_the_statement_timeout_and_are_timed(redis_client, monkeypatch):
+    monkeypatch.setattr(Config, 'STATS_STATEMENT_TIMEOUT_SECONDS', 600)
+    module = ExampleModule()
+    adapter = example_adapter(module)
+
+    assert adapter.run_query('SELECT 1', label='table_count') == [{'n': 1}]
+    assert adapter.run_query('FAIL', label='dataset_count') == []
+    with pytest.raises(RuntimeError):
+        adapter.run_query('FAIL', label='dataset_count', raise_errors=True)
+
+    assert module.timeouts == [600, 600, 600]
+    assert module.executed == [('conn', 'SELECT 1', 'table_count')]
+    timings = get_query_timings('example')['example']
+    assert timings['table_count']['queries'] == 1
+    assert timings['dataset_count']['failures'] == 2
+
+
+def test_batches_run_on_one_connection(redis_client):
+    module = ExampleModule()
+    adapter = example_adapter(module)
+
+    assert adapter.run_batch({'a': 'SELECT a', 'b': 'SELECT b'}) == {'a': [{'n': 1}], 'b': [{'n': 1}]}
+    assert adapter.run_batch({'a': 'SELECT a', 'b': 'FAIL'}) == {}
+    assert len(module.timeouts) == 2
+    assert set(get_query_timings('example')['example']) == {'a', 'b'}
+
+
+def test_native_batches_are_sent_at_once_and_timed_as_one(redis_client):
+    adapter = example_adapter(ExampleModule(native=True))
+
+    assert adapter.run_batch({'a': 'SELECT a', 'b': 'SELECT b'}) == {'a': [{'batched': 'SELECT a'}], 'b': [{'batched': 'SELECT b'}]}
+    assert set(get_query_timings('example')['example']) == {'batch'}
+
+
+class ExampleAdapter(WarehouseAdapter):
+    dwh_type = 'example'
+    label = 'Example'
+    module_path = 'app.datawarehouse_stats.example_stats'
@@ -0,0 +1,42 @@
+from app.beat_leader import LEASE_KEY, BeatLease, get_beat_leader
+
+
+def lease(redis_client, node):
+    beat_lease = BeatLease(redis_client, lease_seconds=60)
+    beat_lease.node_id = node
+    return beat_lease
+
+
+def test_only_one_node_holds_the_lease(redis_client):
+    first, second = lease(redis_client, 'a:1'), lease(redis_client, 'b:1')
+    assert first.acquire_or_renew() is True
+    assert second.acquire_or_renew() is False
+    assert first.acquire_or_renew() is True
+    assert get_beat_leader(redis_client)['node'] == 'a:1'
+
+
+def test_renewal_extends_the_lease(redis_client):
+    first = lease(redis_client, 'a:1')
+    first.acquire_or_renew()
+    redis_client.expire(LEASE_KEY, 5)
+    first.acquire_or_renew()
+    assert redis_client.ttl(LEASE_KEY) > 5
+
+
+def test_follower_takes_over_an_expired_lease(redis_client):
+    first, second = lease(redis_client, 'a:1'), lease(redis_client, 'b:1')
+    first.acquire_or_renew()
+    redis_client.delete(LEASE_KEY)  # expired
+    assert second.acquire_or_renew() is True
+    assert first.acquire_or_renew() is False
+    assert get_beat_leader(redis_client)['node'] == 'b:1'
+
+
+def test_release_only_drops_a_lease_the_node_holds(redis_client):
+    first, second = lease(redis_client, 'a:1'), lease(redis_client, 'b:1')
+    first.acquire_or_renew()
+    second.release()
+    assert redis_client.get(LEASE_KEY) == b'a:1'
+    first.release()
+    assert redis_client.get(LEASE_KEY) is None
+    assert get_beat_leader(redis_client) is None
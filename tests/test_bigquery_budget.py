@@ -0,0 +1,143 @@
+from types import SimpleNamespace
+import pytest
+from google.api_core.exceptions import BadRequest
+from flask import Flask
+from app import tasks
+from app.celery_app import celery
+from app.config import Config
+from app.datawarehouse_stats import bigquery_stats
+from app.datawarehouse_stats.bigquery_stats import BytesBudgetExceeded, refresh_budget, track_bytes_billed
+from app.datawarehouse_stats.stats_metrics import BUDGET_EXCEEDED, refresh_metric
+
+GIB = 1024 ** 3
+
+
+class FakeBigQuery:
+    """Dry runs estimate `estimate` bytes, real runs bill `billed` bytes and return one row."""
+    def __init__(self, estimate, billed=None):
+        self.estimate = estimate
+        self.billed = estimate if billed is None else billed
+        self.dry_runs = 0
+        self.runs = 0
+        # Raised by the next real runs, after their dry run
+        self.failures = []
+
+    def query(self, query, job_config=None):
+        if job_config.dry_run:
+            self.dry_runs += 1
+            return SimpleNamespace(total_bytes_processed=self.estimate)
+        self.runs += 1
+        if self.failures:
+            raise self.failures.pop(0)
+        return SimpleNamespace(
+            job_id=f'job_{self.runs}', total_bytes_billed=self.billed, slot_millis=1, cache_hit=False,
+            result=lambda: [{'table_count': 3, 'dataset_count': 1}])
+
+
+@pytest.fixture
+def bigquery(redis_client, monkeypatch):
+    monkeypatch.setattr(Config, 'STATS_ARROW_FETCH', False)
+    monkeypatch.setattr(Config, 'BIGQUERY_STATS_DRY_RUN', True)
+    monkeypatch.setattr(Config, 'BIGQUERY_STATS_MAX_BYTES_PER_QUERY', 0)
+    monkeypatch.setattr(Config, 'BIGQUERY_STATS_MAX_BYTES_PER_REFRESH', 50 * GIB)
+    monkeypatch.setattr(Config, 'STATS_ROLLUP_ENABLED', False)
+    monkeypatch.setattr(Config, 'STATS_METRIC_SCHEDULES', {})
+    client = FakeBigQuery(estimate=GIB)
+    monkeypatch.setattr(bigquery_stats, 'get_bigquery_client', lambda: (client, 'p.region-eu'))
+    return client
+
+
+def test_nested_blocks_count_towards_the_enclosing_budget(bigquery):
+    with track_bytes_billed(max_bytes=3 * GIB) as outer:
+        with track_bytes_billed() as inner:
+            bigquery_stats.run_bigquery_query('SELECT 1', raise_errors=True)
+            bigquery_stats.run_bigquery_query('SELECT 2', raise_errors=True)
+        assert inner['bytes_billed'] == outer['bytes_billed'] == 2 * GIB
+        with track_bytes_billed():
+            bigquery.estimate = 2 * GIB
+            with pytest.raises(BytesBudgetExceeded):
+                bigquery_stats.run_bigquery_query('SELECT 3', raise_errors=True)
+    assert outer['exceeded']
+
+
+def test_consolidated_collector_stays_inside_the_refresh_budget(bigquery, monkeypatch):
+    monkeypatch.setattr(Config, 'BIGQUERY_STATS_MAX_BYTES_PER_REFRESH', 2 * GIB)
+    with refresh_budget() as totals:
+        assert bigquery_stats.get_all_stats() is None
+    assert bigquery.runs == 2 and totals['bytes_billed'] == 2 * GIB
+    assert totals['exceeded']
+
+
+def test_over_budget_estimate_is_refused_without_running_the_query(bigquery, cache):
+    bigquery.estimate = 60 * GIB
+    entry = refresh_metric(cache, 'bigquery', 'table_count', final_attempt=False)
+    assert entry['error'].startswith(BUDGET_EXCEEDED)
+    assert bigquery.runs == 0
+
+
+def test_budget_refusal_is_not_retried(bigquery, cache, monkeypatch):
+    monkeypatch.setattr(celery.conf, 'task_always_eager', True)
+    monkeypatch.setattr(tasks, 'get_cache', lambda: (Flask(__name__), cache))
+    bigquery.estimate = 60 * GIB
+
+    result = tasks.refresh_stats_metric.apply(args=('bigquery', 'table_count')).get()
+    assert result['error'].startswith(BUDGET_EXCEEDED)
+    assert bigquery.dry_runs == 1 and bigquery.runs == 0
+
+
+def test_metric_tasks_of_one_refresh_share_the_budget(bigquery, cache):
+    bigquery.estimate = bigquery.billed = 30 * GIB
+    first = refresh_metric(cache, 'bigquery', 'table_count', refresh_id='r1')
+    second = refresh_metric(cache, 'bigquery', 'dataset_count', refresh_id='r1')
+    assert first['error'] is None
+    assert second['error'].startswith(BUDGET_EXCEEDED)
+    # Another refresh starts from a fresh budget
+    assert refresh_metric(cache, 'bigquery', 'dataset_count', refresh_id='r2')['error'] is None
+
+
+def test_shared_total_settles_to_the_bytes_actually_billed(bigquery, redis_client):
+    bigquery.estimate, bigquery.billed = 10 * GIB, 4 * GIB
+    with refresh_budget('r1'):
+        bigquery_stats.run_bigquery_query('SELECT 1', raise_errors=True)
+    assert int(redis_client.get('stats_refresh_bytes_bigquery_r1')) == 4 * GIB
+
+
+def test_failed_jobs_give_their_reservation_back(bigquery, cache, redis_client):
+    bigquery.estimate = bigquery.billed = 30 * GIB
+    bigquery.failures = [
+        BadRequest('Query exceeded limit for bytes billed', errors=[{'reason': 'bytesBilledLimitExceeded'}]),
+        ConnectionResetError('connection reset'),
+    ]
+    with refresh_budget('r1') as totals:
+        with pytest.raises(BadRequest):
+            bigquery_stats.run_bigquery_query('SELECT 1', raise_errors=True)
+        assert bigquery_stats.run_bigquery_query('SELECT 2') == []
+    assert int(redis_client.get('stats_refresh_bytes_bigquery_r1')) == 0
+    assert totals['exceeded'].startswith('query went over BIGQUERY_STATS_MAX_BYTES_PER_QUERY')
+
+    # Later metrics of the same refresh still fit into the budget
+    assert refresh_metric(cache, 'bigquery', 'table_count', refresh_id='r1')['error'] is None
+    assert int(redis_client.get('stats_refresh_bytes_bigquery_r1')) == 30 * GIB
+
+
+def test_job_config_caps_bytes_billed_only_when_configured(monkeypatch):
+    monkeypatch.setattr(Config, 'BIGQUERY_STATS_MAX_BYTES_PER_QUERY', 0)
+    unlimited = bigquery_stats.query_job_config(label='table_count')
+    assert 'maximumBytesBilled' not in unlimited.to_api_repr()['query']
+    assert unlimited.use_query_cache
+    assert unlimited.labels == {'stats_query': 'table_count'}
+
+    monkeypatch.setattr(Config, 'BIGQUERY_STATS_MAX_BYTES_PER_QUERY', 10 * GIB)
+    assert bigquery_stats.query_job_config().maximum_bytes_billed == 10 * GIB
+
+
+def test_jobs_time_out_after_the_statement_timeout(bigquery, monkeypatch):
+    monkeypatch.setattr(Config, 'STATS_STATEMENT_TIMEOUT_SECONDS', 600)
+    configs = []
+    query = bigquery.query
+    monkeypatch.setattr(bigquery, 'query', lambda sql, job_config=None: configs.append(job_config) or query(sql, job_config))
+
+    bigquery_stats.run_bigquery_query('SELECT 1', raise_errors=True)
+
+    assert int(configs[-1].job_timeout_ms) == 600000
+    assert 'jobTimeoutMs' not in bigquery_stats.query_job_config().to_api_repr()
@@ -0,0 +1,341 @@
+from datetime import datetime, timedelta, timezone
+import pyarrow as pa
+import pytest
+from google.api_core.exceptions import PermissionDenied
+from app.config import Config
+from app.datawarehouse_stats import bigquery_stats
+from app.datawarehouse_stats.adapters import get_adapter
+from app.datawarehouse_stats.bigquery_stats import BigQueryClientFactory
+from app.json_utils import loads
+
+
+class FakeCredentials:
+    def __init__(self, expires_in):
+        self.token = 'token'
+        self.expiry = datetime.utcnow() + timedelta(seconds=expires_in)
+        self.refreshes = 0
+
+    def refresh(self, request):
+        self.refreshes += 1
+        self.expiry = datetime.utcnow() + timedelta(hours=1)
+
+
+class FakeClient:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeProvider:
+    def __init__(self):
+        self.subscribers = []
+        self.changed = False
+
+    def subscribe(self, callback):
+        if callback not in self.subscribers:
+            self.subscribers.append(callback)
+
+    def check(self):
+        if self.changed:
+            self.changed = False
+            for callback in self.subscribers:
+                callback(self)
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    provider = FakeProvider()
+    monkeypatch.setattr(bigquery_stats, 'get_bigquery_secrets', lambda: provider)
+    return provider
+
+
+@pytest.fixture
+def factory(provider, monkeypatch):
+    factory = BigQueryClientFactory()
+    factory.builds = 0
+
+    def build():
+        factory.builds += 1
+        factory._client = FakeClient()
+        factory._credentials = FakeCredentials(expires_in=3600)
+        factory._location = 'project.region-eu'
+    monkeypatch.setattr(factory, '_build', build)
+    return factory
+
+
+def test_client_is_built_once_and_shared(factory):
+    first, location = factory.get()
+    second, _ = factory.get()
+    assert first is second and factory.builds == 1
+    assert location == 'project.region-eu'
+
+
+def test_client_is_rebuilt_after_a_secret_change(factory, provider):
+    first, _ = factory.get()
+    provider.changed = True
+    second, _ = factory.get()
+    assert second is not first and first.closed
+    assert factory.builds == 2
+
+
+def test_token_is_refreshed_ahead_of_expiry(factory, monkeypatch):
+    monkeypatch.setattr(Config, 'BIGQUERY_TOKEN_REFRESH_MARGIN', 300)
+    factory.get()
+    factory._credentials = credentials = FakeCredentials(expires_in=60)
+    factory.get()
+    assert credentials.refreshes == 1
+    factory.get()
+    assert credentials.refreshes == 1
+
+
+def group(by=None, **values):
+    row = {'by_month': False, 'by_day': False, 'by_user': False, 'by_table': False,
+           'month': None, 'day': None, 'user_email': None, 'dataset': None, 'table_name': None,
+           'query_count': 0, 'failure_count': 0, 'success_count': 0, 'bytes_billed': 0,
+           'avg_bytes_billed': 0, 'execution_seconds': 0, 'avg_execution_seconds': 0,
+           'first_query_date': None, 'last_query_date': None}
+    if by:
+        row[by] = True
+    row.update(values)
+    return row
+
+
+@pytest.fixture
+def consolidated_rows(monkeypatch):
+    jobs = [
+        group(query_count=10, failure_count=1, avg_execution_seconds=2.0),
+        group('by_month', month='2024-02', query_count=4, bytes_billed=2 * 1024 ** 3),
+        group('by_month', month='2024-01', query_count=6, bytes_billed=1024 ** 3),
+        group('by_day', day='2024-02-01', query_count=4),
+        group('by_user', user_email='a@x', query_count=3, bytes_billed=10),
+        group('by_user', user_email='b@x', query_count=7, bytes_billed=20),
+        group('by_table', dataset='d', table_name='t', query_count=5, bytes_billed=5),
+        group('by_table', dataset='d', table_name='view', query_count=5, bytes_billed=50),
+    ]
+    answers = {
+        'all_stats': jobs,
+        'all_stats_datasets': [{'dataset_count': 2}],
+        'all_stats_tables': [
+            {'table_schema': 'd', 'table_name': 't', 'table_type': 'BASE TABLE'},
+            {'table_schema': 'd', 'table_name': 'view', 'table_type': 'VIEW'},
+        ],
+    }
+    labels = []
+
+    def run(query, raise_errors=False, window_days=None, datetime_format=None, label=None):
+        labels.append(label)
+        return answers[label]
+    monkeypatch.setattr(bigquery_stats, 'run_bigquery_query', run)
+    return labels
+
+
+def test_consolidated_mode_builds_every_metric_from_one_jobs_scan(consolidated_rows):
+    stats = bigquery_stats.get_all_stats()
+    assert consolidated_rows.count('all_stats') == 1
+    assert stats['total_query_executed'] == 10
+    assert stats['failure_rate_percentage'] == 10.0
+    assert stats['dataset_count'] == 2 and stats['table_count'] == 2
+    months = loads(stats['query_cost_by_months_chart'])
+    assert [m['month'] for m in months] == ['2024-01', '2024-02']
+    users = loads(stats['total_cost_gb_by_users'])
+    assert [u['user_email'] for u in users] == ['b@x', 'a@x']
+    # Only base tables are listed
+    assert [t['table'] for t in loads(stats['total_cost_gb_by_table'])] == ['t']
+
+
+def test_consolidated_mode_is_a_batched_collector(monkeypatch):
+    adapter = get_adapter('bigquery')
+    monkeypatch.setattr(Config, 'STATS_ROLLUP_ENABLED', False)
+    monkeypatch.setattr(Config, 'BIGQUERY_STATS_MODE', 'consolidated')
+    assert adapter.uses_batch_collection()
+    monkeypatch.setattr(Config, 'BIGQUERY_STATS_MODE', 'per_metric')
+    assert not adapter.uses_batch_collection()
+
+
+def test_window_filter_is_a_plain_creation_time_range(monkeypatch):
+    monkeypatch.setattr(Config, 'BIGQUERY_STATS_DETERMINISTIC', False)
+    monkeypatch.setattr(Config, 'BIGQUERY_STATS_WINDOW_DAYS', 180)
+    assert bigquery_stats.window_filter() == 'creation_time >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 180 DAY)'
+    assert 'INTERVAL 7 DAY' in bigquery_stats.window_filter(7)
+
+
+def test_bind_query_fills_in_the_placeholders(monkeypatch):
+    monkeypatch.setattr(Config, 'BIGQUERY_STATS_DETERMINISTIC', False)
+    query, parameters = bigquery_stats.bind_query('SELECT 1 FROM `{location}.JOBS` WHERE {window} AND day < {today}', 'p.region-eu', 30)
+    assert query == ('SELECT 1 FROM `p.region-eu.JOBS` WHERE '
+                     'creation_time >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 30 DAY) AND day < CURRENT_DATE()')
+    assert parameters == []
+
+
+
+def test_window_bounds_truncate_to_the_granularity(monkeypatch):
+    monkeypatch.setattr(Config, 'BIGQUERY_STATS_TIME_GRANULARITY', 3600)
+    monkeypatch.setattr(Config, 'BIGQUERY_STATS_WINDOW_DAYS', 180)
+    monkeypatch.setattr(bigquery_stats.time, 'time', lambda: 1_700_003_599.9)
+
+    start, end = bigquery_stats.get_window_bounds()
+
+    assert end == datetime(2023, 11, 14, 23, 0, tzinfo=timezone.utc)
+    assert end - start == timedelta(days=180)
+    assert bigquery_stats.get_window_bounds(7)[0] == end - timedelta(days=7)
+
+
+def test_deterministic_bind_query_binds_the_window(monkeypatch):
+    monkeypatch.setattr(Config, 'BIGQUERY_STATS_DETERMINISTIC', True)
+    monkeypatch.setattr(Config, 'BIGQUERY_STATS_TIME_GRANULARITY', 3600)
+    monkeypatch.setattr(bigquery_stats.time, 'time', lambda: 1_700_000_000)
+
+    query, parameters = bigquery_stats.bind_query(
+        'SELECT 1 FROM `{location}.JOBS` WHERE {window} AND start_time < {now} AND day < {today}', 'p.region-eu', 30)
+
+    assert 'CURRENT_' not in query
+    assert query == ('SELECT 1 FROM `p.region-eu.JOBS` WHERE creation_time BETWEEN @window_start AND @window_end '
+                     'AND start_time < @window_end AND day < DATE(@window_end)')
+    bound = {parameter.name: parameter.value for parameter in parameters}
+    assert bound == {'window_start': datetime(2023, 10, 15, 22, 0, tzinfo=timezone.utc),
+                     'window_end': datetime(2023, 11, 14, 22, 0, tzinfo=timezone.utc)}
+
+
+def test_deterministic_refreshes_in_one_slot_send_identical_jobs(monkeypatch):
+    monkeypatch.setattr(Config, 'BIGQUERY_STATS_DETERMINISTIC', True)
+    monkeypatch.setattr(Config, 'BIGQUERY_STATS_TIME_GRANULARITY', 3600)
+    now = iter([1_700_000_000, 1_700_001_000, 1_700_003_700])
+    monkeypatch.setattr(bigquery_stats.time, 'time', lambda: next(now))
+
+    first, second, third = (bigquery_stats.bind_query('SELECT 1 WHERE {window}', 'p.region-eu') for _ in range(3))
+
+    assert first == second
+    assert first != third
+
+
+def test_deterministic_query_without_window_binds_nothing(monkeypatch):
+    monkeypatch.setattr(Config, 'BIGQUERY_STATS_DETERMINISTIC', True)
+    assert bigquery_stats.bind_query('SELECT 1 FROM `{location}.TABLES`', 'p.region-eu') == (
+        'SELECT 1 FROM `p.region-eu.TABLES`', [])
+
+
+def test_cache_hit_rate_is_counted_per_label(redis_client):
+    bigquery_stats.record_cache_hit('table_count', False)
+    bigquery_stats.record_cache_hit('table_count', True)
+    bigquery_stats.record_cache_hit('dataset_count', True)
+    assert bigquery_stats.get_query_cache_stats() == {
+        'table_count': {'queries': 2, 'cache_hits': 1},
+        'dataset_count': {'queries': 1, 'cache_hits': 1}}
+    # Shared with the other processes through Redis
+    assert redis_client.hgetall(bigquery_stats.QUERY_CACHE_HITS_KEY)[b'table_count:queries'] == b'2'
+
+
+def test_cache_hits_are_not_recorded_without_redis(monkeypatch):
+    class Unreachable:
+        def pipeline(self):
+            raise ConnectionError('redis down')
+    monkeypatch.setattr(Config, 'SESSION_REDIS', Unreachable())
+    bigquery_stats.record_cache_hit('table_count', True)
+
+
+class FakeResult:
+    def __init__(self, denied=False):
+        self.denied = denied
+        self.calls = []
+
+    def to_arrow(self, **kwargs):
+        self.calls.append(kwargs)
+        if self.denied and kwargs.get('bqstorage_client'):
+            raise PermissionDenied('bigquery.readsessions.create')
+        return pa.table({'n': [1, 2]})
+
+
+class FakeJob:
+    def __init__(self, *results):
+        self.results = list(results)
+
+    def result(self):
+        return self.results.pop(0)
+
+
+@pytest.fixture
+def arrow_factory(monkeypatch):
+    monkeypatch.setattr(Config, 'STATS_ARROW_FETCH', True)
+    factory = BigQueryClientFactory()
+    monkeypatch.setattr(bigquery_stats, 'client_factory', factory)
+    return factory
+
+
+def test_storage_api_is_off_by_default_and_rest_is_used(arrow_factory):
+    result = FakeResult()
+    assert bigquery_stats.fetch_records(FakeJob(result)) == [{'n': 1}, {'n': 2}]
+    assert result.calls == [{'create_bqstorage_client': False}]
+
+
+def test_storage_api_reads_through_the_shared_client(arrow_factory):
+    arrow_factory._bqstorage_client = shared = object()
+    first, second = FakeResult(), FakeResult()
+    bigquery_stats.fetch_records(FakeJob(first))
+    bigquery_stats.fetch_records(FakeJob(second))
+    assert first.calls == second.calls == [{'bqstorage_client': shared}]
+
+
+def test_refused_read_session_falls_back_to_rest_once_and_for_all(arrow_factory):
+    arrow_factory._bqstorage_client = object()
+    denied, retry = FakeResult(denied=True), FakeResult()
+    assert bigquery_stats.fetch_records(FakeJob(denied, retry)) == [{'n': 1}, {'n': 2}]
+    assert retry.calls == [{'create_bqstorage_client': False}]
+
+    later = FakeResult()
+    bigquery_stats.fetch_records(FakeJob(later))
+    assert later.calls == [{'create_bqstorage_client': False}]
+
+
+def write_ca(path, common_name):
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    now = datetime.utcnow()
+    cert = (x509.CertificateBuilder()
+            .subject_name(name).issuer_name(name)
+            .public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now).not_valid_after(now + timedelta(days=1))
+            .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+            .sign(key, hashes.SHA256()))
+    path.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    return str(path)
+
+
+def ca_names(context):
+    return {dict(item[0] for item in cert['subject']).get('commonName') for cert in context.get_ca_certs()}
+
+
+def test_ssl_context_keeps_public_roots_with_a_custom_ca_only_bundle(tmp_path, monkeypatch):
+    cafile = write_ca(tmp_path / 'internal-ca.pem', 'Internal Test CA')
+    # The custom-only bundle is also what the default verify paths would pick up
+    monkeypatch.setenv('SSL_CERT_FILE', cafile)
+    monkeypatch.setattr(Config, 'SSL_CERT_FILE', cafile)
+
+    names = ca_names(bigquery_stats.get_ssl_context())
+
+    assert 'Internal Test CA' in names
+    assert 'GTS Root R1' in names
+
+
+def test_ssl_context_without_custom_ca_uses_certifi(monkeypatch):
+    monkeypatch.setattr(Config, 'SSL_CERT_FILE', '/nonexistent/ca.pem')
+
+    context = bigquery_stats.get_ssl_context()
+
+    assert 'GTS Root R1' in ca_names(context)
+    assert context.check_hostname
+
+
+def test_transport_verifies_with_the_certifi_context(tmp_path, monkeypatch):
+    cafile = write_ca(tmp_path / 'internal-ca.pem', 'Internal Test CA')
+    monkeypatch.setattr(Config, 'SSL_CERT_FILE', cafile)
+
+    adapter = bigquery_stats.build_transport(pool_size=2).get_adapter('https://bigquery.googleapis.com')
+
+    assert {'Internal Test CA', 'GTS Root R1'} <= ca_names(adapter.ssl_context)
@@ -0,0 +1,63 @@
+import pytest
+from app import cache_warmup
+from app.cache_warmup import WARMUP_STATUS_CACHE_KEY, run_cache_warmup, warm_item
+
+
+@pytest.fixture
+def items(monkeypatch):
+    calls = []
+
+    def loader(value):
+        def load():
+            calls.append(value)
+            return value
+        return load
+
+    def failing():
+        raise RuntimeError('service down')
+
+    monkeypatch.setattr(cache_warmup, 'WARMUP_ITEMS', {
+        'projects': ('projects', loader(['a', 'b']), 60),
+        'empty': ('empty', loader(None), 60),
+        'broken': ('broken', failing, 60),
+        'self_managed': (None, lambda cache, force: 'queued' if force else 'skipped', None),
+    })
+    return calls
+
+
+def test_warm_item_stores_loaded_value(cache, items):
+    assert warm_item(cache, 'projects')['status'] == 'ok'
+    assert cache.get('projects') == ['a', 'b']
+
+
+def test_warm_item_skips_cached_entries_unless_forced(cache, items):
+    cache.set('projects', ['cached'])
+    assert warm_item(cache, 'projects')['status'] == 'skipped'
+    assert items == []
+    assert warm_item(cache, 'projects', force=True)['status'] == 'ok'
+    assert cache.get('projects') == ['a', 'b']
+
+
+def test_warm_item_reports_empty_and_failed_loaders(cache, items):
+    assert warm_item(cache, 'empty')['status'] == 'empty'
+    assert cache.get('empty') is None
+    assert warm_item(cache, 'broken')['status'] == 'failed'
+
+
+def test_warm_item_passes_cache_and_force_to_self_managed_loaders(cache, items):
+    assert warm_item(cache, 'self_managed')['status'] == 'skipped'
+    assert warm_item(cache, 'self_managed', force=True)['status'] == 'queued'
+
+
+def test_run_cache_warmup_stores_status_for_every_item(cache, items):
+    status = run_cache_warmup(cache, max_workers=2)
+    assert status['state'] == 'completed'
+    assert {name: item['status'] for name, item in status['items'].items()} == {
+        'projects': 'ok', 'empty': 'empty', 'broken': 'failed', 'self_managed': 'skipped'
+    }
+    assert cache.get(WARMUP_STATUS_CACHE_KEY)['state'] == 'completed'
+
+
+def test_run_cache_warmup_only_warms_requested_items(cache, items):
+    status = run_cache_warmup(cache, items=['projects'])
+    assert list(status['items']) == ['projects']
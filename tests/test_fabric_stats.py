@@ -0,0 +1,128 @@
+import pytest
+from app.config import Config
+
+# pyodbc needs the unixODBC driver manager (libodbc) to import
+pytest.importorskip('pyodbc', exc_type=ImportError)
+from app.datawarehouse_stats import fabric_stats
+from app.datawarehouse_stats.adapters import get_adapter
+
+SECRETS = {
+    'FABRIC_SERVER': 'fabric.local', 'FABRIC_PORT': '1433', 'FABRIC_DATABASE': 'lakehouse',
+    'FABRIC_USER': 'console', 'FABRIC_PASSWORD': 'secret'
+}
+
+
+class FakeProvider:
+    def subscribe(self, callback):
+        pass
+
+    def get_all(self):
+        return dict(SECRETS)
+
+
+class FakeCursor:
+    """Walks result sets like pyodbc: None descriptions for row counts, nextset() to advance."""
+    def __init__(self, result_sets):
+        self.result_sets = list(result_sets)
+        self.fetch_sizes = []
+        self.executed = []
+        self.arraysize = 1
+
+    @property
+    def description(self):
+        if not self.result_sets or self.result_sets[0] is None:
+            return None
+        return [(column,) for column in self.result_sets[0][0]]
+
+    def execute(self, query):
+        self.executed.append(query)
+
+    def fetchmany(self, size):
+        self.fetch_sizes.append(size)
+        columns, rows = self.result_sets[0]
+        chunk, self.result_sets[0] = rows[:size], (columns, rows[size:])
+        return chunk
+
+    def nextset(self):
+        self.result_sets.pop(0)
+        return bool(self.result_sets)
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.timeout = None
+        self.closed = False
+
+    def cursor(self):
+        return self._cursor
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fabric(redis_client, monkeypatch):
+    """Connect to a fake connection whose cursor answers `fabric.result_sets`."""
+    monkeypatch.setattr(fabric_stats, 'get_secret_provider', lambda *args, **kwargs: FakeProvider())
+    monkeypatch.setattr(Config, 'FABRIC_FETCH_ARRAYSIZE', 2)
+    monkeypatch.setattr(Config, 'STATS_STATEMENT_TIMEOUT_SECONDS', 600)
+    state = type('Fabric', (), {'result_sets': [], 'connects': [], 'connections': []})()
+
+    def connect(conn_str, timeout=None):
+        state.connects.append((conn_str, timeout))
+        connection = FakeConnection(FakeCursor(state.result_sets))
+        state.connections.append(connection)
+        return connection
+    monkeypatch.setattr(fabric_stats.pyodbc, 'connect', connect)
+    return state
+
+
+def test_connection_is_tagged_and_times_out_statements(fabric):
+    with get_adapter('fabric').connection() as connection:
+        (conn_str, timeout), = fabric.connects
+        assert conn_str.endswith(f'APP={Config.STATS_QUERY_TAG}')
+        assert timeout == Config.FABRIC_LOGIN_TIMEOUT
+        assert connection.timeout == 600
+    assert connection.closed
+
+
+def test_rows_are_fetched_in_chunks_and_the_connection_returned(fabric):
+    fabric.result_sets = [(('n',), [(1,), (2,), (3,)])]
+
+    assert fabric_stats.run_query('SELECT n', label='table_count') == [{'n': 1}, {'n': 2}, {'n': 3}]
+    connection, = fabric.connections
+    assert connection.closed
+    assert connection.cursor().fetch_sizes == [2, 2, 2]
+
+
+def test_batch_reads_each_result_set_skipping_row_counts(fabric):
+    fabric.result_sets = [None, (('dataset_count',), [(4,)]), None, (('table_count',), [(9,)])]
+
+    results = fabric_stats.run_batch({'dataset_count': 'SELECT 4;', 'table_count': 'SELECT 9'})
+
+    assert results == {'dataset_count': [{'dataset_count': 4}], 'table_count': [{'table_count': 9}]}
+    batch, = fabric.connections[0].cursor().executed
+    assert batch == 'SET NOCOUNT ON;\nSELECT 4;\nSELECT 9;'
+
+
+def test_failed_batch_returns_nothing(fabric, monkeypatch):
+    def connect(conn_str, timeout=None):
+        raise RuntimeError('login timeout')
+    monkeypatch.setattr(fabric_stats.pyodbc, 'connect', connect)
+    assert fabric_stats.run_batch({'dataset_count': 'SELECT 4'}) == {}
+    assert fabric_stats.get_all_stats() is None
+
+
+def test_all_stats_come_from_one_batch(fabric):
+    fabric.result_sets = [
+        (('dataset_count',), [(4,)]),
+        (('table_count',), [(9,)]),
+        (('TABLE_SCHEMA', 'TABLE_NAME', 'size_mb'), [('dbo', 'orders', 12.5)]),
+    ]
+
+    stats = fabric_stats.get_all_stats()
+
+    assert len(fabric.connects) == 1
+    assert stats['dataset_count'] == 4 and stats['table_count'] == 9
+    assert stats['total_cost_gb_by_table'] == '[{"dataset":"dbo","table":"orders","size_mb":12.5}]'
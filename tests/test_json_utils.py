@@ -0,0 +1,50 @@
+import decimal
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import orjson
+import pytest
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from app.json_utils import OrjsonProvider, dumps, loads
+
+
+def test_loads_parses_response_bytes():
+    assert loads(b'{"logs": {"a": 1}}') == {'logs': {'a': 1}}
+
+
+@pytest.mark.parametrize('body', [b'', b'<html>502 Bad Gateway</html>', b'{"logs": '])
+def test_loads_raises_a_value_error_on_a_non_json_body(body):
+    # Handlers catch ValueError next to RequestException for upstream error pages
+    with pytest.raises(ValueError):
+        loads(body)
+    with pytest.raises(orjson.JSONDecodeError):
+        loads(body)
+
+
+def test_dumps_formats_decimals_and_datetimes():
+    row = {'cost': decimal.Decimal('1.25'), 'at': datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)}
+    assert loads(dumps(row)) == {'cost': 1.25, 'at': '2024-01-02T03:04:05+00:00'}
+    assert loads(dumps(row, datetime_format='%Y-%m-%d %H:%M:%S')) == {'cost': 1.25, 'at': '2024-01-02 03:04:05'}
+
+
+@dataclass
+class Point:
+    x: int
+
+
+def test_provider_matches_flasks_default_provider():
+    app = Flask(__name__)
+    payload = {'b': decimal.Decimal('2.50'), 'a': datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+               'id': uuid.UUID(int=1), 'point': Point(3)}
+    assert loads(OrjsonProvider(app).dumps(payload)) == loads(DefaultJSONProvider(app).dumps(payload))
+    assert OrjsonProvider(app).dumps({'b': 1, 'a': 2}) == '{"a":2,"b":1}'
+
+
+def test_provider_response_is_json():
+    app = Flask(__name__)
+    app.json = OrjsonProvider(app)
+    with app.app_context():
+        response = app.json.response({'ok': True})
+    assert response.mimetype == 'application/json'
+    assert loads(response.get_data()) == {'ok': True}
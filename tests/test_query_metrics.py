@@ -0,0 +1,49 @@
+import pytest
+from app.config import Config
+from app.datawarehouse_stats.query_metrics import (
+    get_query_timings, query_tag, record_query_time, statement_timeout_seconds, timed_query
+)
+
+
+def test_query_tag_appends_the_label(monkeypatch):
+    monkeypatch.setattr(Config, 'STATS_QUERY_TAG', 'fastbi-console-stats')
+    assert query_tag() == 'fastbi-console-stats'
+    assert query_tag('table_count') == 'fastbi-console-stats:table_count'
+
+
+def test_zero_statement_timeout_disables_it(monkeypatch):
+    monkeypatch.setattr(Config, 'STATS_STATEMENT_TIMEOUT_SECONDS', 0)
+    assert statement_timeout_seconds() is None
+    monkeypatch.setattr(Config, 'STATS_STATEMENT_TIMEOUT_SECONDS', 600)
+    assert statement_timeout_seconds() == 600
+
+
+def test_timings_are_summed_per_warehouse_and_label(redis_client):
+    record_query_time('redshift', 'table_count', 1.0)
+    record_query_time('redshift', 'table_count', 2.0, failed=True)
+    record_query_time('snowflake', None, 0.5)
+
+    assert get_query_timings() == {
+        'redshift': {'table_count': {'queries': 2, 'failures': 1, 'total_seconds': 3.0, 'avg_seconds': 1.5}},
+        'snowflake': {'query': {'queries': 1, 'failures': 0, 'total_seconds': 0.5, 'avg_seconds': 0.5}},
+    }
+    assert list(get_query_timings('snowflake')) == ['snowflake']
+
+
+def test_timed_query_counts_a_raising_block_as_failed(redis_client):
+    with timed_query('fabric', 'dataset_count'):
+        pass
+    with pytest.raises(RuntimeError):
+        with timed_query('fabric', 'dataset_count'):
+            raise RuntimeError('timeout')
+
+    entry = get_query_timings('fabric')['fabric']['dataset_count']
+    assert entry['queries'] == 2 and entry['failures'] == 1
+
+
+def test_unreachable_redis_does_not_fail_the_query():
+    class Unreachable:
+        def pipeline(self):
+            raise ConnectionError('redis down')
+
+    record_query_time('redshift', 'table_count', 1.0, redis_client=Unreachable())
@@ -0,0 +1,210 @@
+import gc
+import weakref
+from datetime import date, datetime
+import psycopg2
+import pytest
+from app.config import Config
+from app.datawarehouse_stats import redshift_stats
+
+SECRETS = {
+    'REDSHIFT_DATABASE': 'dev', 'REDSHIFT_USER': 'console', 'REDSHIFT_PASSWORD': 'secret',
+    'REDSHIFT_HOST': 'redshift.local', 'REDSHIFT_PORT': '5439'
+}
+
+
+class FakeProvider:
+    def __init__(self):
+        self.subscribers = []
+
+    def get_all(self):
+        return dict(SECRETS)
+
+    def subscribe(self, callback):
+        if callback not in self.subscribers:
+            self.subscribers.append(callback)
+
+    def check(self):
+        pass
+
+    def rotate(self):
+        for callback in self.subscribers:
+            callback(self)
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.description = [('n',)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        if self.conn.broken:
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+        self.conn.executed.append(query)
+
+    def fetchall(self):
+        return [(1,)]
+
+
+class FakeConnection:
+    def __init__(self):
+        self.autocommit = False
+        self.closed = 0
+        self.broken = False
+        self.executed = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed = 1
+
+
+class FakePool:
+    """ThreadedConnectionPool keeping its connections only while they are in use or idle."""
+    instances = []
+
+    def __init__(self, minconn, maxconn, **kwargs):
+        self.kwargs = kwargs
+        self.idle = []
+        self.opened = []
+        self.closed = False
+        FakePool.instances.append(self)
+
+    def getconn(self):
+        if self.idle:
+            return self.idle.pop()
+        conn = FakeConnection()
+        self.opened.append(weakref.ref(conn))
+        return conn
+
+    def putconn(self, conn, close=False):
+        if close:
+            conn.close()
+        else:
+            self.idle.append(conn)
+
+    def closeall(self):
+        for conn in self.idle:
+            conn.close()
+        self.idle = []
+        self.closed = True
+
+
+@pytest.fixture
+def redshift(redis_client, monkeypatch):
+    provider = FakeProvider()
+    FakePool.instances = []
+    monkeypatch.setattr(redshift_stats, 'get_secret_provider', lambda *args, **kwargs: provider)
+    monkeypatch.setattr(redshift_stats, 'ThreadedConnectionPool', FakePool)
+    monkeypatch.setattr(redshift_stats, '_pool', None)
+    monkeypatch.setattr(redshift_stats, '_pool_pid', None)
+    monkeypatch.setattr(redshift_stats, '_prepared', weakref.WeakSet())
+    monkeypatch.setattr(redshift_stats, '_owners', {})
+    monkeypatch.setattr(redshift_stats, '_retired', [])
+    monkeypatch.setattr(Config, 'REDSHIFT_POOL_SIZE', 2)
+    monkeypatch.setattr(Config, 'REDSHIFT_POOL_TIMEOUT', 0.05)
+    monkeypatch.setattr(Config, 'STATS_STATEMENT_TIMEOUT_SECONDS', 600)
+    return provider
+
+
+def test_connections_are_prepared_once_and_tagged(redshift):
+    assert redshift_stats.run_query('SELECT 1 AS n', label='table_count') == [{'n': 1}]
+    assert redshift_stats.run_query('SELECT 2 AS n', label='dataset_count') == [{'n': 1}]
+
+    pool, = FakePool.instances
+    conn, = pool.idle
+    assert conn.autocommit
+    assert conn.executed.count('SET statement_timeout TO 600000') == 1
+    assert conn.executed.count('SELECT 1') == 1  # health check before the reuse
+    assert pool.kwargs['application_name'] == Config.STATS_QUERY_TAG
+
+
+def test_broken_connection_is_replaced(redshift):
+    conn = redshift_stats.checkout(600)
+    redshift_stats.checkin(conn)
+    conn.broken = True
+
+    fresh = redshift_stats.checkout(600)
+
+    assert fresh is not conn and conn.closed
+    assert 'SET statement_timeout TO 600000' in fresh.executed
+    redshift_stats.checkin(fresh)
+
+
+def test_full_pool_times_out(redshift):
+    first, second = redshift_stats.checkout(), redshift_stats.checkout()
+    with pytest.raises(TimeoutError):
+        redshift_stats.checkout()
+    redshift_stats.checkin(first)
+    redshift_stats.checkin(second)
+
+
+def test_rotation_retires_the_pool_once_its_connections_are_back(redshift):
+    busy = redshift_stats.checkout()
+    old_pool, = FakePool.instances
+
+    redshift.rotate()
+    fresh = redshift_stats.checkout()
+
+    assert fresh not in old_pool.idle and len(FakePool.instances) == 2
+    assert not old_pool.closed
+    redshift_stats.checkin(busy)
+    assert busy.closed and old_pool.closed
+    assert redshift_stats._retired == []
+    redshift_stats.checkin(fresh)
+
+
+def test_connections_of_a_closed_pool_do_not_mark_new_ones_prepared(redshift):
+    for _ in range(20):
+        conn = redshift_stats.checkout(600)
+        redshift_stats.checkin(conn)
+        # The closed connection is freed and its id may be handed to the next one opened
+        redshift.rotate()
+        del conn
+        gc.collect()
+
+    for pool in FakePool.instances:
+        for ref in pool.opened:
+            assert ref() is None
+    conn = redshift_stats.checkout(600)
+    assert conn.autocommit
+    assert 'SET statement_timeout TO 600000' in conn.executed
+    assert len(redshift_stats._prepared) == 1
+    redshift_stats.checkin(conn)
+
+
+def test_increments_count_only_finished_queries():
+    query = ' '.join(redshift_stats.rollup_query(datetime(2024, 3, 5, 10), datetime(2024, 3, 5, 11)).split())
+    assert ("WHERE h.start_time > '2024-03-05T10:00:00' AND h.start_time <= '2024-03-05T11:00:00' "
+            "AND NOT (h.end_time IS NULL OR h.status IN ('planning', 'queued', 'running', 'returning'))") in query
+    # Whole-day rollups are unchanged
+    assert 'NOT (' not in redshift_stats.rollup_query(date(2024, 3, 5))
+
+
+def test_increment_until_stops_before_the_earliest_open_query(monkeypatch):
+    since_time, until_time = datetime(2024, 3, 5, 10), datetime(2024, 3, 5, 11)
+    queries = []
+    answers = [[{'open_start_time': datetime(2024, 3, 5, 10, 30)}], [{'open_start_time': None}]]
+
+    def run_query(query, raise_errors=False, label=None):
+        queries.append(' '.join(query.split()))
+        return answers.pop(0)
+    monkeypatch.setattr(redshift_stats, 'run_query', run_query)
+
+    assert redshift_stats.get_increment_until(since_time, until_time) == datetime(2024, 3, 5, 10, 29, 59, 999999)
+    assert redshift_stats.get_increment_until(since_time, until_time) == until_time
+    assert "start_time > '2024-03-05T10:00:00' AND start_time <= '2024-03-05T11:00:00'" in queries[0]
+    assert "(end_time IS NULL OR status IN ('planning', 'queued', 'running', 'returning'))" in queries[0]
+
+
+def test_increment_until_is_none_when_the_query_fails(monkeypatch):
+    def run_query(query, raise_errors=False, label=None):
+        raise psycopg2.OperationalError('timeout')
+    monkeypatch.setattr(redshift_stats, 'run_query', run_query)
+    assert redshift_stats.get_increment_until(datetime(2024, 3, 5, 10), datetime(2024, 3, 5, 11)) is None
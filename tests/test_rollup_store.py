@@ -0,0 +1,233 @@
+import threading
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+import pytest
+from app.config import Config
+from app.datawarehouse_stats import rollup_store
+from app.datawarehouse_stats.adapters import get_adapter
+from app.datawarehouse_stats.rollup_store import StatsRollupStore
+
+
+@pytest.fixture
+def store(pg, monkeypatch):
+    monkeypatch.setattr(StatsRollupStore, 'get_connection', lambda self: pg)
+
+    def execute_values(cur, query, values):
+        cur.execute(query, values)
+    monkeypatch.setattr(rollup_store.extras, 'execute_values', execute_values)
+    store = StatsRollupStore({})
+    pg.executed.clear()
+    pg.commits = 0
+    return store
+
+
+@pytest.fixture
+def warehouse(monkeypatch):
+    """Replace the BigQuery stats module behind the adapter with a fake one."""
+    module = SimpleNamespace(calls=[])
+    monkeypatch.setattr(get_adapter('bigquery'), '_module', module)
+    return module
+
+
+def rollup_row(day, user='a@x', dataset='d', table='t', queries=1, failures=0, bytes_billed=100):
+    return {
+        'day': day, 'user_name': user, 'dataset': dataset, 'table_name': table,
+        'query_count': queries, 'failure_count': failures, 'finished_count': queries,
+        'bytes_billed': bytes_billed, 'execution_seconds': 1.5 * queries,
+        'first_query_time': datetime.combine(day, datetime.min.time()),
+        'last_query_time': datetime.combine(day, datetime.max.time()),
+    }
+
+
+def test_merge_days_sums_rows_sharing_a_key(store, pg):
+    day = date(2024, 3, 1)
+    rows = [rollup_row(day, queries=2), rollup_row(day, queries=3, failures=1), rollup_row(day, table='other')]
+    assert store.merge_days('bigquery', day, rows, day, 180) == 2
+
+    (_, values), = pg.statements('INSERT INTO dwh_stats_daily_rollup')
+    merged = {value[4]: value for value in values}
+    assert merged['t'][5:8] == (5, 1, 5)
+    assert merged['t'][8] == 200
+    assert merged['other'][5] == 1
+
+
+def test_merge_days_replaces_days_and_moves_the_watermark_in_one_transaction(store, pg):
+    since_day, last_complete_day = date(2024, 3, 1), date(2024, 3, 5)
+    store.merge_days('bigquery', since_day, [rollup_row(since_day)], last_complete_day, 30)
+
+    (_, delete_params), = pg.statements('DELETE FROM dwh_stats_daily_rollup')
+    assert delete_params == ('bigquery', since_day, last_complete_day - timedelta(days=30))
+    (_, watermark_params), = pg.statements('INSERT INTO dwh_stats_rollup_watermark')
+    assert watermark_params == ('bigquery', last_complete_day)
+    assert pg.commits == 1
+
+
+def test_first_refresh_backfills_the_retention_window(store, pg, warehouse, monkeypatch):
+    monkeypatch.setattr(Config, 'STATS_ROLLUP_RETENTION_DAYS', 10)
+    warehouse.get_daily_rollup = lambda since_day: warehouse.calls.append(since_day) or []
+    pg.results = [None]  # no watermark yet
+
+    assert rollup_store.refresh_rollups('bigquery', store) is True
+    assert warehouse.calls == [rollup_store.get_last_complete_day() - timedelta(days=10)]
+
+
+def test_refresh_only_reads_the_days_after_the_watermark(store, pg, warehouse):
+    watermark = date(2024, 3, 5)
+    warehouse.get_daily_rollup = lambda since_day: warehouse.calls.append(since_day) or []
+    pg.results = [(watermark,)]
+
+    rollup_store.refresh_rollups('bigquery', store)
+    assert warehouse.calls == [date(2024, 3, 6)]
+
+
+def test_failed_refresh_keeps_the_watermark(store, pg, warehouse):
+    warehouse.get_daily_rollup = lambda since_day: None
+    pg.results = [(date(2024, 3, 5),)]
+
+    assert rollup_store.refresh_rollups('bigquery', store) is False
+    assert not pg.statements('INSERT INTO dwh_stats_rollup_watermark')
+
+
+def test_rollup_cards_are_computed_from_the_totals(store, pg):
+    totals = {'query_count': 200, 'failure_count': 5, 'finished_count': 100, 'execution_seconds': 250.0}
+    pg.results = [[totals], [totals], [totals]]
+    assert rollup_store.rollup_total_query_executed('bigquery', store) == 200
+    assert rollup_store.rollup_failure_rate_percentage('bigquery', store) == 2.5
+    assert rollup_store.rollup_avg_execution_time_seconds('bigquery', store) == 2.5
+
+
+def test_add_increment_locks_and_checks_the_watermark(store, pg):
+    since_time, until_time = datetime(2024, 3, 5, 10), datetime(2024, 3, 5, 11)
+    pg.results = [(since_time,)]
+
+    assert store.add_increment('redshift', [rollup_row(date(2024, 3, 5))], since_time, until_time, 180) == 1
+
+    statements = [query for query, _ in pg.executed]
+    assert statements[0].startswith('SELECT pg_advisory_xact_lock(hashtext(%s))')
+    assert statements[1].endswith('FOR UPDATE;')
+    (_, params), = pg.statements('INSERT INTO dwh_stats_rollup_watermark')
+    assert params == ('redshift', date(2024, 3, 4), until_time)
+    assert pg.commits == 1
+
+
+def test_add_increment_adds_nothing_once_the_watermark_moved(store, pg):
+    since_time = datetime(2024, 3, 5, 10)
+    pg.results = [(datetime(2024, 3, 5, 11),)]
+
+    assert store.add_increment('redshift', [rollup_row(date(2024, 3, 5))], since_time, datetime(2024, 3, 5, 11), 180) is None
+    assert not pg.statements('INSERT INTO dwh_stats_daily_rollup')
+    assert pg.rollbacks == 1 and pg.commits == 0
+
+
+def test_refresh_lock_is_a_postgres_advisory_lock(store, pg):
+    with store.refresh_lock('redshift'):
+        (query, params), = pg.executed
+    assert query == 'SELECT pg_advisory_lock(hashtext(%s));'
+    assert params == ('dwh_stats_rollup_watermark:refresh:redshift',)
+    assert pg.closed == 1
+
+
+class MemoryStore:
+    """The store's watermark semantics in memory: add_increment only applies on the watermark it was read from."""
+    def __init__(self, start_watermark):
+        self.start_watermark = start_watermark
+        self.added = []
+        self.refreshed = 0
+        self.lock = threading.Lock()
+        self.refresh_mutex = threading.Lock()
+
+    def get_start_watermark(self, dwh_type):
+        return self.start_watermark
+
+    def add_increment(self, dwh_type, rows, since_time, last_start_time, retention_days, replace_since_day=None):
+        with self.lock:
+            if self.start_watermark != since_time:
+                return None
+            self.added.extend(rows)
+            self.start_watermark = last_start_time
+            return len(rows)
+
+    def set_storage_gb(self, dwh_type, storage_gb):
+        pass
+
+    def get_refresh_age_seconds(self, dwh_type):
+        return 0 if self.refreshed else None
+
+    def refresh_lock(self, dwh_type):
+        return self.refresh_mutex
+
+
+def increment_module(rows, barrier=None, open_start_time=None):
+    def get_rollup_increment(since_time, until_time):
+        module.calls.append((since_time, until_time))
+        if barrier:
+            # Both processes have read the same watermark before either adds
+            barrier.wait(timeout=5)
+        return list(rows)
+
+    def get_increment_until(since_time, until_time):
+        return min(until_time, open_start_time) if open_start_time else until_time
+    module = SimpleNamespace(calls=[], get_rollup_increment=get_rollup_increment, get_increment_until=get_increment_until)
+    return module
+
+
+def test_concurrent_increments_add_the_window_once():
+    store = MemoryStore(datetime(2024, 3, 5, 10))
+    module = increment_module([rollup_row(date(2024, 3, 5), queries=7)], barrier=threading.Barrier(2))
+    results = []
+    workers = [threading.Thread(target=lambda: results.append(rollup_store.refresh_increment('redshift', module, store)))
+               for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert results == [True, True]
+    assert len(module.calls) == 2
+    assert [row['query_count'] for row in store.added] == [7]
+
+
+def test_concurrent_refreshes_run_the_rollup_refresh_once(monkeypatch):
+    store = MemoryStore(datetime(2024, 3, 5, 10))
+    entered = threading.Event()
+    release = threading.Event()
+
+    def refresh_rollups(dwh_type, store):
+        entered.set()
+        release.wait(timeout=5)
+        store.refreshed += 1
+        return True
+    monkeypatch.setattr(rollup_store, 'refresh_rollups', refresh_rollups)
+
+    first = threading.Thread(target=rollup_store.ensure_rollups_fresh, args=('redshift', store))
+    first.start()
+    entered.wait(timeout=5)
+    # The second caller saw a stale refresh age before the first finished
+    second = threading.Thread(target=rollup_store.ensure_rollups_fresh, args=('redshift', store))
+    second.start()
+    release.set()
+    first.join()
+    second.join()
+
+    assert store.refreshed == 1
+
+
+def test_increment_stops_before_the_earliest_open_query(monkeypatch):
+    monkeypatch.setattr(Config, 'STATS_ROLLUP_INCREMENT_SETTLE_MINUTES', 15)
+    since_time, open_start_time = datetime(2024, 3, 5, 10), datetime(2024, 3, 5, 10, 30)
+    store = MemoryStore(since_time)
+    module = increment_module([rollup_row(date(2024, 3, 5))], open_start_time=open_start_time)
+
+    assert rollup_store.refresh_increment('redshift', module, store) is True
+    assert module.calls == [(since_time, open_start_time)]
+    assert store.start_watermark == open_start_time
+
+
+def test_increment_is_skipped_when_open_queries_cannot_be_read():
+    since_time = datetime(2024, 3, 5, 10)
+    store = MemoryStore(since_time)
+    module = increment_module([])
+    module.get_increment_until = lambda since_time, until_time: None
+
+    assert rollup_store.refresh_increment('redshift', module, store) is False
+    assert module.calls == [] and store.start_watermark == since_time
@@ -0,0 +1,127 @@
+import os
+import pytest
+from app.config import Config
+from app.datawarehouse_stats import secret_provider
+from app.datawarehouse_stats.secret_provider import SecretProvider, get_secret_provider
+
+NAMES = ['DB_USER', 'DB_PASSWORD']
+
+
+def project(directory, version, values):
+    """Lay secrets out like a kubelet projected volume and swap ..data to the new version."""
+    target = directory / f'..{version}'
+    target.mkdir()
+    for name, value in values.items():
+        (target / name).write_text(f'{value}\n')
+        if not (directory / name).is_symlink():
+            (directory / name).symlink_to(os.path.join('..data', name))
+    link = directory / '..data_tmp'
+    link.symlink_to(target.name)
+    os.replace(link, directory / '..data')
+
+
+@pytest.fixture
+def no_throttle(monkeypatch):
+    monkeypatch.setattr(Config, 'SECRETS_CHECK_SECONDS', 0)
+
+
+def test_secrets_are_read_once_and_cached(tmp_path, no_throttle):
+    project(tmp_path, 'v1', {'DB_USER': 'console', 'DB_PASSWORD': 'first'})
+    provider = SecretProvider(str(tmp_path), NAMES)
+
+    assert provider.get_all() == {'DB_USER': 'console', 'DB_PASSWORD': 'first'}
+    # Edited in place without a ..data swap: not a kubelet update, the cache is kept
+    (tmp_path / '..v1' / 'DB_PASSWORD').write_text('edited')
+    assert provider.get('DB_PASSWORD') == 'first'
+
+
+def test_symlink_swap_reloads_and_notifies_once(tmp_path, no_throttle):
+    project(tmp_path, 'v1', {'DB_USER': 'console', 'DB_PASSWORD': 'first'})
+    provider = SecretProvider(str(tmp_path), NAMES)
+    notified = []
+    callback = notified.append
+    provider.subscribe(callback)
+    provider.subscribe(callback)
+    provider.get_all()
+
+    project(tmp_path, 'v2', {'DB_USER': 'console', 'DB_PASSWORD': 'rotated'})
+
+    assert provider.check() is True
+    assert notified == [provider]
+    assert provider.get('DB_PASSWORD') == 'rotated'
+    assert provider.check() is False
+
+
+def test_checks_are_throttled(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'SECRETS_CHECK_SECONDS', 3600)
+    project(tmp_path, 'v1', {'DB_USER': 'console', 'DB_PASSWORD': 'first'})
+    provider = SecretProvider(str(tmp_path), NAMES)
+    provider.get_all()
+
+    project(tmp_path, 'v2', {'DB_USER': 'console', 'DB_PASSWORD': 'rotated'})
+
+    assert provider.check() is False
+    assert provider.get('DB_PASSWORD') == 'first'
+
+
+def test_plain_files_are_fingerprinted_by_stat(tmp_path, no_throttle):
+    (tmp_path / 'DB_USER').write_text('console')
+    (tmp_path / 'DB_PASSWORD').write_text('first')
+    provider = SecretProvider(str(tmp_path), NAMES)
+    provider.get_all()
+
+    (tmp_path / 'DB_PASSWORD').write_text('rotated-password')
+
+    assert provider.check() is True
+    assert provider.get('DB_PASSWORD') == 'rotated-password'
+
+
+def test_unreadable_update_keeps_the_previous_values(tmp_path, no_throttle):
+    project(tmp_path, 'v1', {'DB_USER': 'console', 'DB_PASSWORD': 'first'})
+    provider = SecretProvider(str(tmp_path), NAMES)
+    notified = []
+    provider.subscribe(notified.append)
+    provider.get_all()
+
+    project(tmp_path, 'v2', {'DB_USER': 'console'})
+
+    assert provider.check() is False
+    assert provider.get('DB_PASSWORD') == 'first' and notified == []
+    (tmp_path / '..v2' / 'DB_PASSWORD').write_text('rotated')
+    assert provider.check() is True
+
+
+def test_failing_subscriber_does_not_stop_the_others(tmp_path, no_throttle):
+    project(tmp_path, 'v1', {'DB_USER': 'console', 'DB_PASSWORD': 'first'})
+    provider = SecretProvider(str(tmp_path), NAMES)
+    notified = []
+
+    def failing(provider):
+        raise RuntimeError('pool busy')
+    provider.subscribe(failing)
+    provider.subscribe(notified.append)
+    provider.get_all()
+
+    project(tmp_path, 'v2', {'DB_USER': 'console', 'DB_PASSWORD': 'rotated'})
+
+    assert provider.check() is True
+    assert notified == [provider]
+
+
+def test_environment_first_reads_only_the_missing_files(tmp_path, monkeypatch):
+    (tmp_path / 'DB_PASSWORD').write_text('from-file')
+    monkeypatch.setenv('DB_USER', 'from-env')
+    monkeypatch.setenv('DB_PASSWORD', '')
+
+    assert SecretProvider(str(tmp_path), NAMES, env_first=True).get_all() == {
+        'DB_USER': 'from-env', 'DB_PASSWORD': 'from-file'}
+    with pytest.raises(FileNotFoundError):
+        SecretProvider(str(tmp_path), NAMES).get_all()
+
+
+def test_one_provider_per_warehouse(tmp_path, monkeypatch):
+    monkeypatch.setattr(secret_provider, '_providers', {})
+    provider = get_secret_provider('redshift', NAMES, path=str(tmp_path))
+    assert get_secret_provider('redshift', NAMES) is provider
+    assert provider.path == str(tmp_path)
+    assert get_secret_provider('fabric', NAMES).path == os.path.join(secret_provider.SECRETS_ROOT, 'fabric')
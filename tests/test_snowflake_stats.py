@@ -0,0 +1,265 @@
+import pytest
+from snowflake.connector.errors import OperationalError, ProgrammingError
+from app.config import Config
+from app.datawarehouse_stats import snowflake_stats
+from app.datawarehouse_stats.query_metrics import get_query_timings
+from app.datawarehouse_stats.snowflake_stats import SnowflakeConnection
+
+SECRETS = {
+    'SNOWFLAKE_ACCOUNT': 'account', 'SNOWFLAKE_DATABASE': 'ANALYTICS', 'SNOWFLAKE_USER': 'console',
+    'SNOWFLAKE_PASSWORD': 'secret', 'SNOWFLAKE_WAREHOUSE': 'COMPUTE_WH'
+}
+
+
+class FakeProvider:
+    def __init__(self):
+        self.subscribers = []
+
+    def get_all(self):
+        return dict(SECRETS)
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def check(self):
+        pass
+
+
+class FakeCursor:
+    def __init__(self, session):
+        self.session = session
+        self.sfqid = None
+        self.rows = []
+        self.description = [('N',)]
+
+    def execute(self, query, _statement_params=None):
+        self.session.executed.append(query)
+        if query in self.session.errors:
+            raise self.session.errors[query]
+        self.sfqid = f'sync_{len(self.session.executed)}'
+        self.rows = [(self.session.answers[query],)]
+
+    def execute_async(self, query, _statement_params=None):
+        self.session.executed.append(query)
+        self.sfqid = f'q{len(self.session.executed)}'
+        self.session.submitted[self.sfqid] = query
+
+    def get_results_from_sfqid(self, query_id):
+        self.sfqid = query_id
+        self.rows = [(self.session.answers[self.session.submitted[query_id]],)]
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeSession:
+    """A Snowflake session whose async queries finish after `polls[query]` status checks."""
+    def __init__(self, answers=None, polls=None, failing=None, errors=None):
+        self.answers = answers or {}
+        # Raised by the synchronous execute() of these statements
+        self.errors = errors or {}
+        self.polls = dict(polls or {})
+        self.failing = failing
+        self.executed = []
+        self.submitted = {}
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_query_status_throw_if_error(self, query_id):
+        query = self.submitted[query_id]
+        if query == self.failing:
+            raise RuntimeError(f'{query} failed')
+        remaining = self.polls.get(query, 0)
+        self.polls[query] = remaining - 1
+        return 'RUNNING' if remaining > 0 else 'SUCCESS'
+
+    def is_still_running(self, status):
+        return status == 'RUNNING'
+
+    def is_closed(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def snowflake(redis_client, monkeypatch):
+    """The process SnowflakeConnection over fake sessions, each connect() opening the next one of `sessions`."""
+    monkeypatch.setattr(snowflake_stats, 'get_secret_provider', lambda *args, **kwargs: FakeProvider())
+    monkeypatch.setattr(Config, 'STATS_ARROW_FETCH', False)
+    monkeypatch.setattr(Config, 'SNOWFLAKE_ASYNC_POLL_SECONDS', 0)
+    monkeypatch.setattr(Config, 'SNOWFLAKE_POOL_SIZE', 2)
+    monkeypatch.setattr(Config, 'SNOWFLAKE_POOL_TIMEOUT', 0.05)
+    monkeypatch.setattr(Config, 'SNOWFLAKE_POOL_IDLE_SECONDS', 300)
+    monkeypatch.setattr(Config, 'SNOWFLAKE_POOL_MAX_AGE_SECONDS', 3600)
+    monkeypatch.setattr(Config, 'STATS_STATEMENT_TIMEOUT_SECONDS', 600)
+    connection = SnowflakeConnection()
+    monkeypatch.setattr(SnowflakeConnection, '_instance', connection)
+    connection.sessions = []
+    connection.connects = []
+
+    def connect(**kwargs):
+        session = connection.sessions.pop(0) if connection.sessions else FakeSession()
+        connection.connects.append(kwargs)
+        return session
+    monkeypatch.setattr(snowflake_stats.snowflake.connector, 'connect', connect)
+    return connection
+
+
+QUERIES = {'slow': 'SELECT slow', 'fast': 'SELECT fast', 'instant': 'SELECT instant'}
+ANSWERS = {'SELECT slow': 1, 'SELECT fast': 2, 'SELECT instant': 3}
+
+
+def test_async_batch_submits_everything_before_polling(snowflake, monkeypatch):
+    monkeypatch.setattr(Config, 'SNOWFLAKE_ASYNC_QUERIES', True)
+    session = FakeSession(ANSWERS, polls={'SELECT slow': 3, 'SELECT fast': 1})
+    snowflake.sessions.append(session)
+
+    results = snowflake_stats.run_queries(QUERIES)
+
+    assert list(results) == ['slow', 'fast', 'instant']
+    assert results == {'slow': [{'N': 1}], 'fast': [{'N': 2}], 'instant': [{'N': 3}]}
+    assert session.executed == list(QUERIES.values())
+    # Each statement from submission to completion, and the whole batch
+    assert set(get_query_timings('snowflake')['snowflake']) == {'slow', 'fast', 'instant', 'batch'}
+
+
+def test_failed_async_query_fails_the_batch_and_discards_the_session(snowflake, monkeypatch):
+    monkeypatch.setattr(Config, 'SNOWFLAKE_ASYNC_QUERIES', True)
+    session = FakeSession(ANSWERS, failing='SELECT fast')
+    snowflake.sessions.append(session)
+
+    assert snowflake_stats.run_queries(QUERIES) == {}
+    assert session.closed
+    assert get_query_timings('snowflake')['snowflake']['fast']['failures'] == 1
+
+
+def test_sync_batch_runs_the_statements_in_order(snowflake, monkeypatch):
+    monkeypatch.setattr(Config, 'SNOWFLAKE_ASYNC_QUERIES', False)
+    session = FakeSession(ANSWERS)
+    snowflake.sessions.append(session)
+
+    assert snowflake_stats.run_queries(QUERIES) == {'slow': [{'N': 1}], 'fast': [{'N': 2}], 'instant': [{'N': 3}]}
+    assert session.submitted == {}
+
+
+def test_sessions_are_reused_with_role_and_tag_set_once(snowflake, monkeypatch):
+    monkeypatch.setattr(Config, 'SNOWFLAKE_ASYNC_QUERIES', False)
+    session = FakeSession(ANSWERS)
+    snowflake.sessions.append(session)
+    snowflake_stats.run_queries({'slow': 'SELECT slow'})
+    snowflake_stats.run_queries({'fast': 'SELECT fast'})
+
+    assert len(snowflake.connects) == 1
+    assert session.executed == ['SELECT slow', 'SELECT fast']
+    parameters = snowflake.connects[-1]
+    assert parameters['role'] == Config.SNOWFLAKE_ROLE
+    assert parameters['client_session_keep_alive'] is True
+    assert parameters['session_parameters']['QUERY_TAG'] == Config.STATS_QUERY_TAG
+    assert parameters['session_parameters']['STATEMENT_TIMEOUT_IN_SECONDS'] == 600
+
+
+def test_checkout_waits_for_a_free_session_then_times_out(snowflake):
+    first = snowflake.checkout()
+    second = snowflake.checkout()
+    with pytest.raises(TimeoutError):
+        snowflake.checkout()
+    snowflake.checkin(*first)
+    assert snowflake.checkout()[0] is first[0]
+    snowflake.checkin(*second)
+
+
+def test_idle_and_old_sessions_are_closed_instead_of_reused(snowflake, monkeypatch):
+    connection, created_at = snowflake.checkout()
+    snowflake.checkin(connection, created_at)
+    monkeypatch.setattr(Config, 'SNOWFLAKE_POOL_IDLE_SECONDS', -1)
+
+    fresh, _ = snowflake.checkout()
+
+    assert fresh is not connection
+    assert connection.closed
+    assert snowflake._open == 1
+
+
+def test_rotated_secrets_close_the_sessions_opened_before(snowflake):
+    connection, created_at = snowflake.checkout()
+    snowflake.checkin(connection, created_at)
+    busy, busy_created_at = snowflake.checkout()
+    other, other_created_at = snowflake.checkout()
+
+    snowflake._on_secrets_changed(None)
+    snowflake.checkin(other, other_created_at)
+
+    # Sessions opened before the rotation are closed when they come back
+    assert other.closed
+    assert snowflake._open == 1
+    snowflake.checkin(busy, busy_created_at)
+    assert busy.closed and snowflake._open == 0
+
+
+def test_failed_connect_frees_its_slot(snowflake, monkeypatch):
+    def refuse(**kwargs):
+        raise RuntimeError('login failed')
+    monkeypatch.setattr(snowflake_stats.snowflake.connector, 'connect', refuse)
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            snowflake.checkout()
+    assert snowflake._open == 0
+
+
+@pytest.mark.parametrize('attribution', ['regex', 'access_history'])
+def test_both_attributions_cover_the_same_window(attribution, monkeypatch):
+    monkeypatch.setattr(Config, 'SNOWFLAKE_ACCESS_HISTORY_DAYS', 90)
+    query = snowflake_stats.table_costs_query('ANALYTICS', attribution)
+    assert "start_time >= DATEADD('day', -90, CURRENT_TIMESTAMP())" in query
+    assert "-30, CURRENT_TIMESTAMP()" in snowflake_stats.table_costs_query('ANALYTICS', attribution, window_days=30)
+
+
+def test_access_history_resolves_objects_by_id():
+    query = ' '.join(snowflake_stats.access_history_table_costs_query('ANALYTICS', 180).split())
+    assert 'SPLIT_PART' not in query
+    assert 't.table_id = obj.value:"objectId"::NUMBER' in query
+    assert "UPPER(t.table_catalog) = UPPER('ANALYTICS')" in query
+    assert 'GROUP BY table_schema, table_name' in query
+
+
+def test_table_costs_keep_quoted_names_with_dots():
+    rows = [
+        {'TABLE_SCHEMA': 'marts', 'TABLE_NAME': 'orders.v2', 'TOTAL_COST_GB': 1.5, 'TOTAL_QUERIES': 3},
+        {'TABLE_NAME': 'staging.events', 'TOTAL_COST_GB': 0.5, 'TOTAL_QUERIES': 1},
+        {'TABLE_NAME': 'temporary_table', 'TOTAL_QUERIES': 1},
+    ]
+    tables = [(row['dataset'], row['table']) for row in snowflake_stats.transform_table_costs(rows)]
+    assert tables == [('marts', 'orders.v2'), ('staging', 'events'), ('system', 'temporary_table')]
+
+
+def test_transient_probe_failure_is_retried_on_the_next_refresh(snowflake, monkeypatch):
+    monkeypatch.setattr(Config, 'SNOWFLAKE_TABLE_ATTRIBUTION', 'auto')
+    probe = snowflake_stats.ACCESS_HISTORY_PROBE
+    suspended = FakeSession(errors={probe: OperationalError(msg='warehouse suspended', errno=250003)})
+    resumed = FakeSession({probe: 1})
+    snowflake.sessions.extend([suspended, resumed])
+
+    assert snowflake_stats.table_attribution(snowflake) == 'regex'
+    assert snowflake.table_attribution is None
+
+    # The failed session was discarded, the next refresh probes again on a new one
+    assert snowflake_stats.table_attribution(snowflake) == 'access_history'
+    assert snowflake_stats.table_attribution(snowflake) == 'access_history'
+    assert resumed.executed == [probe]
+
+
+def test_unreadable_access_history_keeps_the_regex(snowflake, monkeypatch):
+    monkeypatch.setattr(Config, 'SNOWFLAKE_TABLE_ATTRIBUTION', 'auto')
+    probe = snowflake_stats.ACCESS_HISTORY_PROBE
+    denied = ProgrammingError(msg="Object 'ACCESS_HISTORY' does not exist or not authorized.", errno=2003, sqlstate='42S02')
+    session = FakeSession(errors={probe: denied})
+    snowflake.sessions.append(session)
+
+    assert snowflake_stats.table_attribution(snowflake) == 'regex'
+    assert snowflake_stats.table_attribution(snowflake) == 'regex'
+    assert snowflake.table_attribution == 'regex'
+    assert session.executed.count(probe) == 1
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from app.config import Config
+from app.datawarehouse_stats import stats_metrics
+from app.datawarehouse_stats.stats_metrics import (
+    assemble_stats, get_metric_schedule, metric_cache_key, metric_inflight_key, store_metric_result
+)
+
+
+@pytest.fixture(autouse=True)
+def no_schedule_overrides(monkeypatch):
+    monkeypatch.setattr(Config, 'STATS_METRIC_SCHEDULES', {})
+
+
+def test_schedule_defaults_and_overrides(monkeypatch):
+    assert get_metric_schedule('bigquery', 'table_count') == {'interval': 3600, 'ttl': 86400}
+    # Built-in adapter override, then the STATS_METRIC_SCHEDULES setting on top
+    assert get_metric_schedule('fabric', 'total_query_executed') == {'interval': 86400, 'ttl': 172800}
+    monkeypatch.setattr(Config, 'STATS_METRIC_SCHEDULES', {'fabric': {'total_query_executed': {'ttl': 5}}})
+    assert get_metric_schedule('fabric', 'total_query_executed') == {'interval': 86400, 'ttl': 5}
+
+
+def test_successful_refresh_is_cached_under_its_own_key(cache):
+    entry = store_metric_result(cache, 'bigquery', 'table_count', 42, None, 1.25)
+    assert entry['value'] == 42 and entry['last_success'] and entry['error'] is None
+    assert cache.get(metric_cache_key('bigquery', 'table_count')) == entry
+    assert cache.get(metric_cache_key('bigquery', 'dataset_count')) is None
+
+
+def test_failed_refresh_keeps_the_last_value(cache):
+    first = store_metric_result(cache, 'bigquery', 'table_count', 42, None, 1.0)
+    entry = store_metric_result(cache, 'bigquery', 'table_count', None, 'timeout', 2.0)
+    assert entry['value'] == 42
+    assert entry['last_success'] == first['last_success']
+    assert entry['error'] == 'timeout'
+
+
+def test_failure_before_the_final_attempt_leaves_the_cache_untouched(cache):
+    cache.set(metric_inflight_key('bigquery', 'table_count'), {'started_at': 'now'})
+    store_metric_result(cache, 'bigquery', 'table_count', None, 'timeout', 2.0, final_attempt=False)
+    assert cache.get(metric_cache_key('bigquery', 'table_count')) is None
+    assert cache.get(metric_inflight_key('bigquery', 'table_count')) is not None
+
+
+def test_assemble_stats_flags_stale_and_missing_metrics():
+    now = datetime.now(timezone.utc)
+    entries = {
+        'table_count': {'value': 3, 'last_success': now.isoformat()},
+        'dataset_count': {'value': 1, 'last_success': (now - timedelta(days=1)).isoformat()},
+    }
+    stats_data, freshness = assemble_stats('bigquery', entries)
+    assert stats_data['table_count'] == 3 and not freshness['table_count']['stale']
+    assert freshness['dataset_count']['stale']
+    assert freshness['total_query_executed']['stale'] and stats_data['total_query_executed'] is None
+    # Charts and tables default to an empty JSON list for the page scripts
+    assert stats_data['total_cost_gb_by_table'] == '[]'
+    assert freshness['total_cost_gb_by_table']['section'] == 'tables'
+
+
+def test_metrics_are_collected_with_their_own_collector(monkeypatch):
+    adapter = stats_metrics.get_adapter('bigquery')
+    monkeypatch.setattr(adapter, '_module', type('Module', (), {'get_table_count': staticmethod(lambda: 7)})())
+    monkeypatch.setattr(Config, 'STATS_ROLLUP_ENABLED', False)
+    assert stats_metrics.collect_metric('bigquery', 'table_count') == 7
+
+
+def test_windowed_metrics_are_cached_per_non_default_window(monkeypatch):
+    monkeypatch.setattr(Config, 'STATS_ROLLUP_ENABLED', False)
+    monkeypatch.setattr(Config, 'BIGQUERY_STATS_WINDOW_DAYS', 180)
+    assert stats_metrics.resolve_window('bigquery', 'total_query_executed', 30) == 30
+    assert stats_metrics.resolve_window('bigquery', 'total_query_executed', 180) is None
+    # Metadata counts and warehouses without a window ignore it
+    assert stats_metrics.resolve_window('bigquery', 'table_count', 30) is None
+    assert stats_metrics.resolve_window('snowflake', 'total_query_executed', 30) is None
+    assert metric_cache_key('bigquery', 'total_query_executed', 30) == 'dwh_stats_bigquery_total_query_executed_30d'
+    assert metric_cache_key('bigquery', 'total_query_executed', 180) == 'dwh_stats_bigquery_total_query_executed'
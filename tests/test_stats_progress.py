@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from app import tasks
+from app.config import Config
+from app.datawarehouse_stats.stats_metrics import (
+    STATS_METRICS, get_stats_progress, metric_duration_key, metric_inflight_key, queue_metric_refresh,
+    store_metric_result
+)
+
+
+@pytest.fixture
+def dispatched(monkeypatch):
+    calls = []
+    monkeypatch.setattr(tasks, 'dispatch_stats_refresh', lambda dwh_type, metrics, **kwargs: calls.append((dwh_type, metrics, kwargs)))
+    monkeypatch.setattr(Config, 'STATS_METRIC_SCHEDULES', {})
+    return calls
+
+
+def test_queue_metric_refresh_sets_inflight_markers_and_dispatches_once(cache, dispatched):
+    assert queue_metric_refresh(cache, 'bigquery', ['table_count', 'dataset_count']) == ['table_count', 'dataset_count']
+    assert cache.get(metric_inflight_key('bigquery', 'table_count'))['started_at']
+    assert dispatched == [('bigquery', ['table_count', 'dataset_count'], {'release_lock': False, 'window_days': None})]
+
+
+def test_queued_metrics_are_joined_instead_of_queued_again(cache, dispatched):
+    queue_metric_refresh(cache, 'bigquery', ['table_count'])
+    assert queue_metric_refresh(cache, 'bigquery', ['table_count', 'dataset_count']) == ['dataset_count']
+    assert queue_metric_refresh(cache, 'bigquery', ['table_count', 'dataset_count']) == []
+    assert len(dispatched) == 2
+
+
+def test_progress_starts_missing_metrics_and_reports_them_pending(cache, dispatched):
+    store_metric_result(cache, 'bigquery', 'table_count', 12, None, 0.5)
+    progress = get_stats_progress(cache, 'bigquery')
+
+    assert progress['status'] == 'running'
+    assert progress['metrics']['table_count']['status'] == 'ready'
+    assert progress['metrics']['table_count']['value'] == 12
+    assert progress['metrics']['dataset_count']['status'] == 'pending'
+    (_, queued, _), = dispatched
+    assert set(queued) == set(STATS_METRICS) - {'table_count'}
+
+
+def test_progress_estimates_pending_metrics_from_their_last_duration(cache, dispatched):
+    started_at = (datetime.now(timezone.utc) - timedelta(seconds=10)).isoformat()
+    cache.set(metric_inflight_key('bigquery', 'dataset_count'), {'started_at': started_at})
+    cache.set(metric_duration_key('bigquery', 'dataset_count'), 30.0)
+    eta = get_stats_progress(cache, 'bigquery')['metrics']['dataset_count']['eta_seconds']
+    assert 19 <= eta <= 20
+
+
+def test_progress_is_complete_once_every_metric_is_cached(cache, dispatched):
+    for metric in STATS_METRICS:
+        store_metric_result(cache, 'bigquery', metric, None, 'boom', 0.1)
+    progress = get_stats_progress(cache, 'bigquery')
+    assert progress['status'] == 'complete'
+    assert {item['status'] for item in progress['metrics'].values()} == {'failed'}
+    assert dispatched == []
+
+
+def test_unsupported_warehouse_reports_an_error(cache, dispatched):
+    assert get_stats_progress(cache, 'oracle')['error'] == 'Unsupported data warehouse type: oracle'
@@ -0,0 +1,162 @@
+import pytest
+from flask import Flask
+from app import tasks
+from app.celery_app import celery
+from app.config import Config
+from app.datawarehouse_stats import stats_metrics
+from app.datawarehouse_stats.stats_metrics import BUDGET_EXCEEDED, last_refresh_key
+
+
+@pytest.fixture
+def eager(cache, monkeypatch):
+    """Run the stats tasks inline against the fakeredis cache."""
+    monkeypatch.setattr(celery.conf, 'task_always_eager', True)
+    def get_cache():
+        app = Flask(__name__)
+        app.config.from_object(Config)
+        return app, cache
+    monkeypatch.setattr(tasks, 'get_cache', get_cache)
+    monkeypatch.setattr(Config, 'STATS_METRIC_SCHEDULES', {})
+    monkeypatch.setattr(Config, 'BIGQUERY_STATS_MODE', 'per_metric')
+    return cache
+
+
+def fake_refresh(errors, calls):
+    def refresh_metric(cache, dwh_type, metric, final_attempt=True, window_days=None, refresh_id=None):
+        calls.append(final_attempt)
+        error = errors.pop(0) if errors else None
+        return {'value': None if error else 1, 'last_success': None if error else 'now', 'error': error, 'duration_seconds': 0.1}
+    return refresh_metric
+
+
+def test_failed_metric_is_retried_until_the_final_attempt(eager, monkeypatch):
+    calls = []
+    monkeypatch.setattr(stats_metrics, 'refresh_metric', fake_refresh(['timeout'] * 10, calls))
+    result = tasks.refresh_stats_metric.apply(args=('bigquery', 'table_count')).get()
+    assert calls == [False] * Config.STATS_METRIC_MAX_RETRIES + [True]
+    assert result['error'] == 'timeout'
+
+
+def test_metric_recovering_on_retry_succeeds(eager, monkeypatch):
+    calls = []
+    monkeypatch.setattr(stats_metrics, 'refresh_metric', fake_refresh(['timeout'], calls))
+    result = tasks.refresh_stats_metric.apply(args=('bigquery', 'table_count')).get()
+    assert len(calls) == 2 and result['error'] is None
+
+
+def test_budget_refusals_are_not_retried(eager, monkeypatch):
+    calls = []
+    monkeypatch.setattr(stats_metrics, 'refresh_metric', fake_refresh([f'{BUDGET_EXCEEDED}: too big'] * 10, calls))
+    tasks.refresh_stats_metric.apply(args=('bigquery', 'table_count')).get()
+    assert len(calls) == 1
+
+
+def test_metric_task_never_raises_past_its_retries(eager, monkeypatch):
+    def broken(*args, **kwargs):
+        raise RuntimeError('no cache')
+    monkeypatch.setattr(stats_metrics, 'refresh_metric', broken)
+    result = tasks.refresh_stats_metric.apply(args=('bigquery', 'table_count')).get()
+    assert result == {'metric': 'table_count', 'last_success': None, 'error': 'no cache'}
+
+
+def test_metric_tasks_get_the_warehouse_time_limit(monkeypatch):
+    monkeypatch.setattr(Config, 'STATS_WAREHOUSE_TIME_LIMITS', {'snowflake': 900})
+    signature = tasks.metric_task_signature('snowflake', 'table_count')
+    assert signature.options['soft_time_limit'] == 900 and signature.options['time_limit'] == 960
+
+
+def test_chord_finalizer_records_the_refresh_summary(eager, monkeypatch):
+    calls = []
+    monkeypatch.setattr(stats_metrics, 'refresh_metric', fake_refresh([], calls))
+    eager.set(tasks.cache_dwh_stats_lock_key('bigquery'), {'node': 'test'})
+
+    tasks.dispatch_stats_refresh('bigquery', ['table_count', 'dataset_count'], release_lock=True)
+
+    summary = eager.get(last_refresh_key('bigquery'))
+    assert sorted(summary['metrics']) == ['dataset_count', 'table_count']
+    assert summary['failed'] == []
+    assert eager.get(tasks.cache_dwh_stats_lock_key('bigquery')) is None
+
+
+def test_cache_dwh_stats_skips_a_warehouse_already_refreshing(eager, monkeypatch):
+    queued = []
+    monkeypatch.setattr(Config, 'FASTBI_PLATFORM_DWH_LIST', ['bigquery'])
+    monkeypatch.setattr(stats_metrics, 'queue_metric_refresh', lambda cache, dwh_type, metrics, release_lock=False: queued.append(dwh_type) or metrics)
+
+    assert tasks.cache_dwh_stats.apply().get()['bigquery']
+    assert tasks.cache_dwh_stats.apply().get() == {'bigquery': None}
+    assert queued == ['bigquery']
+    assert eager.get(tasks.cache_dwh_stats_lock_key('bigquery'))['node']
+
+
+def test_cache_dwh_stats_releases_the_lock_when_nothing_was_queued(eager, monkeypatch):
+    monkeypatch.setattr(Config, 'FASTBI_PLATFORM_DWH_LIST', ['bigquery'])
+    monkeypatch.setattr(stats_metrics, 'queue_metric_refresh', lambda cache, dwh_type, metrics, release_lock=False: [])
+    tasks.cache_dwh_stats.apply().get()
+    assert eager.get(tasks.cache_dwh_stats_lock_key('bigquery')) is None
+
+
+def test_each_warehouse_has_its_own_refresh_lock(eager, monkeypatch):
+    queued = []
+    monkeypatch.setattr(Config, 'FASTBI_PLATFORM_DWH_LIST', ['bigquery', 'snowflake'])
+    monkeypatch.setattr(stats_metrics, 'queue_metric_refresh', lambda cache, dwh_type, metrics, release_lock=False: queued.append(dwh_type) or metrics)
+    eager.set(tasks.cache_dwh_stats_lock_key('bigquery'), {'node': 'other'})
+
+    results = tasks.cache_dwh_stats.apply().get()
+    assert results['bigquery'] is None and results['snowflake']
+    assert queued == ['snowflake']
+
+
+def test_inflight_markers_cover_each_warehouse_time_limit(monkeypatch):
+    monkeypatch.setattr(Config, 'STATS_WAREHOUSE_TIME_LIMITS', {'snowflake': 900})
+    monkeypatch.setattr(Config, 'STATS_METRIC_TIME_LIMIT', 600)
+    assert stats_metrics.get_inflight_timeout('snowflake') > stats_metrics.get_inflight_timeout('bigquery')
+    assert stats_metrics.metric_cache_key('snowflake', 'table_count') != stats_metrics.metric_cache_key('bigquery', 'table_count')
+
+
+class RecordingBeat:
+    def __init__(self):
+        self.tasks = {}
+
+    def add_periodic_task(self, interval, signature, name=None):
+        self.tasks[name] = (interval, signature)
+
+
+def beat_schedule(monkeypatch, dwh_type):
+    monkeypatch.setattr(Config, 'STATS_METRIC_SCHEDULES', {})
+    monkeypatch.setattr(Config, 'STATS_ROLLUP_ENABLED', False)
+    monkeypatch.setattr(Config, 'FASTBI_PLATFORM_DWH_LIST', [dwh_type])
+    beat = RecordingBeat()
+    tasks.setup_periodic_tasks(beat)
+    return {name: interval for name, (interval, _) in beat.tasks.items()}
+
+
+def test_per_metric_warehouse_schedules_every_metric_on_its_interval(monkeypatch):
+    monkeypatch.setattr(Config, 'SNOWFLAKE_STATS_BATCHED', False)
+    schedule = beat_schedule(monkeypatch, 'snowflake')
+    assert len(schedule) == len(stats_metrics.STATS_METRICS)
+    # The adapter's schedule overrides apply, query cards follow ACCOUNT_USAGE latency
+    assert schedule['refresh_stats_snowflake_total_query_executed'] == 3600
+    assert schedule['refresh_stats_snowflake_total_cost_gb_by_table'] == 43200
+
+
+def test_batched_warehouse_runs_the_batch_at_the_table_tier(monkeypatch):
+    monkeypatch.setattr(Config, 'SNOWFLAKE_STATS_BATCHED', True)
+    schedule = beat_schedule(monkeypatch, 'snowflake')
+    assert schedule.pop('refresh_stats_snowflake_batch') == 43200
+    # Faster metrics are refreshed on their own in between, the table tier only by the batch
+    assert 'refresh_stats_snowflake_total_cost_gb_by_table' not in schedule
+    assert schedule['refresh_stats_snowflake_table_count'] == 3600
+    assert schedule['refresh_stats_snowflake_total_cost_gb_by_users'] == 21600
+    assert all(interval < 43200 for interval in schedule.values())
+
+
+def test_batch_follows_the_schedule_overrides(monkeypatch):
+    monkeypatch.setattr(Config, 'REDSHIFT_STATS_BATCHED', True)
+    monkeypatch.setattr(Config, 'REDSHIFT_STATS_SUMMARY', False)
+    monkeypatch.setattr(Config, 'FASTBI_PLATFORM_DWH_LIST', ['redshift'])
+    monkeypatch.setattr(Config, 'STATS_ROLLUP_ENABLED', False)
+    monkeypatch.setattr(Config, 'STATS_METRIC_SCHEDULES', {'redshift': {metric: {'interval': 3600} for metric in stats_metrics.STATS_METRICS}})
+    beat = RecordingBeat()
+    tasks.setup_periodic_tasks(beat)
+    assert {name: interval for name, (interval, _) in beat.tasks.items()} == {'refresh_stats_redshift_batch': 3600}